@@ -1,15 +1,9 @@
 import streamlit as st
-
-# 初始化 session state
-if 'recipe_name' not in st.session_state:
-    st.session_state.recipe_name = ""  # 配方名称
-if 'ingredients' not in st.session_state:
-    st.session_state.ingredients = []  # 存储原材料列表
-if 'ingredient_counter' not in st.session_state:
-    st.session_state.ingredient_counter = 1  # 追踪添加的原材料数量
-if 'recipe_set' not in st.session_state:
-    st.session_state.recipe_set = False  # 是否设置配方名称
-
+import pandas as pd
+import numpy as np
+from io import BytesIO
+from data_loader import load_upload
+from perf import instrumented, stage
 
 # 单位换算函数：将其他单位转换为克
 def convert_to_grams(value, unit):
@@ -29,6 +23,250 @@ def convert_to_grams(value, unit):
         return value  # 默认返回原始值
 
 
+# 单位换算系数：换算为克（液体按密度1 g/ml，“个”及未知单位保留原值）
+UNIT_TO_GRAMS = {"克": 1, "斤": 500, "公斤": 1000, "毫升": 1, "升": 1000, "个": 1}
+
+# 批量核算所需的列
+RECIPE_COLUMNS = ['配方名称', '原材料名称', '用量', '单位']
+CATALOG_COLUMNS = ['原材料名称', '到货规格', '到货单位', '到货价格']
+
+
+# 向量化的单位换算，与 convert_to_grams 规则一致
+def convert_to_grams_vectorized(values, units):
+    return values.astype(float) * units.map(UNIT_TO_GRAMS).fillna(1).astype(float)
+
+
+# 原材料匹配键：两张表都有“品牌”列时按名称和品牌匹配，否则只按名称匹配
+def ingredient_keys(recipes, catalog):
+    return ['原材料名称', '品牌'] if '品牌' in recipes.columns and '品牌' in catalog.columns else ['原材料名称']
+
+
+# 价格表去重（重复时以最后一行为准）并计算每克价格
+def prepare_catalog(catalog, join_keys):
+    missing = [col for col in CATALOG_COLUMNS if col not in catalog.columns]
+    if missing:
+        raise ValueError(f"价格表缺少必要的列：{missing}")
+    catalog = catalog.drop_duplicates(join_keys, keep='last').copy()
+    catalog['每克价格'] = catalog['到货价格'] / convert_to_grams_vectorized(catalog['到货规格'], catalog['到货单位'])
+    # 到货规格为0或价格缺失的原材料无法计算成本
+    catalog.loc[~(catalog['到货规格'] > 0), '每克价格'] = float('nan')
+    return catalog
+
+
+# 批量核算：配方明细与原材料价格表连接后按配方汇总
+def cost_recipes(recipes, catalog):
+    missing = [col for col in RECIPE_COLUMNS if col not in recipes.columns]
+    if missing:
+        raise ValueError(f"配方表缺少必要的列：{missing}")
+
+    join_keys = ingredient_keys(recipes, catalog)
+    catalog = prepare_catalog(catalog, join_keys)
+
+    detail = recipes[RECIPE_COLUMNS + [col for col in join_keys if col not in RECIPE_COLUMNS]].copy()
+    detail['用量(克)'] = convert_to_grams_vectorized(detail['用量'], detail['单位'])
+    catalog_columns = join_keys + ['到货规格', '到货单位', '到货价格', '每克价格']
+    if '品牌' in catalog.columns and '品牌' not in join_keys:
+        catalog_columns.append('品牌')
+    with stage('连接价格表', rows_in=len(detail)) as info:
+        detail = detail.merge(catalog[catalog_columns], on=join_keys, how='left')
+        detail['原材料成本'] = detail['用量(克)'] * detail['每克价格']
+        info.rows_out = len(detail)
+
+    with stage('分组汇总', rows_in=len(detail)) as info:
+        totals = detail.groupby('配方名称', sort=False).agg(
+            总成本=('原材料成本', 'sum'),
+            原材料数=('原材料名称', 'size'),
+            缺少价格数=('原材料成本', lambda x: int(x.isna().sum()))
+        ).reset_index()
+        info.rows_out = len(totals)
+
+    return detail, totals
+
+
+# 缺少有效价格、未计入成本的原材料
+def missing_prices(detail):
+    return detail.loc[detail['原材料成本'].isna(), ['配方名称', '原材料名称']].drop_duplicates()
+
+
+# 反向索引的键：空值统一为 None（NaN 与自身不相等，不能直接作为字典的键查找）
+def ingredient_key(key):
+    if isinstance(key, tuple):
+        return tuple(None if pd.isna(value) else value for value in key)
+    return None if pd.isna(key) else key
+
+
+# 已核算配方的成本簿：维护 原材料 -> 明细行 的反向索引，价格变动时只重算受影响的配方
+class RecipeCostBook:
+    def __init__(self, recipes, catalog):
+        self.join_keys = ingredient_keys(recipes, catalog)
+        self.detail, totals = cost_recipes(recipes, catalog)
+        self.totals = totals.set_index('配方名称')
+        # 品牌等匹配列为空的明细也要建立索引：完整核算的 merge 中空值与空值相互匹配
+        self.ingredient_rows = {
+            ingredient_key(key): rows
+            for key, rows in self.detail.groupby(self.join_keys, sort=False, dropna=False).indices.items()
+        }
+
+    def update_prices(self, new_catalog):
+        """按新价格表更新受影响的明细和配方总成本，返回每个配方的成本变化"""
+        join_keys = [key for key in self.join_keys if key in new_catalog.columns]
+        if join_keys != self.join_keys:
+            raise ValueError(f"新价格表缺少匹配列：{self.join_keys}")
+        catalog = prepare_catalog(new_catalog, join_keys)
+
+        # 通过反向索引找到使用这些原材料的明细行
+        keys = catalog[join_keys[0]] if len(join_keys) == 1 else catalog[join_keys].itertuples(index=False, name=None)
+        row_groups, price_rows = [], []
+        for position, key in enumerate(keys):
+            rows = self.ingredient_rows.get(ingredient_key(key))
+            if rows is not None:
+                row_groups.append(rows)
+                price_rows.append(np.full(len(rows), position))
+        if not row_groups:
+            return self._impact(pd.DataFrame(columns=['配方名称', '原材料名称', '变化金额', '缺少价格变化']))
+        rows = np.concatenate(row_groups)
+        prices = catalog.iloc[np.concatenate(price_rows)]
+
+        old_cost = self.detail['原材料成本'].to_numpy()[rows]
+        new_cost = self.detail['用量(克)'].to_numpy()[rows] * prices['每克价格'].to_numpy()
+        changed = (np.isnan(old_cost) != np.isnan(new_cost)) | ~np.isclose(
+            np.nan_to_num(old_cost), np.nan_to_num(new_cost), rtol=0, atol=1e-9)
+        rows, prices = rows[changed], prices[changed]
+        old_cost, new_cost = old_cost[changed], new_cost[changed]
+
+        # 更新明细行的价格信息
+        for col in ['到货规格', '到货单位', '到货价格', '每克价格']:
+            self.detail.loc[rows, col] = prices[col].to_numpy()
+        self.detail.loc[rows, '原材料成本'] = new_cost
+
+        return self._impact(pd.DataFrame({
+            '配方名称': self.detail['配方名称'].to_numpy()[rows],
+            '原材料名称': self.detail['原材料名称'].to_numpy()[rows],
+            '变化金额': np.nan_to_num(new_cost) - np.nan_to_num(old_cost),
+            '缺少价格变化': np.isnan(new_cost).astype(int) - np.isnan(old_cost).astype(int)
+        }))
+
+    def _impact(self, changes):
+        """只对受影响的配方累加变化金额，返回影响报告"""
+        impact = changes.groupby('配方名称', sort=False).agg(
+            变化金额=('变化金额', 'sum'),
+            缺少价格变化=('缺少价格变化', 'sum'),
+            涉及原材料=('原材料名称', lambda x: '、'.join(pd.unique(x.astype(str))))
+        )
+        old_total = self.totals.loc[impact.index, '总成本']
+        self.totals.loc[impact.index, '总成本'] = old_total + impact['变化金额']
+        self.totals.loc[impact.index, '缺少价格数'] += impact['缺少价格变化']
+
+        report = pd.DataFrame({
+            '配方名称': impact.index,
+            '原总成本': old_total.round(2).to_numpy(),
+            '新总成本': self.totals.loc[impact.index, '总成本'].round(2).to_numpy(),
+            '变化金额': impact['变化金额'].round(2).to_numpy(),
+            '涉及原材料': impact['涉及原材料'].to_numpy()
+        })
+        report['变化比例'] = (report['变化金额'] / report['原总成本'].where(report['原总成本'] != 0)).round(4)
+        return report.sort_values('变化金额', key=abs, ascending=False).reset_index(drop=True)
+
+
+# 初始化 session state
+def init_session_state():
+    if 'recipe_name' not in st.session_state:
+        st.session_state.recipe_name = ""  # 配方名称
+    if 'ingredients' not in st.session_state:
+        st.session_state.ingredients = []  # 存储原材料列表
+    if 'ingredient_counter' not in st.session_state:
+        st.session_state.ingredient_counter = 1  # 追踪添加的原材料数量
+    if 'recipe_set' not in st.session_state:
+        st.session_state.recipe_set = False  # 是否设置配方名称
+
+
+# 核算结果的各工作表：配方成本汇总、原材料成本明细、缺少价格，有价格变动时附加影响报告
+def costing_sheets(book, impact=None):
+    totals = book.totals.reset_index()
+    totals['总成本'] = totals['总成本'].round(2)
+    sheets = {
+        '配方成本汇总': totals,
+        '原材料成本明细': book.detail,
+        '缺少价格': missing_prices(book.detail)
+    }
+    if impact is not None:
+        sheets['价格变动影响'] = impact
+    return sheets
+
+
+# 将各工作表写入Excel
+def to_excel(sheets):
+    output = BytesIO()
+    with stage('导出Excel', rows_in=sum(len(df) for df in sheets.values())), \
+            pd.ExcelWriter(output, engine='openpyxl') as writer:
+        for sheet_name, df in sheets.items():
+            df.to_excel(writer, index=False, sheet_name=sheet_name)
+    return output.getvalue()
+
+
+# 批量核算界面
+def batch_costing():
+    st.write("配方表需包含列：配方名称、原材料名称、用量、单位（可选：品牌）")
+    st.write("价格表需包含列：原材料名称、到货规格、到货单位、到货价格（可选：品牌）")
+    recipes_file = st.file_uploader("上传配方表", type=["xlsx", "xls", "csv"], key="recipes_file")
+    catalog_file = st.file_uploader("上传原材料价格表", type=["xlsx", "xls", "csv"], key="catalog_file")
+
+    if recipes_file is None or catalog_file is None:
+        st.info("请上传配方表和原材料价格表")
+        return
+
+    # 同一组文件只核算一次，成本簿保存在当前会话中
+    book_key = (recipes_file.file_id, catalog_file.file_id)
+    if st.session_state.get('cost_book_key') != book_key:
+        try:
+            st.session_state.cost_book = RecipeCostBook(load_upload(recipes_file, RECIPE_COLUMNS, '配方表'),
+                                                         load_upload(catalog_file, CATALOG_COLUMNS, '价格表'))
+        except Exception as e:
+            st.error(f"核算失败：{e}")
+            return
+        st.session_state.cost_book_key = book_key
+        st.session_state.price_impacts = {}
+    book = st.session_state.cost_book
+
+    # 价格变动影响分析：每个新价格表只应用一次
+    st.subheader("价格变动影响分析")
+    price_file = st.file_uploader("上传新的原材料价格表（只需包含价格变动的原材料）",
+                                  type=["xlsx", "xls", "csv"], key="price_update_file")
+    impact = None
+    if price_file is not None:
+        if price_file.file_id not in st.session_state.price_impacts:
+            try:
+                new_catalog = load_upload(price_file, CATALOG_COLUMNS, '新价格表')
+                with stage('价格更新', rows_in=len(new_catalog)) as info:
+                    st.session_state.price_impacts[price_file.file_id] = book.update_prices(new_catalog)
+                    info.rows_out = len(st.session_state.price_impacts[price_file.file_id])
+            except Exception as e:
+                st.error(f"价格更新失败：{e}")
+        impact = st.session_state.price_impacts.get(price_file.file_id)
+        if impact is not None:
+            st.write(f"受影响的配方共 {len(impact)} 个")
+            st.dataframe(impact)
+
+    sheets = costing_sheets(book, impact)
+    totals = sheets['配方成本汇总']
+    missing = sheets['缺少价格']
+
+    st.subheader(f"配方成本汇总（共 {len(totals)} 个配方）")
+    st.dataframe(totals)
+    if not missing.empty:
+        st.warning(f"有 {len(missing)} 条原材料未找到有效价格，未计入成本")
+        st.dataframe(missing)
+    with st.expander("原材料成本明细"):
+        st.dataframe(book.detail)
+
+    st.download_button(
+        label="下载核算结果",
+        data=to_excel(sheets),
+        file_name="配方成本核算.xlsx",
+        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+    )
+
+
 # 添加配方名称
 def add_recipe_name():
     recipe_name = st.text_input('请输入配方名称：', value=st.session_state.recipe_name)
@@ -147,7 +385,20 @@ def calculate_cost():
 
 
 # 显示输入界面
-st.title('烘焙产品成本计算')
+@instrumented('app000')
+def main():
+    init_session_state()
+    st.title('烘焙产品成本计算')
+
+    mode = st.radio("核算方式", ["单个配方录入", "批量配方核算"], horizontal=True)
+
+    if mode == "单个配方录入":
+        # 运行原材料添加界面
+        add_ingredient()
+    else:
+        batch_costing()
+
+
+if __name__ == "__main__":
+    main()
 
-# 运行原材料添加界面
-add_ingredient()
@@ -1,91 +1,169 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 import os
+import hashlib
 import logging
+from data_loader import check_columns, parse_dates, read_table
+from perf import instrumented, stage
 
 # 设置日志记录
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# 上传文件的目录
-UPLOAD_FOLDER = 'uploads'
-if not os.path.exists(UPLOAD_FOLDER):
-    os.makedirs(UPLOAD_FOLDER)
+# 必要的列
+REQUIRED_COLUMNS_BASE = ['客户名称', '商品名称', 'm_id', 'BD', 'sku', '下单时间']
+REQUIRED_COLUMNS_MATCH = ['商品名称']
 
-def read_file(file_path):
-    """根据文件扩展名读取文件，支持CSV和XLSX格式。"""
-    _, ext = os.path.splitext(file_path)
+
+def read_file(file_name, data):
+    """根据文件扩展名读取文件内容，支持CSV和XLSX格式（解析结果按内容哈希缓存在磁盘上，各工具共用）。"""
+    _, ext = os.path.splitext(file_name)
     try:
         if ext.lower() == '.csv':
-            df = pd.read_csv(file_path, encoding='utf-8', on_bad_lines='warn')
+            df = read_table(file_name, data, encoding='utf-8', on_bad_lines='warn')
         elif ext.lower() in ['.xlsx', '.xls']:
-            df = pd.read_excel(file_path)
+            df = read_table(file_name, data)
         else:
             raise ValueError(f"不支持的文件格式: {ext}")
         return df
     except Exception as e:
-        logger.error(f"读取文件 {file_path} 时出错: {e}")
+        logger.error(f"读取文件 {file_name} 时出错: {e}")
         raise e
 
-# Streamlit页面标题
-st.title("文件上传与数据匹配工具")
-
-# 上传文件
-st.subheader("请上传基础文件和匹配文件")
 
-base_file = st.file_uploader("上传基础文件 (CSV 或 Excel 格式)", type=['csv', 'xlsx', 'xls'])
-match_file = st.file_uploader("上传匹配文件 (CSV 或 Excel 格式)", type=['csv', 'xlsx', 'xls'])
+@st.cache_data(show_spinner=False, max_entries=8)
+def load_upload(digest, file_name, _data):
+    """读取上传文件：在磁盘缓存之上再按内容哈希缓存在内存中"""
+    return read_file(file_name, _data)
+
+
+def aggregate_latest_orders(df, keys=('客户名称', '商品名称'), first_columns=('m_id', 'BD', 'sku'),
+                            date_col='下单时间'):
+    """
+    单次哈希分组计算每个客户-商品的汇总结果，不再对全表排序。
+    结果与稳定排序 df.sort_values(date_col, kind='stable').groupby(keys).agg(...) 一致：
+    - first_columns 取按日期排序后每组第一个非空值（同一日期按原表顺序）
+    - date_col 取每组最大值
+    - 结果按分组键排序，分组键为空的行不参与汇总
+    改写前用默认的不稳定排序，同一日期有多行时取哪一行的值不确定；现在固定取原表中靠前的一行，
+    因此这类组合的 first_columns 可能与改写前不同，date_col 不受影响。
+    """
+    keys = list(keys)
+    df = df.reset_index(drop=True)
+
+    # 各分组键排序编码后组合为组号，组号的顺序即分组键的排序顺序
+    codes = np.zeros(len(df), dtype=np.int64)
+    valid = np.ones(len(df), dtype=bool)
+    key_uniques = []
+    for key in keys:
+        key_codes, uniques = pd.factorize(df[key], sort=True)
+        valid &= key_codes >= 0
+        codes = codes * len(uniques) + key_codes
+        key_uniques.append(uniques)
+    group_codes, codes = np.unique(codes[valid], return_inverse=True)
+    positions = np.flatnonzero(valid)
+    n_groups = len(group_codes)
+
+    dates = df[date_col].to_numpy(dtype='datetime64[ns]')[valid]
+    date_key = np.where(np.isnat(dates), np.iinfo(np.int64).max, dates.view('i8'))
+
+    # 还原各分组键的取值
+    result = {}
+    remainder = group_codes
+    for key, uniques in reversed(list(zip(keys, key_uniques))):
+        remainder, key_codes = np.divmod(remainder, len(uniques))
+        result[key] = uniques.take(key_codes)
+    result = pd.DataFrame({key: result[key] for key in keys})
+
+    # 每列各自取日期最早（同日期取位置最靠前）的非空值所在行
+    for col in first_columns:
+        notna = df[col].notna().to_numpy()[valid]
+        group_min = np.full(n_groups, np.iinfo(np.int64).max)
+        np.minimum.at(group_min, codes[notna], date_key[notna])
+        is_min = np.flatnonzero(notna & (date_key == group_min[codes]))
+        first_row = np.full(n_groups, len(df))
+        np.minimum.at(first_row, codes[is_min], positions[is_min])
+        # 没有非空值的组取到越界位置，reindex 后为空值
+        result[col] = df[col].reindex(np.where(first_row < len(df), first_row, -1)).to_numpy()
+
+    # 最大日期：取日期最大的任一行的取值，保留原列的日期类型
+    max_key = np.where(np.isnat(dates), np.iinfo(np.int64).min, dates.view('i8'))
+    group_max = np.full(n_groups, np.iinfo(np.int64).min)
+    np.maximum.at(group_max, codes, max_key)
+    is_max = np.flatnonzero(max_key == group_max[codes])
+    max_row = np.zeros(n_groups, dtype=np.int64)
+    np.maximum.at(max_row, codes[is_max], positions[is_max])
+    result[date_col] = df[date_col].take(max_row).to_numpy()
+    return result
+
+
+def match_latest_orders(base_df, match_df):
+    """
+    基础表中购买过匹配表商品的客户，每个客户-商品取一行并给出最后一次下单时间。
+    缺少必要的列时抛出 ValueError；无法解析的下单时间不参与匹配。
+    """
+    missing_base = set(REQUIRED_COLUMNS_BASE) - set(base_df.columns)
+    if missing_base:
+        raise ValueError(f"基础表缺少必要的列: {', '.join(missing_base)}")
+
+    missing_match = set(REQUIRED_COLUMNS_MATCH) - set(match_df.columns)
+    if missing_match:
+        raise ValueError(f"匹配表缺少必要的列: {', '.join(missing_match)}")
+
+    # 确保 '下单时间' 转换为 datetime 类型（缓存结果只读，先复制）
+    base_df = base_df.copy()
+    base_df['下单时间'], _ = parse_dates(base_df['下单时间'])
+
+    # 移除无法解析的日期
+    base_df = base_df.dropna(subset=['下单时间'])
+
+    # 匹配数据
+    with stage('匹配商品', rows_in=len(base_df)) as info:
+        matched_customers = base_df[base_df['商品名称'].isin(match_df['商品名称'])]
 
-# 如果文件上传成功
-if base_file and match_file:
-    try:
-        # 保存上传的文件
-        base_path = os.path.join(UPLOAD_FOLDER, base_file.name)
-        match_path = os.path.join(UPLOAD_FOLDER, match_file.name)
+        # 选择需要的列
+        matched_customers = matched_customers[REQUIRED_COLUMNS_BASE]
+        info.rows_out = len(matched_customers)
 
-        with open(base_path, 'wb') as f:
-            f.write(base_file.getbuffer())
-        with open(match_path, 'wb') as f:
-            f.write(match_file.getbuffer())
+    # 获取每个客户和商品的最后一次下单时间
+    with stage('分组汇总', rows_in=len(matched_customers)) as info:
+        result_df = aggregate_latest_orders(matched_customers)
+        info.rows_out = len(result_df)
 
-        # 读取文件
-        base_df = read_file(base_path)
-        match_df = read_file(match_path)
+    # 重命名 '下单时间' 为 '最后一次下单时间'
+    return result_df.rename(columns={'下单时间': '最后一次下单时间'})
 
-        # 检查必要的列是否存在
-        required_columns_base = {'客户名称', '商品名称', 'm_id', 'BD', 'sku', '下单时间'}
-        required_columns_match = {'商品名称'}
 
-        missing_base = required_columns_base - set(base_df.columns)
-        if missing_base:
-            raise ValueError(f"基础表缺少必要的列: {', '.join(missing_base)}")
+@instrumented('app001')
+def main():
+    # Streamlit页面标题
+    st.title("文件上传与数据匹配工具")
 
-        missing_match = required_columns_match - set(match_df.columns)
-        if missing_match:
-            raise ValueError(f"匹配表缺少必要的列: {', '.join(missing_match)}")
+    # 上传文件
+    st.subheader("请上传基础文件和匹配文件")
 
-        # 确保 '下单时间' 转换为 datetime 类型
-        base_df['下单时间'] = pd.to_datetime(base_df['下单时间'], errors='coerce')
+    base_file = st.file_uploader("上传基础文件 (CSV 或 Excel 格式)", type=['csv', 'xlsx', 'xls'])
+    match_file = st.file_uploader("上传匹配文件 (CSV 或 Excel 格式)", type=['csv', 'xlsx', 'xls'])
 
-        # 移除无法解析的日期
-        base_df = base_df.dropna(subset=['下单时间'])
+    # 如果文件上传成功
+    if not (base_file and match_file):
+        return
 
-        # 匹配数据
-        matched_customers = base_df[base_df['商品名称'].isin(match_df['商品名称'])]
+    try:
+        base_data = base_file.getvalue()
+        match_data = match_file.getvalue()
 
-        # 选择需要的列
-        matched_customers = matched_customers[['客户名称', '商品名称', 'm_id', 'BD', 'sku', '下单时间']]
+        # 检查必要的列是否存在（只读取表头，缺列时无需等待完整解析）
+        check_columns(base_file.name, base_data, REQUIRED_COLUMNS_BASE, '基础表')
+        check_columns(match_file.name, match_data, REQUIRED_COLUMNS_MATCH, '匹配表')
 
-        # 获取每个客户和商品的最后一次下单时间
-        result_df = matched_customers.sort_values('下单时间').groupby(['客户名称', '商品名称']).agg({
-            'm_id': 'first',
-            'BD': 'first',
-            'sku': 'first',
-            '下单时间': 'max'
-        }).reset_index()
+        # 读取文件（按内容哈希缓存，同名文件互不覆盖）
+        base_df = load_upload(hashlib.sha256(base_data).hexdigest(), base_file.name, base_data)
+        match_df = load_upload(hashlib.sha256(match_data).hexdigest(), match_file.name, match_data)
 
-        # 重命名 '下单时间' 为 '最后一次下单时间'
-        result_df = result_df.rename(columns={'下单时间': '最后一次下单时间'})
+        # 表头无法单独读取时，匹配前在完整解析后再检查一次
+        result_df = match_latest_orders(base_df, match_df)
 
         # 检查结果是否为空
         if result_df.empty:
@@ -95,14 +173,10 @@ if base_file and match_file:
             st.write("匹配结果如下：")
             st.dataframe(result_df)
 
-            # 保存结果
-            result_path = os.path.join(UPLOAD_FOLDER, 'matched_results.csv')
-            result_df.to_csv(result_path, index=False, encoding='utf-8-sig')
-
-            # 提供下载链接
+            # 提供下载链接（结果只在内存中生成，不写入共享目录）
             st.download_button(
                 label="下载匹配结果",
-                data=open(result_path, 'rb').read(),
+                data=result_df.to_csv(index=False).encode('utf-8-sig'),
                 file_name='matched_results.csv',
                 mime='text/csv'
             )
@@ -110,3 +184,7 @@ if base_file and match_file:
     except Exception as e:
         logger.error(f"处理文件时出错: {e}")
         st.error(f"发生错误: {e}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,268 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
+import hashlib
+import os
 from datetime import datetime, timedelta
 from io import BytesIO
-
+from data_loader import check_columns, files_digest, load_tables, parse_dates, read_table
+from perf import instrumented, stage
+
+
+# 定义可能的列名
+SKU_COLUMNS = ['sku_id', 'sku']
+ORDER_DATE_COLUMNS = ['订单日期', '下单时间']
+BD_COLUMNS = ['BD', 'bd_name']
+REQUIRED_ORIGINAL_COLUMNS = {'客户名称', '商品名称', 'sku_id', 'BD', 'order_date'}
+REQUIRED_MATCHING_COLUMNS = {'客户名称'}
+# 只读取表头时的必要列校验（候选列名任一存在即可）
+ORIGINAL_COLUMN_SPEC = [tuple(SKU_COLUMNS), tuple(ORDER_DATE_COLUMNS), tuple(BD_COLUMNS), '客户名称', '商品名称']
+# 多个文件合并前统一的列名
+ORIGINAL_ALIASES = {'sku_id': SKU_COLUMNS, 'order_date': ORDER_DATE_COLUMNS, 'BD': BD_COLUMNS}
+# 读取时的列类型：重复度高的字符串列用 category，ID 列按取值范围降为较小的整数类型
+ORIGINAL_DTYPES = {
+    '客户名称': 'category', '商品名称': 'category', 'BD': 'category', 'bd_name': 'category',
+    'sku_id': 'integer', 'sku': 'integer', 'm_id': 'integer'
+}
+
+# 流式模式每次读取的行数
+STREAM_CHUNK_ROWS = 500_000
+# 服务器上存放超大 CSV 的目录，页面只能选择该目录中的文件分块读取；未设置时页面不提供服务器文件这一数据来源
+STREAM_DATA_DIR = os.environ.get('STREAM_DATA_DIR') or None
+
+
+def resolve_columns(columns):
+    """
+    根据原始数据表的列名确定重命名规则。
+    返回 (重命名字典, 提示信息列表, 是否包含 m_id)；缺少必要列时抛出 ValueError。
+    """
+    rename_map = {}
+    messages = []
+
+    # 重命名 'sku' 或 'sku_id' 为 'sku_id'
+    sku_present = [col for col in SKU_COLUMNS if col in columns]
+    if sku_present:
+        rename_map[sku_present[0]] = 'sku_id'
+        if sku_present[0] != 'sku_id':
+            messages.append(('info', f"将列 '{sku_present[0]}' 重命名为 'sku_id'。"))
+    else:
+        raise ValueError("原始数据表缺少 'sku_id' 或 'sku' 列。")
+
+    # 重命名 '订单日期' 或 '下单时间' 为 'order_date'
+    # 多个文件合并时已统一为 'order_date'
+    order_date_present = [col for col in ['order_date'] + ORDER_DATE_COLUMNS if col in columns]
+    if order_date_present:
+        rename_map[order_date_present[0]] = 'order_date'
+        if order_date_present[0] != 'order_date':
+            messages.append(('info', f"将列 '{order_date_present[0]}' 重命名为 'order_date'。"))
+    else:
+        raise ValueError("原始数据表缺少 '订单日期' 或 '下单时间' 列。")
+
+    # 重命名 'bd_name' 为 'BD'（如果存在）
+    bd_present = [col for col in BD_COLUMNS if col in columns]
+    if bd_present:
+        rename_map[bd_present[0]] = 'BD'
+        if bd_present[0] != 'BD':
+            messages.append(('info', f"将列 '{bd_present[0]}' 重命名为 'BD'。"))
+    else:
+        messages.append(('warning', "原始数据表中未找到 'BD' 或 'bd_name' 列。"))
+
+    # 确保必要的列存在
+    missing_original_cols = REQUIRED_ORIGINAL_COLUMNS - {rename_map.get(col, col) for col in columns}
+    if missing_original_cols:
+        raise ValueError(f"原始数据表缺少以下必要列：{missing_original_cols}")
+
+    # 检查是否存在“m_id”列
+    has_m_id = 'm_id' in columns
+    if has_m_id:
+        messages.append(('info', "检测到 'm_id' 列，将包含在结果中。"))
+    else:
+        messages.append(('info', "未检测到 'm_id' 列，结果中将不包含该列。"))
+
+    return rename_map, messages, has_m_id
+
+
+def read_matching_customers(matching):
+    """读取客户匹配表中的客户名称"""
+    check_columns(*matching, sorted(REQUIRED_MATCHING_COLUMNS), '客户匹配表')
+    matching_df = read_table(*matching)
+
+    # 确保匹配表中必要的列存在
+    missing_matching_cols = REQUIRED_MATCHING_COLUMNS - set(matching_df.columns)
+    if missing_matching_cols:
+        raise ValueError(f"客户匹配表缺少以下必要列：{missing_matching_cols}")
+    return matching_df['客户名称']
+
+
+def reduce_latest(orders):
+    """每个客户-商品保留最新的一行，结果按 order_date 升序排列（NaT 在最后）"""
+    return orders.sort_values('order_date', kind='stable').drop_duplicates(['客户名称', '商品名称'], keep='last')
+
+
+def read_latest_orders(original, matching=None, max_workers=None):
+    """
+    读取原始数据表（original 为 [(文件名, 内容), ...]）和可选的客户匹配表 (文件名, 内容)，
+    计算每个客户-商品的最新订单。
+    返回 (按 order_date 升序排列的最新订单表, 有效日期的行数, 提示信息列表, 是否包含 m_id)；
+    缺少必要列时抛出 ValueError。
+    """
+    # 先只读取表头校验必要列，缺列时立即报错，不必等待整个文件解析完成
+    if matching is not None:
+        check_columns(*matching, sorted(REQUIRED_MATCHING_COLUMNS), '客户匹配表')
+
+    # 多个原始数据文件并行解析后合并：只读取需要的列，各文件的列名先统一再合并，并按 ORIGINAL_DTYPES 压缩列类型
+    original_df = load_tables(original, ORIGINAL_COLUMN_SPEC, '原始数据表', columns=['m_id'],
+                              dtypes=ORIGINAL_DTYPES, aliases=ORIGINAL_ALIASES, max_workers=max_workers)
+    rename_map, messages, has_m_id = resolve_columns(original_df.columns)
+    original_df.rename(columns=rename_map, inplace=True)
+
+    # 读取并处理客户匹配表（如果上传）
+    if matching is not None:
+        # 筛选需要匹配的客户
+        matched_customers = original_df[original_df['客户名称'].isin(read_matching_customers(matching))].copy()
+        messages.append(('success', "已根据客户匹配表筛选客户。"))
+    else:
+        # 如果未上传匹配表，则使用所有客户
+        matched_customers = original_df.copy()
+        messages.append(('info', "未上传客户匹配表，将分析所有客户的数据。"))
+
+    # 转换订单日期为datetime格式（只解析去重后的日期取值）
+    matched_customers['order_date'], invalid_dates = parse_dates(matched_customers['order_date'])
+
+    # 检查日期转换是否有NaT值
+    if matched_customers['order_date'].isnull().any():
+        messages.append(('warning', f"部分订单日期格式不正确（无法解析 {invalid_dates} 条），已被转换为NaT。请检查数据。"))
+
+    # 获取每个客户-商品的最新订单日期以及对应的sku_id和BD
+    # 结果按 order_date 升序排列，任意阈值的不活跃组合都是开头的一段连续行
+    with stage('汇总最新订单', rows_in=len(matched_customers)) as info:
+        latest_orders = reduce_latest(matched_customers).reset_index(drop=True)
+        info.rows_out = len(latest_orders)
+    valid_count = int(latest_orders['order_date'].notna().sum())
+
+    return latest_orders, valid_count, messages, has_m_id
+
+
+# 按所有上传内容的组合哈希缓存，调整阈值时直接使用缓存结果
+@st.cache_resource(show_spinner="正在读取并汇总最新订单...", max_entries=4)
+def build_latest_orders(file_key, _original, _matching):
+    return read_latest_orders(_original, _matching)
+
+
+def scan_latest_orders(csv_path, matching=None, chunksize=STREAM_CHUNK_ROWS):
+    """
+    分块读取超大 CSV：只读取需要的列，每块并入当前的最新订单表后立即归约，
+    内存占用取决于客户-商品组合数而不是订单行数。返回值与 read_latest_orders 相同。
+    """
+    # 只读取表头确定列名，正文只读取需要的列
+    header = pd.read_csv(csv_path, nrows=0).columns
+    rename_map, messages, has_m_id = resolve_columns(header)
+    needed = set(rename_map) | {'客户名称', '商品名称', 'BD', 'm_id'}
+    usecols = [col for col in header if col in needed]
+
+    customers = read_matching_customers(matching) if matching is not None else None
+    if customers is not None:
+        messages.append(('success', "已根据客户匹配表筛选客户。"))
+    else:
+        messages.append(('info', "未上传客户匹配表，将分析所有客户的数据。"))
+
+    latest_orders = None
+    has_invalid_dates = False
+    invalid_dates = 0
+    rows_read = 0
+    with stage('分块读取汇总') as info:
+        for chunk in pd.read_csv(csv_path, usecols=usecols, chunksize=chunksize):
+            rows_read += len(chunk)
+            chunk = chunk.rename(columns=rename_map)
+            if customers is not None:
+                chunk = chunk[chunk['客户名称'].isin(customers)]
+            chunk['order_date'], chunk_invalid = parse_dates(chunk['order_date'])
+            invalid_dates += chunk_invalid
+            has_invalid_dates = has_invalid_dates or chunk['order_date'].isnull().any()
+            # 已有结果在前、新块在后，稳定排序后保留最后一行，与一次性读取的结果一致
+            latest_orders = reduce_latest(chunk if latest_orders is None else pd.concat([latest_orders, chunk]))
+        info.rows_in = rows_read
+        info.rows_out = 0 if latest_orders is None else len(latest_orders)
+
+    if has_invalid_dates:
+        messages.append(('warning', f"部分订单日期格式不正确（无法解析 {invalid_dates} 条），已被转换为NaT。请检查数据。"))
+
+    if latest_orders is None:
+        latest_orders = pd.DataFrame(columns=[rename_map.get(col, col) for col in usecols])
+    latest_orders = latest_orders.reset_index(drop=True)
+    valid_count = int(latest_orders['order_date'].notna().sum())
+
+    return latest_orders, valid_count, messages, has_m_id
+
+
+# 按文件路径、修改时间和大小缓存
+@st.cache_resource(show_spinner="正在分块读取大文件...", max_entries=4)
+def stream_latest_orders(file_key, csv_path, _matching, chunksize=STREAM_CHUNK_ROWS):
+    return scan_latest_orders(csv_path, _matching, chunksize)
+
+
+def list_stream_files(root):
+    """数据目录（含子目录）中的 CSV 文件，返回相对路径列表"""
+    files = []
+    for directory, _, names in os.walk(root):
+        files += [os.path.relpath(os.path.join(directory, name), root) for name in names
+                  if name.lower().endswith('.csv')]
+    return sorted(files)
+
+
+def resolve_stream_path(root, name):
+    """数据目录中文件的实际路径；解析符号链接和 .. 后不在数据目录中时抛出 ValueError"""
+    root = os.path.realpath(root)
+    path = os.path.realpath(os.path.join(root, name))
+    if os.path.commonpath([root, path]) != root:
+        raise ValueError(f"只能读取数据目录中的文件：{name}")
+    return path
+
+
+def count_inactive(latest_dates, threshold_days, current_date):
+    """已排序的最新订单日期中，早于阈值日期的组合数（二分查找）"""
+    threshold_date = np.datetime64(current_date - timedelta(days=int(threshold_days)), 'ns')
+    return int(np.searchsorted(latest_dates, threshold_date, side='left'))
+
+
+def select_inactive(latest_orders, valid_count, has_m_id, threshold_days, current_date):
+    """超过阈值天数未购买的客户-商品组合，列名 order_date 改为“最后一次购买日期”"""
+    latest_dates = latest_orders['order_date'].to_numpy(dtype='datetime64[ns]')[:valid_count]
+    inactive_count = count_inactive(latest_dates, threshold_days, current_date)
+
+    # 筛选超过阈值未购买的商品（按日期排序后取开头的连续行）
+    inactive_products = latest_orders.iloc[:inactive_count]
+
+    # 选择需要的列
+    result_columns = ['客户名称', '商品名称', 'sku_id', 'BD', 'order_date']
+    if has_m_id:
+        result_columns.append('m_id')
+    inactive_products = inactive_products[result_columns]
+
+    # 重命名“order_date”以明确表示是最后一次购买时间
+    return inactive_products.rename(columns={'order_date': '最后一次购买日期'})
+
+
+@instrumented('app002')
 def main():
     st.title("客户商品购买分析工具")
 
     st.sidebar.header("上传文件")
 
-    # 上传原始数据表
-    original_file = st.sidebar.file_uploader("上传原始数据表（Excel 或 CSV）", type=["xlsx", "xls", "csv"])
+    # 数据来源：设置了 STREAM_DATA_DIR 时，超大 CSV 可直接从服务器的数据目录分块读取
+    sources = ["上传文件"] + (["服务器CSV文件（大文件流式读取）"] if STREAM_DATA_DIR else [])
+    source = st.sidebar.radio("原始数据来源", sources) if len(sources) > 1 else sources[0]
+    csv_name = None
+    if source == "上传文件":
+        original_files = st.sidebar.file_uploader("上传原始数据表（Excel 或 CSV，可多选，如按月导出的多个文件）",
+                                                  type=["xlsx", "xls", "csv"], accept_multiple_files=True)
+    else:
+        original_files = []
+        csv_files = list_stream_files(STREAM_DATA_DIR)
+        if csv_files:
+            csv_name = st.sidebar.selectbox("选择数据目录中的CSV文件", csv_files)
+        else:
+            st.sidebar.info(f"数据目录中没有CSV文件：{STREAM_DATA_DIR}")
 
     # 上传客户匹配表（可选）
     matching_file = st.sidebar.file_uploader("上传客户匹配表（Excel 或 CSV）（可选）", type=["xlsx", "xls", "csv"])
@@ -27,139 +280,78 @@ def main():
     - 如果不上传，分析将涵盖所有客户。
     """)
 
-    if st.sidebar.button("开始分析"):
-        if not original_file:
+    if not original_files and not csv_name:
+        if st.sidebar.button("开始分析"):
             st.error("请上传原始数据表。")
-            return
-
-        try:
-            # 读取原始数据表
-            if original_file.name.endswith(('.xlsx', '.xls')):
-                original_df = pd.read_excel(original_file)
-            else:
-                original_df = pd.read_csv(original_file)
-
-            # 定义可能的列名
-            sku_columns = ['sku_id', 'sku']
-            order_date_columns = ['订单日期', '下单时间']
-            bd_columns = ['BD', 'bd_name']
-
-            # 重命名 'sku' 或 'sku_id' 为 'sku_id'
-            sku_present = [col for col in sku_columns if col in original_df.columns]
-            if sku_present:
-                original_df.rename(columns={sku_present[0]: 'sku_id'}, inplace=True)
-                st.info(f"将列 '{sku_present[0]}' 重命名为 'sku_id'。")
-            else:
-                st.error("原始数据表缺少 'sku_id' 或 'sku' 列。")
+        return
+
+    try:
+        # 同一组文件只读取和汇总一次，调整阈值时直接使用缓存结果
+        matching = (matching_file.name, matching_file.getvalue()) if matching_file else None
+        matching_hash = hashlib.sha256(matching[1]).hexdigest() if matching else None
+        if original_files:
+            original = [(f.name, f.getvalue()) for f in original_files]
+            file_key = (files_digest(original), matching_hash)
+            latest_orders, valid_count, messages, has_m_id = build_latest_orders(file_key, original, matching)
+        else:
+            csv_path = resolve_stream_path(STREAM_DATA_DIR, csv_name)
+            if not os.path.isfile(csv_path):
+                st.error(f"找不到文件：{csv_name}")
                 return
+            # 以路径、修改时间和大小标识文件，文件更新后重新读取
+            file_stat = os.stat(csv_path)
+            file_key = (csv_path, file_stat.st_mtime, file_stat.st_size, matching_hash)
+            latest_orders, valid_count, messages, has_m_id = stream_latest_orders(file_key, csv_path, matching)
+    except ValueError as ve:
+        st.error(str(ve))
+        return
+    except ImportError as ie:
+        st.error(f"导入错误：{ie}. 请确保所有依赖项已正确安装。")
+        return
+    except Exception as e:
+        st.error(f"在处理文件时发生错误：{str(e)}")
+        return
+
+    # 获取当前日期
+    current_date = datetime.now()
+    latest_dates = latest_orders['order_date'].to_numpy(dtype='datetime64[ns]')[:valid_count]
+
+    # 实时显示当前阈值及常用阈值下的不活跃组合数
+    inactive_count = count_inactive(latest_dates, threshold_days, current_date)
+    st.metric(f"超过{threshold_days}天未购买的客户-商品组合", f"{inactive_count} / {len(latest_orders)}")
+    with st.expander("不同阈值下的不活跃组合数"):
+        thresholds = sorted({7, 14, 30, 60, 90, 180, 365, int(threshold_days)})
+        st.dataframe(pd.DataFrame({
+            '未购买天数阈值': thresholds,
+            '不活跃组合数': [count_inactive(latest_dates, days, current_date) for days in thresholds]
+        }), hide_index=True)
 
-            # 重命名 '订单日期' 或 '下单时间' 为 'order_date'
-            order_date_present = [col for col in order_date_columns if col in original_df.columns]
-            if order_date_present:
-                original_df.rename(columns={order_date_present[0]: 'order_date'}, inplace=True)
-                st.info(f"将列 '{order_date_present[0]}' 重命名为 'order_date'。")
-            else:
-                st.error("原始数据表缺少 '订单日期' 或 '下单时间' 列。")
-                return
+    if st.sidebar.button("开始分析"):
+        for level, message in messages:
+            getattr(st, level)(message)
 
-            # 重命名 'bd_name' 为 'BD'（如果存在）
-            bd_present = [col for col in bd_columns if col in original_df.columns]
-            if bd_present:
-                original_df.rename(columns={bd_present[0]: 'BD'}, inplace=True)
-                st.info(f"将列 '{bd_present[0]}' 重命名为 'BD'。")
-            else:
-                st.warning("原始数据表中未找到 'BD' 或 'bd_name' 列。")
-
-            # 确保必要的列存在
-            required_original_columns = {'客户名称', '商品名称', 'sku_id', 'BD', 'order_date'}
-            required_matching_columns = {'客户名称'}
-
-            missing_original_cols = required_original_columns - set(original_df.columns)
-            if missing_original_cols:
-                st.error(f"原始数据表缺少以下必要列：{missing_original_cols}")
-                return
+        inactive_products = select_inactive(latest_orders, valid_count, has_m_id, threshold_days, current_date)
 
-            # 检查是否存在“m_id”列
-            has_m_id = 'm_id' in original_df.columns
-            if has_m_id:
-                st.info("检测到 'm_id' 列，将包含在结果中。")
-            else:
-                st.info("未检测到 'm_id' 列，结果中将不包含该列。")
-
-            # 读取并处理客户匹配表（如果上传）
-            if matching_file:
-                if matching_file.name.endswith(('.xlsx', '.xls')):
-                    matching_df = pd.read_excel(matching_file)
-                else:
-                    matching_df = pd.read_csv(matching_file)
-
-                # 确保匹配表中必要的列存在
-                missing_matching_cols = required_matching_columns - set(matching_df.columns)
-                if missing_matching_cols:
-                    st.error(f"客户匹配表缺少以下必要列：{missing_matching_cols}")
-                    return
-
-                # 筛选需要匹配的客户
-                matched_customers = original_df[original_df['客户名称'].isin(matching_df['客户名称'])]
-                st.success("已根据客户匹配表筛选客户。")
-            else:
-                # 如果未上传匹配表，则使用所有客户
-                matched_customers = original_df.copy()
-                st.info("未上传客户匹配表，将分析所有客户的数据。")
-
-            # 转换订单日期为datetime格式
-            matched_customers['order_date'] = pd.to_datetime(matched_customers['order_date'], errors='coerce')
-
-            # 检查日期转换是否有NaT值
-            if matched_customers['order_date'].isnull().any():
-                st.warning("部分订单日期格式不正确，已被转换为NaT。请检查数据。")
-
-            # 获取当前日期
-            current_date = datetime.now()
-
-            # 计算阈值日期
-            threshold_date = current_date - timedelta(days=int(threshold_days))
-
-            # 获取每个客户-商品的最新订单日期以及对应的sku_id和BD
-            latest_orders = matched_customers.sort_values('order_date').drop_duplicates(['客户名称', '商品名称'], keep='last')
-
-            # 筛选超过阈值未购买的商品
-            inactive_products = latest_orders[latest_orders['order_date'] < threshold_date]
-
-            if inactive_products.empty:
-                st.success(f"所有客户的商品在过去{threshold_days}天内都有购买记录。")
-                return
+        if inactive_products.empty:
+            st.success(f"所有客户的商品在过去{threshold_days}天内都有购买记录。")
+            return
 
-            # 选择需要的列
-            result_columns = ['客户名称', '商品名称', 'sku_id', 'BD', 'order_date']
-            if has_m_id:
-                result_columns.append('m_id')
-            inactive_products = inactive_products[result_columns]
-
-            # 重命名“order_date”以明确表示是最后一次购买时间
-            inactive_products.rename(columns={'order_date': '最后一次购买日期'}, inplace=True)
-
-            st.subheader("分析结果")
-            st.dataframe(inactive_products)
-
-            # 将 DataFrame 写入 BytesIO 对象
-            output = BytesIO()
-            with pd.ExcelWriter(output, engine='openpyxl') as writer:
-                inactive_products.to_excel(writer, index=False, sheet_name='Inactive Products')
-            processed_data = output.getvalue()
-
-            # 提供下载链接
-            st.download_button(
-                label="下载结果",
-                data=processed_data,
-                file_name=output_filename,
-                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-            )
-
-        except ImportError as ie:
-            st.error(f"导入错误：{ie}. 请确保所有依赖项已正确安装。")
-        except Exception as e:
-            st.error(f"在处理文件时发生错误：{str(e)}")
+        st.subheader("分析结果")
+        st.dataframe(inactive_products)
+
+        # 将 DataFrame 写入 BytesIO 对象
+        output = BytesIO()
+        with pd.ExcelWriter(output, engine='openpyxl') as writer:
+            inactive_products.to_excel(writer, index=False, sheet_name='Inactive Products')
+        processed_data = output.getvalue()
+
+        # 提供下载链接
+        st.download_button(
+            label="下载结果",
+            data=processed_data,
+            file_name=output_filename,
+            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+        )
 
 if __name__ == "__main__":
     main()
@@ -4,9 +4,14 @@ import numpy as np
 from io import BytesIO
 from datetime import datetime
 from openpyxl.styles import numbers
+from data_loader import files_digest, load_tables, optimize_dtypes, parse_dates
+from perf import instrumented, stage
 
-st.title("大麦-数据与策略-月环比智能")
 SPECIAL_ITEMS = ['安佳淡奶油', '爱乐薇(铁塔)淡奶油']
+# 所有分析维度都需要的列，缺少时读取表头后立即报错
+REQUIRED_COLUMNS = ['下单时间', '商品名称', '实付金额']
+# 分析维度列，只读取这些列并转为 category
+CATEGORY_COLUMNS = ['商品名称', '客户名称', 'BD', '主营类型', '商品分类', '订单类型']
 
 # 配置所有分析维度
 DIMENSION_CONFIG = {
@@ -25,13 +30,23 @@ DIMENSION_CONFIG = {
 }
 
 
-def process_data(uploaded_file):
+# 多个文件（如按月导出）并行解析后合并
+def read_orders(files, max_workers=None):
     # 读取并预处理数据
-    df = pd.read_excel(uploaded_file)
+    df = load_tables(files, REQUIRED_COLUMNS, 'Excel文件', columns=CATEGORY_COLUMNS, max_workers=max_workers)
     df = df.dropna(subset=['下单时间'])
-    df['下单时间'] = pd.to_datetime(df['下单时间'])
+    df['下单时间'], invalid_dates = parse_dates(df['下单时间'])
+    if invalid_dates:
+        raise ValueError(f"下单时间有 {invalid_dates} 条无法解析的日期，请检查数据")
     df['商品名称'] = df['商品名称'].fillna('未知商品')
-    return df
+    # 填充缺失值后再转为 category，分组时只按编码计算
+    return optimize_dtypes(df, dict.fromkeys(CATEGORY_COLUMNS, 'category'))
+
+
+# 按所有文件内容的组合哈希缓存
+@st.cache_data(show_spinner="正在读取数据...", max_entries=4)
+def process_data(files_key, _files):
+    return read_orders(_files)
 
 
 def calculate_comparison(base_df, period1, period2, group_cols):
@@ -42,8 +57,8 @@ def calculate_comparison(base_df, period1, period2, group_cols):
         df_period2 = base_df[base_df['下单时间'].between(period2[0], period2[1])]
 
         # 分组聚合
-        group1 = df_period1.groupby(group_cols)['实付金额'].sum().reset_index()
-        group2 = df_period2.groupby(group_cols)['实付金额'].sum().reset_index()
+        group1 = df_period1.groupby(group_cols, observed=True)['实付金额'].sum().reset_index()
+        group2 = df_period2.groupby(group_cols, observed=True)['实付金额'].sum().reset_index()
 
         # 合并数据
         merged = pd.merge(
@@ -66,12 +81,87 @@ def calculate_comparison(base_df, period1, period2, group_cols):
         return pd.DataFrame()
 
 
-# 文件上传
-uploaded_file = st.file_uploader("上传Excel文件", type=["xlsx"])
+def compare_periods(raw_df, period1, period2):
+    """按 DIMENSION_CONFIG 的各维度计算两个期段的环比，返回 {维度: 结果表}，没有数据的维度不出现在结果中"""
+    # 数据分割
+    main_df = raw_df[~raw_df['商品名称'].isin(SPECIAL_ITEMS)]
+    special_df = raw_df[raw_df['商品名称'].isin(SPECIAL_ITEMS)]
+
+    results = {}
+
+    # ====== 常规分析 ======
+    for dim_type in DIMENSION_CONFIG['常规分析']:
+        group_cols = DIMENSION_CONFIG['常规分析'][dim_type]
+        with stage(f'环比计算：{dim_type}', rows_in=len(main_df)) as info:
+            analysis = calculate_comparison(main_df, period1, period2, group_cols)
+            info.rows_out = len(analysis)
+        if not analysis.empty:
+            results[dim_type] = analysis
+
+    # ====== 特殊分析 ======
+    if not special_df.empty:
+        for dim_type in DIMENSION_CONFIG['特殊分析']:
+            group_cols = DIMENSION_CONFIG['特殊分析'][dim_type]
+            with stage(f'环比计算：{dim_type}', rows_in=len(special_df)) as info:
+                analysis = calculate_comparison(special_df, period1, period2, group_cols)
+                info.rows_out = len(analysis)
+            if not analysis.empty:
+                results[dim_type] = analysis
+
+    return results
+
+
+def to_excel(results):
+    """生成Excel报告，环比增长率设置为百分比格式"""
+    output = BytesIO()
+    with stage('导出Excel', rows_in=sum(len(data) for data in results.values())), \
+            pd.ExcelWriter(output, engine='openpyxl') as writer:
+        for sheet_name, data in results.items():
+            export_df = data.copy()
+            # 处理无限大值
+            export_df['环比增长率'] = export_df['环比增长率'].replace(
+                [np.inf, -np.inf],
+                ['新增', 'N/A']
+            )
+            # 写入Excel
+            export_df.to_excel(
+                writer,
+                sheet_name=sheet_name[:30],
+                index=False,
+                header=[
+                    f"{col}期段1" if '_期段1' in col else
+                    f"{col}期段2" if '_期段2' in col else
+                    col
+                    for col in export_df.columns
+                ]
+            )
+
+            # 设置百分比格式
+            ws = writer.sheets[sheet_name[:30]]
+            for col_idx, col_name in enumerate(export_df.columns, 1):
+                if '环比增长率' in col_name:
+                    for row in range(2, len(export_df) + 2):
+                        cell = ws.cell(row=row, column=col_idx)
+                        if export_df.iloc[row - 2]['环比增长率'] not in ['新增', 'N/A']:
+                            cell.number_format = numbers.FORMAT_PERCENTAGE_00
+    return output.getvalue()
+
+
+@instrumented('app003')
+def main():
+    st.title("大麦-数据与策略-月环比智能")
+
+    # 文件上传
+    uploaded_files = st.file_uploader("上传Excel文件（可多选，如按月导出的多个文件）", type=["xlsx"],
+                                      accept_multiple_files=True)
+
+    if not uploaded_files:
+        st.info("请上传Excel文件开始分析")
+        return
 
-if uploaded_file:
     try:
-        raw_df = process_data(uploaded_file)
+        files = [(f.name, f.getvalue()) for f in uploaded_files]
+        raw_df = process_data(files_digest(files), files)
 
         # 时间段选择
         st.sidebar.header("分析设置")
@@ -94,26 +184,7 @@ if uploaded_file:
         if period2[0] <= period1[1]:
             st.warning("警告：分析期段存在时间重叠")
 
-        # 数据分割
-        main_df = raw_df[~raw_df['商品名称'].isin(SPECIAL_ITEMS)]
-        special_df = raw_df[raw_df['商品名称'].isin(SPECIAL_ITEMS)]
-
-        results = {}
-
-        # ====== 常规分析 ======
-        for dim_type in DIMENSION_CONFIG['常规分析']:
-            group_cols = DIMENSION_CONFIG['常规分析'][dim_type]
-            analysis = calculate_comparison(main_df, period1, period2, group_cols)
-            if not analysis.empty:
-                results[dim_type] = analysis
-
-        # ====== 特殊分析 ======
-        if not special_df.empty:
-            for dim_type in DIMENSION_CONFIG['特殊分析']:
-                group_cols = DIMENSION_CONFIG['特殊分析'][dim_type]
-                analysis = calculate_comparison(special_df, period1, period2, group_cols)
-                if not analysis.empty:
-                    results[dim_type] = analysis
+        results = compare_periods(raw_df, period1, period2)
 
         # 结果展示
         if not results:
@@ -137,45 +208,16 @@ if uploaded_file:
             st.dataframe(display_df)
 
         # 生成Excel报告
-        output = BytesIO()
-        with pd.ExcelWriter(output, engine='openpyxl') as writer:
-            for sheet_name, data in results.items():
-                export_df = data.copy()
-                # 处理无限大值
-                export_df['环比增长率'] = export_df['环比增长率'].replace(
-                    [np.inf, -np.inf],
-                    ['新增', 'N/A']
-                )
-                # 写入Excel
-                export_df.to_excel(
-                    writer,
-                    sheet_name=sheet_name[:30],
-                    index=False,
-                    header=[
-                        f"{col}期段1" if '_期段1' in col else
-                        f"{col}期段2" if '_期段2' in col else
-                        col
-                        for col in export_df.columns
-                    ]
-                )
-
-                # 设置百分比格式
-                ws = writer.sheets[sheet_name[:30]]
-                for col_idx, col_name in enumerate(export_df.columns, 1):
-                    if '环比增长率' in col_name:
-                        for row in range(2, len(export_df) + 2):
-                            cell = ws.cell(row=row, column=col_idx)
-                            if export_df.iloc[row - 2]['环比增长率'] not in ['新增', 'N/A']:
-                                cell.number_format = numbers.FORMAT_PERCENTAGE_00
-
         st.download_button(
             "下载分析报告",
-            output.getvalue(),
+            to_excel(results),
             file_name="custom_period_analysis.xlsx",
             mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
         )
 
     except Exception as e:
         st.error(f"系统错误：{str(e)}")
-else:
-    st.info("请上传Excel文件开始分析")
+
+
+if __name__ == "__main__":
+    main()
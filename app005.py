@@ -1,15 +1,29 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
+import hashlib
+import copy
 from PIL import Image
 import io
 import os
+from data_loader import load_table, parse_dates
+from perf import instrumented, stage
 
-# 设置页面配置
-st.set_page_config(
-    page_title="大麦-数据策略工具-购买周期",
-    layout="wide",
-    initial_sidebar_state="expanded",
-)
+PAIR_COLUMNS = ['客户名称', '商品名称']
+CYCLE_WINDOW = 32  # 每个客户-商品保留最近的购买间隔数，用于计算中位数和分位数
+EWMA_ALPHA = 0.3
+REQUIRED_COLUMNS = ['商品名称', '下单时间', '客户名称', 'BD']
+
+# 预测方法 -> 使用的购买周期列
+ESTIMATORS = {
+    '平均值': '平均购买周期(天)',
+    '中位数': '中位购买周期(天)',
+    'EWMA': 'EWMA购买周期(天)',
+    '去极值均值': '去极值平均周期(天)',
+}
+# 只用最近 CYCLE_WINDOW 次间隔计算的列和估计方法；平均值、最短、最长和 EWMA 基于全部历史间隔
+WINDOW_COLUMNS = ['中位购买周期(天)', 'P25购买周期(天)', 'P75购买周期(天)', '去极值平均周期(天)']
+WINDOW_ESTIMATORS = ['中位数', '去极值均值']
 
 # 显示LOGO
 def display_logo():
@@ -23,98 +37,368 @@ def display_logo():
     else:
         st.warning("未找到 logo.png 文件，程序将继续运行但不显示LOGO。")
 
-display_logo()
+# 整理订单并建立商品索引
+def prepare_orders(df):
+    orders = df[REQUIRED_COLUMNS].copy()
+    orders['下单时间'], _ = parse_dates(orders['下单时间'])
+    orders = orders.dropna(subset=['商品名称', '下单时间'])
+    with stage('排序', rows_in=len(orders)):
+        orders = orders.sort_values(['商品名称', '客户名称', '下单时间'], kind='mergesort').reset_index(drop=True)
 
-st.title("大麦-数据策略工具-购买周期")
+    # 排序后每个商品占据连续的行区间：商品名称 -> (起始行, 结束行)
+    names = orders['商品名称']
+    starts = np.flatnonzero(names.ne(names.shift()).to_numpy())
+    stops = np.append(starts[1:], len(orders))
+    product_index = dict(zip(names.iloc[starts], zip(starts.tolist(), stops.tolist())))
 
-# 上传文件
-st.header("上传需要分析的表格文件")
-uploaded_file = st.file_uploader("选择一个Excel文件（.xlsx）", type=["xlsx"])
+    return orders, product_index
 
-# 输入商品名称
-st.header("输入商品名称")
-product_name = st.text_input("请输入要查询的商品名称：")
+# 解析上传文件并建立商品索引，按文件内容哈希缓存，重复查询无需重新读取Excel
+@st.cache_resource(show_spinner="正在解析文件...", max_entries=4)
+def load_orders(file_hash, file_name, _file_bytes):
+    # 先只读取表头校验必要的列，缺列时无需等待整个工作簿解析完成
+    return prepare_orders(load_table(file_name, _file_bytes, REQUIRED_COLUMNS, 'Excel文件'))
 
-# 定义数据分析函数
-def analyze_data(df, product_name):
-    required_columns = ['商品名称', '下单时间', '客户名称', 'BD']
-    if not all(column in df.columns for column in required_columns):
-        st.error(f"Excel文件缺少必要的列：{required_columns}")
+# 读取上传文件的内容哈希，作为缓存键
+def upload_hash(uploaded_file):
+    return hashlib.sha256(uploaded_file.getvalue()).hexdigest()
+
+# 按 客户-商品 维护购买间隔统计，可用新增订单批次增量更新而无需回溯历史订单
+class CycleStats:
+    def __init__(self, window=CYCLE_WINDOW, alpha=EWMA_ALPHA):
+        self.window = window
+        self.alpha = alpha
+        self.keys = pd.DataFrame(columns=PAIR_COLUMNS)
+        self.bd = np.empty(0, dtype=object)
+        self.count = np.zeros(0, dtype=np.int64)
+        self.total = np.zeros(0)
+        self.min = np.zeros(0)
+        self.max = np.zeros(0)
+        self.ewma = np.zeros(0)
+        self.last_order = np.empty(0, dtype='datetime64[ns]')
+        # 每个组合最近 window 次购买间隔的环形缓冲区，用于计算中位数和分位数
+        self.recent = np.empty((0, window), dtype=np.float32)
+        self.pos = np.zeros(0, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def copy(self):
+        return copy.deepcopy(self)
+
+    def _grow(self, n):
+        self.bd = np.append(self.bd, np.full(n, None, dtype=object))
+        self.count = np.append(self.count, np.zeros(n, dtype=np.int64))
+        self.total = np.append(self.total, np.zeros(n))
+        self.min = np.append(self.min, np.full(n, np.inf))
+        self.max = np.append(self.max, np.full(n, -np.inf))
+        self.ewma = np.append(self.ewma, np.zeros(n))
+        self.last_order = np.append(self.last_order, np.full(n, np.datetime64('NaT'), dtype='datetime64[ns]'))
+        self.recent = np.vstack([self.recent, np.full((n, self.window), np.nan, dtype=np.float32)])
+        self.pos = np.append(self.pos, np.zeros(n, dtype=np.int64))
+
+    def _pair_codes(self, pairs):
+        """把不重复的 客户-商品 组合映射为数组下标，新组合追加到末尾"""
+        if len(self.keys):
+            codes = pd.MultiIndex.from_frame(self.keys).get_indexer(pd.MultiIndex.from_frame(pairs))
+        else:
+            codes = np.full(len(pairs), -1)
+        new = codes == -1
+        codes[new] = len(self.keys) + np.arange(new.sum())
+        if new.any():
+            self.keys = pd.concat([self.keys, pairs[new]], ignore_index=True)
+            self._grow(int(new.sum()))
+        return codes
+
+    def update(self, orders):
+        """
+        并入一批订单。不晚于该组合已记录最近下单时间的订单视为已并入过的重复数据，忽略：
+        重复上传或与上一批重叠的文件不会产生 0 天的间隔而拉低购买周期。
+        """
+        batch = orders[PAIR_COLUMNS + ['BD', '下单时间']].dropna(subset=['下单时间'])
+        if batch.empty:
+            return self
+        batch = batch.sort_values(PAIR_COLUMNS + ['下单时间'], kind='mergesort').reset_index(drop=True)
+
+        first = ((batch['客户名称'] != batch['客户名称'].shift()) |
+                 (batch['商品名称'] != batch['商品名称'].shift())).to_numpy()
+        codes = self._pair_codes(batch.loc[first, PAIR_COLUMNS].reset_index(drop=True))
+        row_code = codes[np.cumsum(first) - 1]
+        times = batch['下单时间'].to_numpy(dtype='datetime64[ns]')
+        bd = batch['BD'].to_numpy(dtype=object)
+
+        prev_last = self.last_order[row_code]
+        keep = np.isnat(prev_last) | (times > prev_last)
+        row_code, times, bd = row_code[keep], times[keep], bd[keep]
+        if len(row_code) == 0:
+            return self
+
+        # 上一次下单时间：组合内取上一行，组合首行取已记录的最近下单时间
+        first = np.r_[True, row_code[1:] != row_code[:-1]]
+        last = np.r_[row_code[1:] != row_code[:-1], True]
+        prev = np.r_[np.datetime64('NaT', 'ns'), times[:-1]]
+        prev[first] = self.last_order[row_code[first]]
+        valid = ~np.isnat(prev)
+        gap_code = row_code[valid]
+        gaps = ((times[valid] - prev[valid]) // np.timedelta64(1, 'D')).astype(float)
+
+        self.last_order[row_code[last]] = times[last]
+        self.bd[row_code[last]] = bd[last]
+        if len(gaps) == 0:
+            return self
+
+        n = len(self)
+        batch_count = np.bincount(gap_code, minlength=n)
+        old_count = self.count.copy()
+        self.count += batch_count
+        self.total += np.bincount(gap_code, weights=gaps, minlength=n)
+        np.minimum.at(self.min, gap_code, gaps)
+        np.maximum.at(self.max, gap_code, gaps)
+
+        # 组合内第 j 个新间隔（共 m 个），EWMA 展开为 decay * 旧值 + 加权和
+        gap_first = np.r_[True, gap_code[1:] != gap_code[:-1]]
+        position = np.arange(len(gap_code))
+        j = position - np.maximum.accumulate(np.where(gap_first, position, 0))
+        m = batch_count[gap_code]
+        decay = 1 - self.alpha
+        weights = self.alpha * decay ** (m - 1 - j)
+        # 没有历史间隔的组合以第一个间隔作为 EWMA 初值
+        seed = (j == 0) & (old_count[gap_code] == 0)
+        weights[seed] = decay ** (m[seed] - 1)
+        self.ewma = (np.where(old_count > 0, decay ** batch_count, 0.0) * self.ewma +
+                     np.bincount(gap_code, weights=weights * gaps, minlength=n))
+
+        # 只有最后 window 个新间隔会留在环形缓冲区中
+        in_window = j >= m - self.window
+        slot = (self.pos[gap_code] + j) % self.window
+        self.recent[gap_code[in_window], slot[in_window]] = gaps[in_window]
+        self.pos = (self.pos + batch_count) % self.window
+
+        return self
+
+    def summary(self, estimator='平均值'):
+        """汇总每个组合的购买周期，并按所选估计方法预测下次购买时间"""
+        has = self.count > 0
+        recent = self.recent[has].astype(float)
+        if recent.shape[0]:
+            p25, median, p75 = np.nanpercentile(recent, [25, 50, 75], axis=1)
+        else:
+            p25 = median = p75 = np.zeros(0)
+        # 去极值均值：剔除超出 [P25 - 1.5IQR, P75 + 1.5IQR] 的间隔后取平均
+        iqr = p75 - p25
+        inlier = (recent >= (p25 - 1.5 * iqr)[:, None]) & (recent <= (p75 + 1.5 * iqr)[:, None])
+        trimmed = np.nanmean(np.where(inlier, recent, np.nan), axis=1) if recent.shape[0] else np.zeros(0)
+
+        summary = self.keys[has].reset_index(drop=True)
+        summary['BD'] = self.bd[has]
+        summary['购买间隔次数'] = self.count[has]
+        summary['平均购买周期(天)'] = self.total[has] / self.count[has]
+        summary['最短购买周期(天)'] = self.min[has]
+        summary['最长购买周期(天)'] = self.max[has]
+        summary['中位购买周期(天)'] = median
+        summary['P25购买周期(天)'] = p25
+        summary['P75购买周期(天)'] = p75
+        summary['EWMA购买周期(天)'] = self.ewma[has]
+        summary['去极值平均周期(天)'] = trimmed
+        summary['最近一次下单时间'] = self.last_order[has]
+
+        summary = summary[
+            (summary['平均购买周期(天)'] != 0) |
+            (summary['最短购买周期(天)'] != 0) |
+            (summary['最长购买周期(天)'] != 0)
+        ]
+        # 预测购买时间保持日期类型，便于后续筛选即将到期的客户
+        summary['预测购买时间'] = summary['最近一次下单时间'] + pd.to_timedelta(
+            summary[ESTIMATORS[estimator]], unit='D')
+
+        return summary.reset_index(drop=True)
+
+# 单个商品的购买周期，查询不到该商品时返回 None
+def product_cycles(orders, product_index, product_name, estimator):
+    # 根据商品名称严格匹配，直接切取该商品的连续行
+    if product_name not in product_index:
         return None
+    start, stop = product_index[product_name]
 
-    # 根据商品名称严格匹配过滤数据
-    filtered_data = df[df['商品名称'] == product_name].copy()
-    if filtered_data.empty:
+    summary = CycleStats().update(orders.iloc[start:stop]).summary(estimator)
+    return format_prediction(summary)
+
+# 定义数据分析函数
+def analyze_data(orders, product_index, product_name, estimator):
+    result = product_cycles(orders, product_index, product_name, estimator)
+    if result is None:
         st.warning("查询不到此商品，请重新输入。")
-        return None
+    return result
+
+# 全部 客户-商品 的购买周期统计，按文件内容哈希缓存
+@st.cache_resource(show_spinner="正在计算购买周期...", max_entries=4)
+def build_cycle_stats(file_hash, _orders):
+    with stage('周期统计', rows_in=len(_orders)):
+        return CycleStats().update(_orders)
 
-    # 转换下单时间格式并排序
-    filtered_data['下单时间'] = pd.to_datetime(filtered_data['下单时间'], errors='coerce')
-    filtered_data = filtered_data.dropna(subset=['下单时间'])
-    filtered_data = filtered_data.sort_values(['客户名称', '下单时间'])
-
-    # 计算客户购买周期
-    filtered_data['购买间隔(天)'] = filtered_data.groupby('客户名称')['下单时间'].diff().dt.days
-
-    # 获取每位客户的最近一次下单时间
-    recent_order = filtered_data.groupby('客户名称')['下单时间'].max().reset_index()
-    recent_order.rename(columns={'下单时间': '最近一次下单时间'}, inplace=True)
-
-    # 汇总结果并增加 BD 信息和商品名称
-    summary = filtered_data.groupby(['客户名称', 'BD'])['购买间隔(天)'].agg(['mean', 'min', 'max']).reset_index()
-    summary.rename(columns={
-        'mean': '平均购买周期(天)',
-        'min': '最短购买周期(天)',
-        'max': '最长购买周期(天)'
-    }, inplace=True)
-
-    summary = pd.merge(summary, recent_order, on='客户名称', how='left')
-    summary['预测购买时间'] = summary['最近一次下单时间'] + pd.to_timedelta(summary['平均购买周期(天)'], unit='D')
-    summary['预测购买时间'] = summary['预测购买时间'].dt.strftime('%Y年%m月%d日')
-
-    summary['商品名称'] = product_name
-
-    summary = summary.dropna(subset=['平均购买周期(天)', '最短购买周期(天)', '最长购买周期(天)'])
-    summary = summary[
-        (summary['平均购买周期(天)'] != 0) |
-        (summary['最短购买周期(天)'] != 0) |
-        (summary['最长购买周期(天)'] != 0)
+# 筛选未来N天内预计下单的客户
+def filter_due_soon(summary, days):
+    today = pd.Timestamp.today().normalize()
+    due = summary[
+        (summary['预测购买时间'] >= today) &
+        (summary['预测购买时间'] < today + pd.Timedelta(days=days))
     ]
+    return due.sort_values('预测购买时间')
+
+# 批量结果：全部组合的购买周期（可按商品名称模糊筛选）及未来N天内预计下单的组合
+def batch_cycles(stats, estimator, product_filter='', due_days=7):
+    with stage('周期预测') as info:
+        batch_summary = stats.summary(estimator)
+        info.rows_out = len(batch_summary)
+    # 先整体计算，再按商品名称筛选
+    if product_filter.strip():
+        batch_summary = batch_summary[
+            batch_summary['商品名称'].astype(str).str.contains(product_filter.strip(), regex=False)
+        ]
+    return batch_summary, filter_due_soon(batch_summary, int(due_days))
+
+# 估计方法的展示名称，注明只用最近的购买间隔的方法
+def estimator_label(estimator):
+    return f"{estimator}（最近{CYCLE_WINDOW}次间隔）" if estimator in WINDOW_ESTIMATORS else estimator
+
+# 结果表中只用最近的购买间隔计算的列，加上说明
+def window_column_config():
+    return {col: st.column_config.NumberColumn(help=f"只用每个客户-商品最近 {CYCLE_WINDOW} 次购买间隔计算")
+            for col in WINDOW_COLUMNS}
+
+# 预测购买时间格式化为展示用的字符串
+def format_prediction(summary):
+    result = summary.copy()
+    result['预测购买时间'] = result['预测购买时间'].dt.strftime('%Y年%m月%d日')
+    return result
 
-    return summary
+# 将结果写入Excel
+def to_excel(sheets):
+    towrite = io.BytesIO()
+    with stage('导出Excel', rows_in=sum(len(data) for data in sheets.values())), \
+            pd.ExcelWriter(towrite, engine='openpyxl') as writer:
+        for sheet_name, data in sheets.items():
+            data.to_excel(writer, index=False, sheet_name=sheet_name)
+    towrite.seek(0)
+    return towrite
 
-# 处理查询
-if st.button("查询"):
-    if uploaded_file is None:
-        st.warning("请先上传文件。")
-    elif not product_name.strip():
-        st.warning("请输入要查询的商品名称。")
+@instrumented('app005')
+def main():
+    # 设置页面配置
+    st.set_page_config(
+        page_title="大麦-数据策略工具-购买周期",
+        layout="wide",
+        initial_sidebar_state="expanded",
+    )
+
+    display_logo()
+
+    st.title("大麦-数据策略工具-购买周期")
+
+    # 上传文件
+    st.header("上传需要分析的表格文件")
+    uploaded_file = st.file_uploader("选择一个Excel文件（.xlsx）", type=["xlsx"])
+
+    # 选择分析模式
+    st.header("选择分析模式")
+    mode = st.radio("分析模式", ["单品查询", "全部商品批量分析"], horizontal=True)
+    estimator = st.selectbox("预测购买时间的估计方法", list(ESTIMATORS), format_func=estimator_label,
+                             help=f"中位数、P25/P75 和去极值均值只用每个客户-商品最近 {CYCLE_WINDOW} 次购买间隔计算，"
+                                  "受个别超长间隔影响较小；平均值、最短、最长和 EWMA 基于全部历史间隔")
+
+    if mode == "单品查询":
+        # 输入商品名称
+        st.header("输入商品名称")
+        product_name = st.text_input("请输入要查询的商品名称：")
     else:
-        try:
-            df = pd.read_excel(uploaded_file, engine='openpyxl')
-            result = analyze_data(df, product_name.strip())
-            if result is not None:
-                st.success("分析完成！")
-                st.dataframe(result)
-
-                # 提供下载功能
-                towrite = io.BytesIO()
-                result.to_excel(towrite, index=False, engine='openpyxl')
-                towrite.seek(0)
-                st.download_button(
-                    label="下载结果为Excel",
-                    data=towrite,
-                    file_name=f"分析结果_{product_name}.xlsx",
-                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-                )
-        except Exception as e:
-            st.error(f"处理文件时发生错误：{e}")
-
-# 提示信息
-st.markdown("""
----
-**注意事项：**
-- 请确保上传的Excel文件包含以下列：`商品名称`, `下单时间`, `客户名称`, `BD`。
-- `下单时间` 列应为日期格式。
-- `logo.png` 文件应与 `app005.py` 位于同一目录下。
-""")
+        # 批量模式的筛选条件
+        st.header("批量分析设置")
+        product_filter = st.text_input("按商品名称筛选（可选，支持模糊匹配）：")
+        due_days = st.number_input("列出未来N天内预计下单的客户", min_value=1, value=7)
+        extra_file = st.file_uploader("追加新订单文件（可选，在已有统计上增量更新）", type=["xlsx"])
+
+    # 处理批量分析
+    if mode == "全部商品批量分析":
+        if st.button("批量分析"):
+            if uploaded_file is None:
+                st.warning("请先上传文件。")
+            else:
+                try:
+                    file_hash = upload_hash(uploaded_file)
+                    orders, _ = load_orders(file_hash, uploaded_file.name, uploaded_file.getvalue())
+                    stats = build_cycle_stats(file_hash, orders)
+                    batch_key = (file_hash, None)
+                    if extra_file is not None:
+                        extra_hash = upload_hash(extra_file)
+                        extra_orders, _ = load_orders(extra_hash, extra_file.name, extra_file.getvalue())
+                        stats = stats.copy().update(extra_orders)
+                        batch_key = (file_hash, extra_hash)
+                    st.session_state.batch_stats = (batch_key, stats)
+                except Exception as e:
+                    st.error(f"处理文件时发生错误：{e}")
+
+        # 仅展示当前上传文件的批量结果，切换估计方法时直接由统计数组重新汇总
+        batch_key, batch_stats = st.session_state.get('batch_stats', (None, None))
+        current_key = (
+            upload_hash(uploaded_file) if uploaded_file is not None else None,
+            upload_hash(extra_file) if extra_file is not None else None
+        )
+        if uploaded_file is not None and batch_stats is not None and batch_key == current_key:
+            batch_summary, due_soon = batch_cycles(batch_stats, estimator, product_filter, due_days)
+
+            st.success(f"分析完成！共 {len(batch_summary)} 个客户-商品组合。")
+            st.dataframe(format_prediction(batch_summary), column_config=window_column_config())
+
+            st.subheader(f"未来{int(due_days)}天内预计下单（共 {len(due_soon)} 条）")
+            st.dataframe(format_prediction(due_soon), column_config=window_column_config())
+
+            st.download_button(
+                label="下载结果为Excel",
+                data=to_excel({
+                    '全部购买周期': format_prediction(batch_summary),
+                    f'未来{int(due_days)}天预计下单': format_prediction(due_soon)
+                }),
+                file_name="分析结果_全部商品.xlsx",
+                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+            )
+
+    # 处理查询
+    if mode == "单品查询" and st.button("查询"):
+        if uploaded_file is None:
+            st.warning("请先上传文件。")
+        elif not product_name.strip():
+            st.warning("请输入要查询的商品名称。")
+        else:
+            try:
+                orders, product_index = load_orders(upload_hash(uploaded_file), uploaded_file.name,
+                                                    uploaded_file.getvalue())
+                result = analyze_data(orders, product_index, product_name.strip(), estimator)
+                if result is not None:
+                    st.success("分析完成！")
+                    st.dataframe(result, column_config=window_column_config())
+
+                    # 提供下载功能
+                    towrite = io.BytesIO()
+                    result.to_excel(towrite, index=False, engine='openpyxl')
+                    towrite.seek(0)
+                    st.download_button(
+                        label="下载结果为Excel",
+                        data=towrite,
+                        file_name=f"分析结果_{product_name}.xlsx",
+                        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+                    )
+            except Exception as e:
+                st.error(f"处理文件时发生错误：{e}")
+
+    # 提示信息
+    st.markdown("""
+    ---
+    **注意事项：**
+    - 请确保上传的Excel文件包含以下列：`商品名称`, `下单时间`, `客户名称`, `BD`。
+    - `下单时间` 列应为日期格式。
+    - `logo.png` 文件应与 `app005.py` 位于同一目录下。
+    """)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,51 +1,160 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
+import hashlib
+import io
+from data_loader import load_table, optimize_dtypes, parse_dates
+from perf import instrumented, stage
 
+# 必要列：客户ID、日期、实付金额允许使用不同的列名
+REQUIRED_COLUMNS = [('cust_id', 'm_id'), ('日期', '下单时间'), ('实付GMV', '实付金额'), '商品名称', '客户名称', 'BD']
+# 分组用的字符串列转为 category，客户ID降为较小的整数类型
+COLUMN_DTYPES = {'商品名称': 'category', '客户名称': 'category', 'BD': 'category',
+                 'cust_id': 'integer', 'm_id': 'integer'}
 
-# 计算分析函数
-def analyze_data(df, target_increase_pct, min_rank, max_rank):
-    # 1. 过滤掉“商品名称”列中的指定商品
-    filtered_df = df[~df['商品名称'].isin(['爱乐薇(铁塔)淡奶油', '安佳淡奶油'])]
 
-    # 2. 动态列名匹配
+# 计算客户月均GMV及BD内排名，返回 (数据预览, 实付GMV总和, 客户月均GMV表)
+def gmv_cube(df):
+    # 1. 动态列名匹配
     # 确保列名正确匹配，如果需要，可以进行列名替换
     df.columns = df.columns.str.strip()  # 清除列名中的空格
+    optimize_dtypes(df, COLUMN_DTYPES)
 
     # 识别列名称
     cust_id_col = 'cust_id' if 'cust_id' in df.columns else 'm_id'
     date_col = '日期' if '日期' in df.columns else '下单时间'
     gmv_col = '实付GMV' if '实付GMV' in df.columns else '实付金额'
 
+    # 2. 过滤掉“商品名称”列中的指定商品
+    filtered_df = df[~df['商品名称'].isin(['爱乐薇(铁塔)淡奶油', '安佳淡奶油'])].copy()
+
     # 3. 汇总“实付GMV”的总和值
     total_gmv = filtered_df[gmv_col].sum()
 
     # 4. 转换“日期”列为日期格式
-    filtered_df[date_col] = pd.to_datetime(filtered_df[date_col], errors='coerce')
+    filtered_df[date_col], _ = parse_dates(filtered_df[date_col])
 
     # 5. 计算每个客户的月平均值
     filtered_df['年-月'] = filtered_df[date_col].dt.to_period('M')
 
-    # 按客户、月度和BD汇总GMV
-    monthly_gmv = filtered_df.groupby([cust_id_col, '客户名称', '年-月', 'BD'])[gmv_col].sum().reset_index()
+    with stage('分组汇总', rows_in=len(filtered_df)) as info:
+        # 按客户、月度和BD汇总GMV
+        # category 列分组时只保留实际出现的组合
+        monthly_gmv = filtered_df.groupby([cust_id_col, '客户名称', '年-月', 'BD'], observed=True)[gmv_col].sum().reset_index()
+
+        # 计算每个客户的月平均GMV，按照BD维度
+        customer_avg_gmv = monthly_gmv.groupby(['BD', cust_id_col, '客户名称'], observed=True)[gmv_col].mean().reset_index()
+        customer_avg_gmv = customer_avg_gmv.rename(columns={gmv_col: '月平均GMV'})
+
+        # 6. 计算每个BD名下客户的月平均GMV排名
+        customer_avg_gmv['排名'] = customer_avg_gmv.groupby('BD', observed=True)['月平均GMV'].rank(method='min', ascending=False)
+        info.rows_out = len(customer_avg_gmv)
+
+    return df.head(), total_gmv, customer_avg_gmv
 
-    # 计算每个客户的月平均GMV，按照BD维度
-    customer_avg_gmv = monthly_gmv.groupby(['BD', cust_id_col, '客户名称'])[gmv_col].mean().reset_index()
-    customer_avg_gmv = customer_avg_gmv.rename(columns={gmv_col: '月平均GMV'})
 
-    # 6. 计算每个BD名下客户的月平均GMV排名
-    customer_avg_gmv['排名'] = customer_avg_gmv.groupby('BD')['月平均GMV'].rank(method='min', ascending=False)
+# 读取上传文件并计算客户月均GMV及BD内排名，按文件内容哈希缓存
+# 调整目标上涨百分比或排名区间时只需筛选缓存结果，无需重新读取和汇总
+@st.cache_resource(show_spinner="正在计算客户月均GMV...", max_entries=4)
+def build_gmv_cube(file_hash, file_name, _file_bytes):
+    # 先只读取表头校验必要列（候选列名任一存在即可），缺列时立即报错；只读取必要列
+    return gmv_cube(load_table(file_name, _file_bytes, REQUIRED_COLUMNS, '上传文件', columns=[]))
 
-    # 7. 筛选根据用户输入的排名区间
-    filtered_customers = customer_avg_gmv[
-        (customer_avg_gmv['排名'] >= min_rank) & (customer_avg_gmv['排名'] <= max_rank)]
+
+# 计算分析函数
+def analyze_data(customer_avg_gmv, target_increase_pct, min_rank, max_rank):
+    # 7. 筛选根据用户输入的排名区间（缓存结果只读，筛选后复制）
+    rank = customer_avg_gmv['排名'].to_numpy()
+    filtered_customers = customer_avg_gmv[(rank >= min_rank) & (rank <= max_rank)].copy()
 
     # 8. 计算客户目标值（目标上涨百分比）
-    filtered_customers['目标'] = filtered_customers['月平均GMV'] * (1 + target_increase_pct / 100)
+    filtered_customers['目标'] = filtered_customers['月平均GMV'].to_numpy() * (1 + target_increase_pct / 100)
+
+    return filtered_customers
+
+
+# 多场景模拟：一次性计算所有（上涨百分比, 排名区间）组合的客户数、目标GMV和各BD目标
+def simulate_scenarios(customer_avg_gmv, pct_list, rank_bands):
+    rank = customer_avg_gmv['排名'].to_numpy()
+    avg_gmv = customer_avg_gmv['月平均GMV'].to_numpy(dtype=float)
+    bd_codes, bd_names = pd.factorize(customer_avg_gmv['BD'])
+
+    # 区间 × 客户 的布尔矩阵，按区间汇总客户数和月平均GMV
+    low = np.array([band[0] for band in rank_bands])
+    high = np.array([band[1] for band in rank_bands])
+    in_band = (rank >= low[:, None]) & (rank <= high[:, None])
+    band_count = in_band.sum(axis=1)
+    band_gmv = in_band @ avg_gmv
+
+    # 区间 × BD 的月平均GMV合计
+    n_bands, n_bds = len(rank_bands), len(bd_names)
+    flat_index = (np.arange(n_bands)[:, None] * n_bds + bd_codes).ravel()
+    band_bd_gmv = np.bincount(flat_index, weights=(in_band * avg_gmv).ravel(),
+                              minlength=n_bands * n_bds).reshape(n_bands, n_bds)
+
+    # 目标 = 月平均GMV合计 × (1 + 上涨百分比)，百分比 × 区间 广播
+    factor = 1 + np.asarray(pct_list, dtype=float) / 100
+    target_gmv = factor[:, None] * band_gmv[None, :]
+    bd_target = factor[:, None, None] * band_bd_gmv[None, :, :]
+
+    labels = [scenario_label(pct, band) for pct in pct_list for band in rank_bands]
+    comparison = pd.DataFrame({
+        '场景': labels,
+        '上涨百分比': np.repeat(pct_list, n_bands),
+        '最小排名': np.tile(low, len(pct_list)),
+        '最大排名': np.tile(high, len(pct_list)),
+        '客户数': np.tile(band_count, len(pct_list)),
+        '月平均GMV合计': np.tile(band_gmv, len(pct_list)),
+        '目标GMV合计': target_gmv.ravel()
+    })
+    bd_totals = pd.DataFrame(bd_target.reshape(-1, n_bds).T, index=bd_names, columns=labels)
+    bd_totals.index.name = 'BD'
+
+    return comparison, bd_totals.reset_index()
+
+
+def scenario_label(pct, band):
+    return f"{pct:g}%_{band[0]}-{band[1]}名"
 
-    return total_gmv, filtered_customers
+
+# 多场景导出的各工作表：场景对比、BD目标汇总及每个场景的客户明细
+def scenario_sheets(customer_avg_gmv, pct_list, rank_bands):
+    comparison, bd_totals = simulate_scenarios(customer_avg_gmv, pct_list, rank_bands)
+    sheets = {'场景对比': comparison, 'BD目标汇总': bd_totals}
+    for pct in pct_list:
+        for min_rank, max_rank in rank_bands:
+            sheets[scenario_label(pct, (min_rank, max_rank))] = analyze_data(
+                customer_avg_gmv, pct, min_rank, max_rank)
+    return sheets
+
+
+# 解析逗号分隔的上涨百分比，例如 "5,10,15"
+def parse_pct_list(text):
+    return [float(item) for item in text.replace('，', ',').split(',') if item.strip()]
+
+
+# 解析逗号分隔的排名区间，例如 "1-10,11-50"
+def parse_rank_bands(text):
+    bands = []
+    for item in text.replace('，', ',').split(','):
+        if item.strip():
+            low, high = item.split('-')
+            bands.append((int(low), int(high)))
+    return bands
+
+
+# 在内存中生成Excel文件
+def to_excel(sheets):
+    output = io.BytesIO()
+    with stage('导出Excel', rows_in=sum(len(df) for df in sheets.values())), \
+            pd.ExcelWriter(output, engine='xlsxwriter') as writer:
+        for sheet_name, df in sheets.items():
+            df.to_excel(writer, index=False, sheet_name=sheet_name[:31])
+    return output.getvalue()
 
 
 # Streamlit应用
+@instrumented('app006')
 def main():
     st.title("GMV数据分析工具")
 
@@ -53,12 +162,23 @@ def main():
     uploaded_file = st.file_uploader("上传Excel文件", type=["xlsx"])
 
     if uploaded_file is not None:
-        # 读取Excel文件
-        df = pd.read_excel(uploaded_file)
+        # 读取Excel文件（同一文件只解析和汇总一次）
+        file_bytes = uploaded_file.getvalue()
+        file_hash = hashlib.sha256(file_bytes).hexdigest()
+        try:
+            preview, total_gmv, customer_avg_gmv = build_gmv_cube(file_hash, uploaded_file.name, file_bytes)
+        except ValueError as e:
+            st.error(str(e))
+            return
 
         # 显示上传的文件数据
         st.write("上传的数据预览:")
-        st.dataframe(df.head())
+        st.dataframe(preview)
+
+        mode = st.radio("分析模式", ["单一场景", "多场景对比"], horizontal=True)
+        if mode == "多场景对比":
+            scenario_grid(customer_avg_gmv, total_gmv, file_hash)
+            return
 
         # 输入客户目标上涨百分比
         target_increase_pct = st.number_input(
@@ -73,7 +193,7 @@ def main():
         max_rank = st.number_input("请输入最大排名（例如：50）", min_value=1, value=50)
 
         # 执行数据分析
-        total_gmv, filtered_customers = analyze_data(df, target_increase_pct, min_rank, max_rank)
+        filtered_customers = analyze_data(customer_avg_gmv, target_increase_pct, min_rank, max_rank)
 
         # 显示总GMV值
         st.subheader("实付GMV总和值:")
@@ -84,12 +204,62 @@ def main():
         st.write(filtered_customers)
 
         # 提供下载按钮，允许用户下载分析结果
+        # 点击后才在内存中生成文件，结果只保存在当前会话，不再写入工作目录
         result_file = "目标客户分析结果_with_cust_id.xlsx"
-        filtered_customers.to_excel(result_file, index=False)
+        export_key = (file_hash, target_increase_pct, min_rank, max_rank)
+        if st.button("生成下载文件"):
+            st.session_state.export = (export_key, to_excel({'Sheet1': filtered_customers}))
+
+        export = st.session_state.get('export')
+        if export is not None and export[0] == export_key:
+            st.download_button(
+                label="下载分析结果",
+                data=export[1],
+                file_name=result_file,
+                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+            )
+
+
+# 多场景对比界面
+def scenario_grid(customer_avg_gmv, total_gmv, file_hash):
+    pct_text = st.text_input("目标上涨百分比列表（逗号分隔）", "5,10,15,20")
+    band_text = st.text_input("排名区间列表（逗号分隔，例如 1-10,11-50）", "1-10,11-50,51-100")
+
+    try:
+        pct_list = parse_pct_list(pct_text)
+        rank_bands = parse_rank_bands(band_text)
+    except ValueError:
+        st.error("输入格式错误：百分比请用数字，排名区间请用“最小-最大”的形式，多个值用逗号分隔。")
+        return
+    if not pct_list or not rank_bands:
+        st.warning("请至少输入一个上涨百分比和一个排名区间。")
+        return
+
+    with stage('多场景模拟', rows_in=len(customer_avg_gmv)) as info:
+        comparison, bd_totals = simulate_scenarios(customer_avg_gmv, pct_list, rank_bands)
+        info.rows_out = len(comparison)
+
+    st.subheader("实付GMV总和值:")
+    st.write(total_gmv)
+
+    st.subheader(f"场景对比（共 {len(comparison)} 个场景）")
+    st.dataframe(comparison)
+
+    st.subheader("各BD目标GMV合计")
+    st.dataframe(bd_totals)
+
+    # 导出时才生成每个场景的客户明细
+    result_file = "目标客户多场景分析结果.xlsx"
+    export_key = (file_hash, tuple(pct_list), tuple(rank_bands))
+    if st.button("生成下载文件"):
+        sheets = scenario_sheets(customer_avg_gmv, pct_list, rank_bands)
+        st.session_state.scenario_export = (export_key, to_excel(sheets))
 
+    export = st.session_state.get('scenario_export')
+    if export is not None and export[0] == export_key:
         st.download_button(
             label="下载分析结果",
-            data=open(result_file, "rb").read(),
+            data=export[1],
             file_name=result_file,
             mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
         )
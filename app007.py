@@ -1,10 +1,41 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
+import os
+import re
+import sqlite3
 from datetime import datetime, timedelta
 from io import BytesIO
+from data_loader import files_digest, load_tables, load_upload, parse_dates, MissingColumnsError
+from perf import instrumented, stage
 
 # 需要类目限制的关键词（精确匹配）
 CATEGORY_RESTRICTED_KEYWORDS = {'草莓', '西瓜', '芒果', '芒'}
+RESTRICTED_KEYWORDS_LOWER = {kw.lower() for kw in CATEGORY_RESTRICTED_KEYWORDS}
+
+# 本地最后购买记录库的文件路径，只由服务器配置（环境变量 LAST_PURCHASE_DB）指定，页面不能修改；未设置时放在程序目录下
+LAST_PURCHASE_DB = (os.environ.get('LAST_PURCHASE_DB')
+                    or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'last_purchase_state.sqlite'))
+STORE_COLUMNS = ['cust_id', '商品名称', '客户名称', '类目', 'sku_id', 'BD', 'm_id', 'order_date']
+# 无效日期（NaT）在记录库中的写法：按文本比较大于任何日期，与不使用记录库时 NaT 排在最后的规则一致
+INVALID_DATE = 'NaT'
+
+# 列名标准化处理
+COLUMN_MAPPING = {
+    'sku_id': ['sku_id', 'sku'],
+    'cust_id': ['cust_id', '客户ID', 'customer_id'],
+    'order_date': ['订单日期', '下单时间'],
+    'BD': ['BD', 'bd_name'],
+    '类目': ['类目', 'category']
+}
+# 原始数据表必须包含的标准列
+REQUIRED_COLUMNS = ['类目', 'order_date', 'cust_id']
+# 只读取以下列（含各候选列名），重复度高的字符串列转为 category，ID 列降为较小的整数类型
+ORIGINAL_COLUMNS = [tuple(names) for names in COLUMN_MAPPING.values()] + ['客户名称', '商品名称', 'm_id']
+ORIGINAL_DTYPES = {
+    **dict.fromkeys(['客户名称', '商品名称', *COLUMN_MAPPING['类目'], *COLUMN_MAPPING['BD']], 'category'),
+    **dict.fromkeys([*COLUMN_MAPPING['sku_id'], *COLUMN_MAPPING['cust_id'], 'm_id'], 'integer')
+}
 
 
 def check_dependencies():
@@ -17,18 +48,26 @@ def check_dependencies():
         st.stop()
 
 
+def _compile_terms(terms):
+    """将多个关键词编译为一个正则，长词优先，一次扫描即可判断是否包含任一关键词"""
+    ordered = sorted(set(terms), key=len, reverse=True)
+    return re.compile('|'.join(map(re.escape, ordered)), re.IGNORECASE)
+
+
+def _match_codes(series, predicate):
+    """只对去重后的取值计算一次，再按编码映射回每一行（缺失值按空字符串处理）"""
+    codes, uniques = pd.factorize(series)
+    cleaned = pd.Series(uniques, dtype=object).str.lower().str.strip().fillna('')
+    hits = np.array([predicate(value) for value in cleaned] + [predicate('')], dtype=bool)
+    return hits[codes]
+
+
 def smart_product_filter(df, search_terms):
     """
     智能商品筛选（严格模式）：
     - 精确匹配预设关键词
     - 仅当搜索词完全匹配预设关键词时应用类目限制
     """
-    # 预处理
-    df_clean = df.assign(
-        clean_name=df['商品名称'].str.lower().str.strip().fillna(''),
-        category_lower=df['类目'].str.lower().str.strip()
-    )
-
     # 分离关键词类型
     restricted_terms = []
     normal_terms = []
@@ -36,7 +75,7 @@ def smart_product_filter(df, search_terms):
     # 精确匹配判断
     for term in map(str.strip, map(str, search_terms)):
         term_lower = term.lower()
-        if term_lower in {kw.lower() for kw in CATEGORY_RESTRICTED_KEYWORDS}:
+        if term_lower in RESTRICTED_KEYWORDS_LOWER:
             restricted_terms.append(term_lower)
         else:
             normal_terms.append(term_lower)
@@ -46,32 +85,235 @@ def smart_product_filter(df, search_terms):
 
     # 类目限制条件（鲜果类目 + 精确关键词匹配）
     if restricted_terms:
-        restr_cond = (df_clean['category_lower'] == '鲜果')
-        name_cond = pd.Series(False, index=df.index)
-        for term in restricted_terms:
-            # 精确包含匹配（非子字符串匹配）
-            name_cond |= df_clean['clean_name'].str.contains(
-                term, regex=False, case=False
-            )
+        pattern = _compile_terms(restricted_terms)
+        restr_cond = _match_codes(df['类目'], lambda value: value == '鲜果')
+        name_cond = _match_codes(df['商品名称'], lambda value: pattern.search(value) is not None)
         conditions.append(restr_cond & name_cond)
 
     # 普通条件（全类目模糊匹配）
     if normal_terms:
-        normal_cond = pd.Series(False, index=df.index)
-        for term in normal_terms:
-            normal_cond |= df_clean['clean_name'].str.contains(
-                term, regex=False, case=False
-            )
-        conditions.append(normal_cond)
+        pattern = _compile_terms(normal_terms)
+        conditions.append(_match_codes(df['商品名称'], lambda value: pattern.search(value) is not None))
 
     # 组合条件（OR逻辑）
     if conditions:
-        combined_cond = pd.concat(conditions, axis=1).any(axis=1)
-        return df[combined_cond]
+        return df[np.logical_or.reduce(conditions)]
 
     return df
 
 
+def extract_latest_purchases(df, keys=('客户名称', '商品名称'), date_col='order_date'):
+    """
+    每个 客户-商品 的最后一次购买记录（单次哈希分组，O(n)）：
+    - 结果（包括行的顺序）与稳定排序 sort_values(date_col, kind='stable') + drop_duplicates(keep='last') 一致
+    - 同一天多条记录时取原表中靠后的一行；改写前用默认的不稳定排序，同一天取哪一行不确定，
+      因此与改写前相比只有各组合的最后购买日期保证相同，其余列和行的顺序可能不同
+    - 含无效日期（NaT）的组合取 NaT 行
+    - 只复制胜出的行，并按日期排序输出
+    """
+    if df.empty:
+        return df.reset_index(drop=True)
+
+    # 各键列分别编码为整数后组合为组号（缺失值视为同一取值，与 drop_duplicates 一致）
+    codes = np.zeros(len(df), dtype=np.int64)
+    n_groups = 1
+    for key in keys:
+        key_codes, uniques = pd.factorize(df[key], use_na_sentinel=False)
+        codes = codes * len(uniques) + key_codes
+        n_groups *= len(uniques)
+    if n_groups > 4 * len(df):
+        # 组合空间过大时重新编码为连续组号
+        codes, uniques = pd.factorize(codes)
+        n_groups = len(uniques)
+
+    dates = df[date_col].to_numpy(dtype='datetime64[ns]')
+    # NaT 排序时排在最后，这里映射为最大值以保持一致
+    date_key = np.where(np.isnat(dates), np.iinfo(np.int64).max, dates.view('i8'))
+
+    group_max = np.full(n_groups, np.iinfo(np.int64).min)
+    np.maximum.at(group_max, codes, date_key)
+
+    # 日期等于组内最大值的行中取位置最靠后的一行
+    is_max = np.flatnonzero(date_key == group_max[codes])
+    winner = np.full(n_groups, -1)
+    np.maximum.at(winner, codes[is_max], is_max)
+
+    # 按原表位置排列后再按日期稳定排序，等价于对全表排序后的顺序
+    winner = np.sort(winner[winner >= 0])
+    order = np.argsort(date_key[winner], kind='stable')
+    return df.take(winner[order]).reset_index(drop=True)
+
+
+def store_ids(cust_id):
+    """
+    cust_id 转为记录库主键的文本：整数编号统一写成 '1' 的形式。
+    批次中有空的 cust_id 时整列读成浮点数，直接转文本会得到 '1.0'，与其他批次的 '1' 成为两个组合。
+    """
+    if pd.api.types.is_numeric_dtype(cust_id) and (cust_id.dropna() % 1 == 0).all():
+        return cust_id.astype('Int64').astype(str)
+    return cust_id.astype(str)
+
+
+class LastPurchaseStore:
+    """
+    本地最后购买记录库（SQLite），按 (cust_id, 商品名称) 保存最近一次购买：
+    - 每次只并入新订单，已有组合仅在日期不早于记录时更新
+    - 订单日期无效的行记为 INVALID_DATE：组合出现过无效日期后始终以该行为最后购买，不再出现在不活跃结果中，
+      与不使用记录库时对全部订单计算（extract_latest_purchases 取 NaT 行）的结果一致
+    - 查询任意阈值的不活跃组合时无需重新读取历史订单
+    """
+
+    def __init__(self, path=LAST_PURCHASE_DB):
+        self.conn = sqlite3.connect(path)
+        with self.conn:
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS last_purchase (
+                    cust_id TEXT NOT NULL,
+                    "商品名称" TEXT NOT NULL,
+                    "客户名称" TEXT,
+                    "类目" TEXT,
+                    sku_id,
+                    BD TEXT,
+                    m_id,
+                    order_date TEXT NOT NULL,
+                    PRIMARY KEY (cust_id, "商品名称")
+                )
+            """)
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_last_purchase_date ON last_purchase (order_date)")
+        self._merge_float_ids()
+
+    def _merge_float_ids(self):
+        """旧版本把部分整数编号保存成了 '1.0'，合并到 '1' 的记录上（按日期取较新的一条）"""
+        stale = pd.read_sql_query("SELECT * FROM last_purchase WHERE cust_id GLOB '*[0-9].0'", self.conn)
+        stale = stale[stale['cust_id'].str.fullmatch(r'-?\d+\.0')]
+        if stale.empty:
+            return
+        # 先写入规范编号的记录，再删除旧记录
+        self._upsert(stale[STORE_COLUMNS].assign(cust_id=stale['cust_id'].str[:-2]))
+        with self.conn:
+            self.conn.executemany("DELETE FROM last_purchase WHERE cust_id = ? AND \"商品名称\" = ?",
+                                  stale[['cust_id', '商品名称']].itertuples(index=False, name=None))
+
+    def ingest(self, df):
+        """并入一批订单，返回新增或更新的组合数"""
+        delta = df.dropna(subset=['cust_id', '商品名称'])
+        if delta.empty:
+            return 0
+
+        # 先在本批次内取每个组合的最后一次购买，只写入这些行
+        latest = extract_latest_purchases(delta, keys=('cust_id', '商品名称')).reindex(columns=STORE_COLUMNS)
+        latest['order_date'] = latest['order_date'].dt.strftime('%Y-%m-%d %H:%M:%S').fillna(INVALID_DATE)
+        latest['cust_id'] = store_ids(latest['cust_id'])
+        latest['商品名称'] = latest['商品名称'].astype(str)
+        return self._upsert(latest)
+
+    def _upsert(self, latest):
+        """写入 STORE_COLUMNS 各列的行，已有组合仅在日期不早于记录时更新，返回新增或更新的组合数"""
+        latest = latest.astype(object).where(latest.notna(), None)
+        columns = ', '.join(f'"{col}"' for col in STORE_COLUMNS)
+        updates = ', '.join(f'"{col}" = excluded."{col}"' for col in STORE_COLUMNS[2:])
+        before = self.conn.total_changes
+        with self.conn:
+            self.conn.executemany(
+                f"""
+                INSERT INTO last_purchase ({columns}) VALUES ({', '.join('?' * len(STORE_COLUMNS))})
+                ON CONFLICT (cust_id, "商品名称") DO UPDATE SET {updates}
+                WHERE excluded.order_date >= last_purchase.order_date
+                """,
+                latest.itertuples(index=False, name=None)
+            )
+        return self.conn.total_changes - before
+
+    def stats(self):
+        """返回 (组合数, 最新订单日期)，最新订单日期不计无效日期"""
+        return self.conn.execute("SELECT COUNT(*), MAX(NULLIF(order_date, ?)) FROM last_purchase",
+                                 [INVALID_DATE]).fetchone()
+
+    def inactive_since(self, threshold_date):
+        """查询最后购买日期早于阈值日期的组合（最后购买为无效日期的组合不在其中）"""
+        result = pd.read_sql_query(
+            "SELECT * FROM last_purchase WHERE order_date < ? ORDER BY order_date",
+            self.conn,
+            params=[pd.Timestamp(threshold_date).strftime('%Y-%m-%d %H:%M:%S')]
+        )
+        result['order_date'], _ = parse_dates(result['order_date'])
+        # cust_id 作为主键按文本保存，取出时还原为整数（与不使用记录库时的结果一致；带前导零等的编号保持文本）
+        cust_id = pd.to_numeric(result['cust_id'], errors='coerce')
+        if cust_id.notna().all() and (cust_id.astype('int64').astype(str) == result['cust_id']).all():
+            result['cust_id'] = cust_id.astype('int64')
+        # 原始数据中没有的可选列不出现在结果中
+        return result.drop(columns=[col for col in ['BD', 'm_id'] if result[col].isna().all()])
+
+
+def read_original_files(files, max_workers=None):
+    """多个原始数据文件（[(文件名, 内容), ...]）并行解析后合并，各文件的列名先按 COLUMN_MAPPING 标准化"""
+    return load_tables(files, [tuple(COLUMN_MAPPING[name]) for name in REQUIRED_COLUMNS], '原始数据表',
+                       columns=ORIGINAL_COLUMNS, dtypes=ORIGINAL_DTYPES, aliases=COLUMN_MAPPING,
+                       max_workers=max_workers)
+
+
+@st.cache_data(show_spinner="正在读取原始数据...", max_entries=4)
+def read_original_data(files_key, _files):
+    """按所有文件内容的组合哈希缓存"""
+    return read_original_files(_files)
+
+
+def load_original_data(original_files):
+    """读取原始数据表并标准化列名，缺少必要列时返回 None"""
+    # 先只读取表头检查必要列，缺列时无需等待完整解析
+    files = [(f.name, f.getvalue()) for f in original_files]
+    try:
+        return read_original_data(files_digest(files), files)
+    except MissingColumnsError as e:
+        st.error(f"❌ {e}")
+        return None
+
+
+def find_inactive(df, threshold_days, now=None):
+    """
+    每个客户-商品的最后一次购买早于 now 减去阈值天数的组合（结果列名 order_date 改为“最后购买日期”）。
+    返回 (不活跃商品表, 无效日期的行数)，无效日期的行不参与判断。
+    """
+    # 日期处理
+    dates, _ = parse_dates(df['order_date'])
+    df = df.assign(order_date=dates)
+    invalid_count = int(df['order_date'].isnull().sum())
+
+    # 计算阈值日期
+    threshold_date = (now or datetime.now()) - timedelta(days=threshold_days)
+
+    # 获取最新购买记录
+    with stage('最新购买', rows_in=len(df)) as info:
+        latest_purchases = extract_latest_purchases(df)
+        info.rows_out = len(latest_purchases)
+
+    # 筛选不活跃商品
+    inactive_df = latest_purchases[latest_purchases['order_date'] < threshold_date]
+
+    # 结果处理（修正版本）
+    result_columns = [
+        '客户名称',
+        'cust_id',
+        '商品名称',
+        '类目',
+        'sku_id',
+        'order_date'  # 确保包含日期列
+    ]
+
+    # 动态插入可选列
+    if 'BD' in df.columns:
+        result_columns.insert(5, 'BD')
+    if 'm_id' in df.columns:
+        result_columns.append('m_id')
+
+    # 执行列选择和重命名
+    inactive_df = inactive_df[result_columns].rename(
+        columns={'order_date': '最后购买日期'}
+    )
+    return inactive_df, invalid_count
+
+
+@instrumented('app007')
 def main():
     check_dependencies()
 
@@ -79,10 +321,11 @@ def main():
     st.sidebar.header("文件上传")
 
     # 文件上传组件
-    original_file = st.sidebar.file_uploader(
-        "1. 原始数据表 (Excel/CSV)",
+    original_files = st.sidebar.file_uploader(
+        "1. 原始数据表 (Excel/CSV，可多选)",
         type=["xlsx", "xls", "csv"],
-        key="original"
+        key="original",
+        accept_multiple_files=True
     )
 
     customer_matching_file = st.sidebar.file_uploader(
@@ -111,47 +354,48 @@ def main():
         help="自定义结果文件的名称"
     )
 
+    # 增量模式
+    st.sidebar.header("增量模式")
+    use_store = st.sidebar.checkbox(
+        "使用本地最后购买记录库",
+        help="原始数据表只需包含上次运行以来的新订单，并入记录库后直接查询；不上传文件则只查询记录库"
+    )
+
     if st.sidebar.button("🚀 开始分析"):
-        if not original_file:
+        if not original_files and not use_store:
             st.error("❌ 请先上传原始数据表")
             return
 
         try:
-            # 读取原始数据
-            if original_file.name.endswith(('.xlsx', '.xls')):
-                df = pd.read_excel(original_file)
-            else:
-                df = pd.read_csv(original_file)
-
-            # 列名标准化处理
-            COLUMN_MAPPING = {
-                'sku_id': ['sku_id', 'sku'],
-                'cust_id': ['cust_id', '客户ID', 'customer_id'],
-                'order_date': ['订单日期', '下单时间'],
-                'BD': ['BD', 'bd_name'],
-                '类目': ['类目', 'category']
-            }
-
-            # 自动识别列名
-            missing_columns = []
-            for standard_name, possible_names in COLUMN_MAPPING.items():
-                found = [n for n in possible_names if n in df.columns]
-                if found:
-                    if found[0] != standard_name:
-                        df.rename(columns={found[0]: standard_name}, inplace=True)
-                else:
-                    if standard_name in ['类目', 'order_date', 'cust_id']:
-                        missing_columns.append(standard_name)
-
-            if missing_columns:
-                st.error(f"❌ 缺少必要列：{', '.join(missing_columns)}")
-                return
+            if original_files:
+                df = load_original_data(original_files)
+                if df is None:
+                    return
+
+            if use_store:
+                store = LastPurchaseStore()
+                try:
+                    if original_files:
+                        # 只并入本次上传的新订单，历史记录不再重新扫描
+                        df['order_date'], _ = parse_dates(df['order_date'])
+                        with stage('并入记录库', rows_in=len(df)) as info:
+                            updated = store.ingest(df)
+                            info.rows_out = updated
+                        st.success(f"✅ 已并入 {len(df)} 条新订单，更新 {updated} 个客户-商品组合")
+                    total_pairs, latest_date = store.stats()
+                    st.info(f"📦 记录库共 {total_pairs} 个客户-商品组合，最新订单日期：{latest_date or '无'}")
+                    # 直接从记录库查询超过阈值未购买的组合
+                    with stage('查询记录库', rows_in=total_pairs) as info:
+                        df = store.inactive_since(datetime.now() - timedelta(days=threshold_days))
+                        info.rows_out = len(df)
+                finally:
+                    store.conn.close()
 
             # 客户匹配处理
             if customer_matching_file:
-                customer_df = pd.read_excel(customer_matching_file) if customer_matching_file.name.endswith(
-                    ('.xlsx', '.xls')) else pd.read_csv(customer_matching_file)
-                if '客户名称' not in customer_df.columns:
+                try:
+                    customer_df = load_upload(customer_matching_file, ['客户名称'], '客户匹配表')
+                except MissingColumnsError:
                     st.error("⛔ 客户匹配表必须包含「客户名称」列")
                     return
                 df = df[df['客户名称'].isin(customer_df['客户名称'])]
@@ -159,9 +403,9 @@ def main():
 
             # 商品智能匹配
             if product_matching_file:
-                product_df = pd.read_excel(product_matching_file) if product_matching_file.name.endswith(
-                    ('.xlsx', '.xls')) else pd.read_csv(product_matching_file)
-                if '商品名称' not in product_df.columns:
+                try:
+                    product_df = load_upload(product_matching_file, ['商品名称'], '商品匹配表')
+                except MissingColumnsError:
                     st.error("⛔ 商品匹配表必须包含「商品名称」列")
                     return
 
@@ -169,16 +413,16 @@ def main():
                 original_count = len(df)
 
                 try:
-                    df = smart_product_filter(df, search_terms)
+                    with stage('商品筛选', rows_in=original_count) as info:
+                        df = smart_product_filter(df, search_terms)
+                        info.rows_out = len(df)
                 except KeyError as e:
                     st.error(f"❌ 数据列缺失：{str(e)}")
                     return
 
                 # 统计匹配情况
-                matched_restricted = [t for t in search_terms if
-                                      t.lower() in {kw.lower() for kw in CATEGORY_RESTRICTED_KEYWORDS}]
-                matched_normal = [t for t in search_terms if
-                                  t.lower() not in {kw.lower() for kw in CATEGORY_RESTRICTED_KEYWORDS}]
+                matched_restricted = [t for t in search_terms if t.lower() in RESTRICTED_KEYWORDS_LOWER]
+                matched_normal = [t for t in search_terms if t.lower() not in RESTRICTED_KEYWORDS_LOWER]
 
                 st.success(f"""
                 ✅ 商品智能匹配完成：
@@ -191,51 +435,15 @@ def main():
                     st.error("⚠️ 没有匹配到任何商品，请检查匹配条件")
                     return
 
-            # 日期处理
-            df['order_date'] = pd.to_datetime(df['order_date'], errors='coerce')
-            if df['order_date'].isnull().any():
-                invalid_count = df['order_date'].isnull().sum()
+            inactive_df, invalid_count = find_inactive(df, threshold_days)
+            if invalid_count:
                 st.warning(f"⚠️ 发现 {invalid_count} 条无效日期记录，已自动排除")
 
-            # 计算阈值日期
-            threshold_date = datetime.now() - timedelta(days=threshold_days)
-
-            # 获取最新购买记录
-            latest_purchases = (
-                df.sort_values('order_date')
-                .drop_duplicates(['客户名称', '商品名称'], keep='last')
-                .reset_index(drop=True)
-            )
-
-            # 筛选不活跃商品
-            inactive_df = latest_purchases[latest_purchases['order_date'] < threshold_date]
-
             if inactive_df.empty:
                 st.balloons()
                 st.success(f"🎉 所有商品在过去 {threshold_days} 天都有购买记录")
                 return
 
-            # 结果处理（修正版本）
-            result_columns = [
-                '客户名称',
-                'cust_id',
-                '商品名称',
-                '类目',
-                'sku_id',
-                'order_date'  # 确保包含日期列
-            ]
-
-            # 动态插入可选列
-            if 'BD' in df.columns:
-                result_columns.insert(5, 'BD')
-            if 'm_id' in df.columns:
-                result_columns.append('m_id')
-
-            # 执行列选择和重命名
-            inactive_df = inactive_df[result_columns].rename(
-                columns={'order_date': '最后购买日期'}
-            )
-
             # 显示结果
             st.subheader(f"📑 分析结果（共 {len(inactive_df)} 条不活跃商品）")
             st.dataframe(
@@ -250,7 +458,7 @@ def main():
 
             # 生成下载文件
             output = BytesIO()
-            with pd.ExcelWriter(output, engine='openpyxl') as writer:
+            with stage('导出Excel', rows_in=len(inactive_df)), pd.ExcelWriter(output, engine='openpyxl') as writer:
                 inactive_df.to_excel(writer, index=False, sheet_name='不活跃商品')
 
             st.download_button(
@@ -2,8 +2,98 @@ import streamlit as st
 import pandas as pd
 from datetime import datetime, timedelta
 from io import BytesIO
-
-
+from data_loader import check_columns, files_digest, load_tables, parse_dates, read_table
+from perf import instrumented, stage
+
+# 必要列
+RAW_COLUMNS = ['订单日期', '商品描述', '商品名称', 'sku_id', '客户名称', 'bd_name', '销量']
+BONUS_COLUMNS = ['商品名称', 'SKU', '存量佣金', '增量佣金']
+# 原始数据表只读取必要列，重复度高的字符串列转为 category，整数列降为较小的整数类型
+RAW_DTYPES = {'商品名称': 'category', '客户名称': 'category', 'bd_name': 'category', '商品描述': 'category',
+              'sku_id': 'integer', '销量': 'integer'}
+
+
+# 多个原始数据文件并行解析后合并
+def read_raw_data(files, max_workers=None):
+    return load_tables(files, RAW_COLUMNS, '原始数据表', columns=[], dtypes=RAW_DTYPES, max_workers=max_workers)
+
+
+# 按所有文件内容的组合哈希缓存
+@st.cache_data(show_spinner=False, max_entries=4)
+def load_raw_data(files_key, _files):
+    return read_raw_data(_files)
+
+
+def compute_commission(raw_df, bonus_df, start_date, end_date):
+    """按存量/增量佣金计算奖金周期内的激励，返回 (BD汇总表（含总计行）, 明细表)"""
+    # 数据校验与预处理
+    raw_df = raw_df.copy()
+    bonus_df = bonus_df.copy()
+    raw_df['sku_id'] = pd.to_numeric(raw_df['sku_id'], errors='coerce')
+    bonus_df['SKU'] = pd.to_numeric(bonus_df['SKU'], errors='coerce')
+    with stage('合并奖金表', rows_in=len(raw_df)) as info:
+        merged_df = pd.merge(raw_df, bonus_df, left_on=['商品名称', 'sku_id'], right_on=['商品名称', 'SKU'])
+        info.rows_out = len(merged_df)
+
+    # 日期处理与筛选
+    # 只解析去重后的日期取值；与改写前一样只接受 '%Y/%m/%d'，按原始时间比较
+    merged_df['订单日期'] = parse_dates(merged_df['订单日期'], '%Y/%m/%d')[0]
+    start_dt = pd.Timestamp(start_date)
+    end_dt = pd.Timestamp(end_date)
+    period_mask = (merged_df['订单日期'] >= start_dt) & (merged_df['订单日期'] <= end_dt)
+    period_orders = merged_df[period_mask].copy()
+
+    # 存量/增量判断
+    lookback_start = start_dt - timedelta(days=90)
+
+    def check_history(row):
+        client_mask = (merged_df['客户名称'] == row['客户名称']) & \
+                      (merged_df['商品名称'] == row['商品名称']) & \
+                      (merged_df['订单日期'] >= lookback_start) & \
+                      (merged_df['订单日期'] < start_dt)
+        return '存量' if any(client_mask) else '增量'
+
+    with stage('存量判断', rows_in=len(period_orders)) as info:
+        period_orders['类型'] = period_orders.apply(check_history, axis=1)
+        info.rows_out = len(period_orders)
+
+    # 奖金计算
+    period_orders['奖金'] = period_orders.apply(
+        lambda x: x['销量'] * x['存量佣金'] if x['类型'] == '存量' else x['销量'] * x['增量佣金'], axis=1)
+
+    # ================== 结果生成 ==================
+    # 汇总统计（增加总计行）
+    with stage('分组汇总', rows_in=len(period_orders)) as info:
+        summary_df = period_orders.groupby('bd_name', observed=True).agg(
+            总奖金=('奖金', 'sum'),
+            存量奖金=('奖金', lambda x: x[period_orders.loc[x.index, '类型'] == '存量'].sum()),
+            增量奖金=('奖金', lambda x: x[period_orders.loc[x.index, '类型'] == '增量'].sum())
+        ).reset_index()
+        info.rows_out = len(summary_df)
+
+    # 添加总计行
+    total = summary_df.sum(numeric_only=True)
+    total['bd_name'] = '总计'
+    summary_df = pd.concat([summary_df, pd.DataFrame([total])], ignore_index=True)
+
+    # 明细数据
+    detail_df = period_orders[[
+        '客户名称', '商品名称', '商品描述', 'sku_id',
+        'bd_name', '销量', '奖金', '类型'
+    ]]
+    return summary_df, detail_df
+
+
+# 在内存中生成Excel报告
+def to_excel(summary_df, detail_df):
+    output = BytesIO()
+    with stage('导出Excel', rows_in=len(detail_df)), pd.ExcelWriter(output, engine='xlsxwriter') as writer:
+        summary_df.to_excel(writer, sheet_name='奖金汇总', index=False)
+        detail_df.to_excel(writer, sheet_name='明细数据', index=False)
+    return output.getvalue()
+
+
+@instrumented('app008')
 def calculate_commission():
     st.set_page_config(
         page_title="新版销售激励--大麦",
@@ -31,7 +121,8 @@ def calculate_commission():
     with st.container():
         col1, col2, col3 = st.columns([1, 1, 2])
         with col1.expander("📤 1. 上传数据", expanded=True):
-            raw_file = st.file_uploader("原始数据表", type=["xlsx", "csv"], key="raw")
+            raw_file = st.file_uploader("原始数据表（可多选）", type=["xlsx", "csv"], key="raw",
+                                        accept_multiple_files=True)
             bonus_file = st.file_uploader("标品奖金表", type=["xlsx", "csv"], key="bonus")
 
         with col2.expander("📅 2. 设置周期", expanded=True):
@@ -55,55 +146,13 @@ def calculate_commission():
         with st.spinner('⏳ 数据解析中...'):
             try:
                 # ================== 数据处理逻辑 ==================
-                raw_df = pd.read_excel(raw_file) if raw_file.name.endswith('.xlsx') else pd.read_csv(raw_file)
-                bonus_df = pd.read_excel(bonus_file) if bonus_file.name.endswith('.xlsx') else pd.read_csv(bonus_file)
-
-                # 数据校验与预处理
-                raw_df['sku_id'] = pd.to_numeric(raw_df['sku_id'], errors='coerce')
-                bonus_df['SKU'] = pd.to_numeric(bonus_df['SKU'], errors='coerce')
-                merged_df = pd.merge(raw_df, bonus_df, left_on=['商品名称', 'sku_id'], right_on=['商品名称', 'SKU'])
-
-                # 日期处理与筛选
-                merged_df['订单日期'] = pd.to_datetime(merged_df['订单日期'], format='%Y/%m/%d', errors='coerce')
-                start_dt = pd.Timestamp(start_date)
-                end_dt = pd.Timestamp(end_date)
-                period_mask = (merged_df['订单日期'] >= start_dt) & (merged_df['订单日期'] <= end_dt)
-                period_orders = merged_df[period_mask].copy()
-
-                # 存量/增量判断
-                lookback_start = start_dt - timedelta(days=90)
-
-                def check_history(row):
-                    client_mask = (merged_df['客户名称'] == row['客户名称']) & \
-                                  (merged_df['商品名称'] == row['商品名称']) & \
-                                  (merged_df['订单日期'] >= lookback_start) & \
-                                  (merged_df['订单日期'] < start_dt)
-                    return '存量' if any(client_mask) else '增量'
-
-                period_orders['类型'] = period_orders.apply(check_history, axis=1)
-
-                # 奖金计算
-                period_orders['奖金'] = period_orders.apply(
-                    lambda x: x['销量'] * x['存量佣金'] if x['类型'] == '存量' else x['销量'] * x['增量佣金'], axis=1)
-
-                # ================== 结果生成 ==================
-                # 汇总统计（增加总计行）
-                summary_df = period_orders.groupby('bd_name').agg(
-                    总奖金=('奖金', 'sum'),
-                    存量奖金=('奖金', lambda x: x[period_orders.loc[x.index, '类型'] == '存量'].sum()),
-                    增量奖金=('奖金', lambda x: x[period_orders.loc[x.index, '类型'] == '增量'].sum())
-                ).reset_index()
-
-                # 添加总计行
-                total = summary_df.sum(numeric_only=True)
-                total['bd_name'] = '总计'
-                summary_df = pd.concat([summary_df, pd.DataFrame([total])], ignore_index=True)
-
-                # 明细数据
-                detail_df = period_orders[[
-                    '客户名称', '商品名称', '商品描述', 'sku_id',
-                    'bd_name', '销量', '奖金', '类型'
-                ]]
+                # 先只读取各文件的表头检查必要列，再完整解析
+                check_columns(bonus_file.name, bonus_file.getvalue(), BONUS_COLUMNS, '标品奖金表')
+                raw_files = [(f.name, f.getvalue()) for f in raw_file]
+                raw_df = load_raw_data(files_digest(raw_files), raw_files)
+                bonus_df = read_table(bonus_file.name, bonus_file.getvalue())
+
+                summary_df, detail_df = compute_commission(raw_df, bonus_df, start_date, end_date)
 
                 # ================== 结果展示 ==================
                 st.success("✅ 分析完成！")
@@ -139,19 +188,13 @@ def calculate_commission():
                     )
 
                 # ================== 整合下载功能 ==================
-                with BytesIO() as output:
-                    with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-                        summary_df.to_excel(writer, sheet_name='奖金汇总', index=False)
-                        detail_df.to_excel(writer, sheet_name='明细数据', index=False)
-                    output.seek(0)
-
-                    st.download_button(
-                        label="📥 下载完整分析报告 (Excel)",
-                        data=output,
-                        file_name=f'销售激励分析_{start_date}至{end_date}.xlsx',
-                        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                        use_container_width=True
-                    )
+                st.download_button(
+                    label="📥 下载完整分析报告 (Excel)",
+                    data=to_excel(summary_df, detail_df),
+                    file_name=f'销售激励分析_{start_date}至{end_date}.xlsx',
+                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                    use_container_width=True
+                )
 
             except Exception as e:
                 st.error(f"❌ 处理错误：{str(e)}")
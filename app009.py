@@ -1,37 +1,60 @@
 import streamlit as st
 import pandas as pd
 from datetime import datetime, timedelta
+from data_loader import files_digest, load_tables, parse_dates, MissingColumnsError, SOURCE_COLUMN
+from perf import instrumented, stage
 
-st.set_page_config(page_title="新版销售激励（鲜果）--大麦", layout="wide")
-st.title("新版销售激励（鲜果）--大麦分析工具")
+REQUIRED_COLS = {
+    "原始数据表": ["订单日期", "商品描述", "商品名称", "一级类目", "客户名称", "sku_id", "bd_name", "销量"],
+    "鲜果奖金表": ["关键词", "规格", "存量奖金", "增量奖金"]
+}
 
 
-def load_data(file, name):
-    """加载并校验数据（未修改）"""
-    try:
-        if file.name.endswith('.csv'):
-            df = pd.read_csv(file)
-        elif file.name.endswith(('.xls', '.xlsx')):
-            df = pd.read_excel(file)
-        else:
-            st.error(f"错误：{name}仅支持.csv或.xlsx格式！")
-            return None
+def read_data_files(files, name, max_workers=None):
+    """多个文件（[(文件名, 内容), ...]）并行解析后合并；原始数据表记录每行的来源文件"""
+    source_column = SOURCE_COLUMN if name == "原始数据表" else None
+    df = load_tables(files, REQUIRED_COLS[name], name, source_column=source_column, max_workers=max_workers)
+    if source_column:
+        # 多个导出文件有重叠时，与合并成一个文件后的去重结果一致
+        df = df.drop_duplicates(subset=[col for col in df.columns if col != source_column])
+    return df
+
+
+@st.cache_data(show_spinner=False, max_entries=4)
+def read_files(files_key, _files, name):
+    """按所有文件内容的组合哈希缓存"""
+    return read_data_files(_files, name)
+
+
+def normalize_order_dates(df):
+    """订单日期按 '%Y/%m/%d' 解析并过滤无效日期，返回 (处理后的表, 无法解析的行数)"""
+    # 只解析去重后的日期取值；与改写前一样只接受 '%Y/%m/%d'，按原始时间比较
+    dates, invalid_dates = parse_dates(df["订单日期"], "%Y/%m/%d")
+    df = df.assign(订单日期=dates)
+    return df.dropna(subset=["订单日期"]), invalid_dates
 
-        required_cols = {
-            "原始数据表": ["订单日期", "商品描述", "商品名称", "一级类目", "客户名称", "sku_id", "bd_name", "销量"],
-            "鲜果奖金表": ["关键词", "规格", "存量奖金", "增量奖金"]
-        }[name]
 
-        missing_cols = [col for col in required_cols if col not in df.columns]
-        if missing_cols:
-            st.error(f"错误：{name}缺少必需列：{missing_cols}")
+def load_data(files, name):
+    """加载并校验数据，files 为一个或多个上传文件"""
+    try:
+        for file in files:
+            if not file.name.endswith(('.csv', '.xls', '.xlsx')):
+                st.error(f"错误：{name}仅支持.csv或.xlsx格式！")
+                return None
+
+        # 先只读取表头检查必需列，缺列时无需等待完整解析
+        uploads = [(file.name, file.getvalue()) for file in files]
+        try:
+            df = read_files(files_digest(uploads), uploads, name)
+        except MissingColumnsError as e:
+            st.error(f"错误：{name}缺少必需列：{e.missing}")
             return None
 
         if name == "原始数据表":
-            df["订单日期"] = pd.to_datetime(df["订单日期"], format="%Y/%m/%d", errors="coerce")
-            if df["订单日期"].isna().any():
-                st.warning("注意：原始数据表中存在无法解析的订单日期，已过滤无效日期")
-                df = df.dropna(subset=["订单日期"])
+            rows = len(df)
+            df, invalid_dates = normalize_order_dates(df)
+            if len(df) < rows:
+                st.warning(f"注意：原始数据表中存在无法解析的订单日期（{invalid_dates} 条），已过滤无效日期")
 
         return df
 
@@ -40,9 +63,145 @@ def load_data(file, name):
         return None
 
 
+def compute_fruit_bonus(raw_df, bonus_df, start_date, end_date):
+    """
+    按关键词和规格匹配鲜果奖金，区分存量/增量计算奖金时间段内的奖金。
+    返回 (BD奖金统计（含总计行）, 奖金明细)；没有匹配到任何商品时返回 None。
+    """
+    # 预处理奖金表（清洗规格并重置索引）
+    bonus_df = bonus_df.drop_duplicates().reset_index(drop=True)
+    bonus_df["规格_clean"] = bonus_df["规格"].str.replace(r"\s+", "", regex=True)
+
+    with stage('关键词匹配', rows_in=len(raw_df)) as info:
+        # 生成笛卡尔积（原始数据 × 奖金表）
+        merged_df = raw_df.assign(key=1).merge(bonus_df.assign(key=1), on="key").drop(columns="key")
+        merged_df = merged_df.drop_duplicates().reset_index(drop=True)
+
+        # 关键词匹配
+        merged_df["关键词匹配"] = merged_df.apply(
+            lambda row: row["关键词"] in str(row["商品名称"]), axis=1
+        )
+        merged_df = merged_df[merged_df["关键词匹配"]].drop_duplicates().reset_index(drop=True)
+        info.rows_out = len(merged_df)
+
+    # 筛选一级类目为"鲜果"
+    merged_df = merged_df[merged_df["一级类目"] == "鲜果"].drop_duplicates().reset_index(drop=True)
+
+    # 预处理商品描述（清洗空格）
+    merged_df["商品描述_clean"] = merged_df["商品描述"].str.replace(r"\s+", "", regex=True)
+
+    with stage('规格匹配', rows_in=len(merged_df)) as info:
+        # 规格匹配
+        merged_df["规格匹配"] = merged_df.apply(
+            lambda row: row["规格_clean"] in row["商品描述_clean"], axis=1
+        )
+        merged_df = merged_df.drop_duplicates().reset_index(drop=True)
+        info.rows_out = int(merged_df["规格匹配"].sum())
+
+    # 分离匹配和未匹配规格的记录
+    matched = merged_df[merged_df["规格匹配"]].drop_duplicates().reset_index(drop=True)
+    unmatched = merged_df[~merged_df["规格匹配"]].drop_duplicates().reset_index(drop=True)
+
+    # 处理未匹配规格（合并"其他"规格）
+    other_specs = bonus_df[bonus_df["规格"] == "其他"][["关键词", "规格", "存量奖金", "增量奖金"]]
+    if not other_specs.empty:
+        unmatched = unmatched[
+            ["订单日期", "商品描述", "商品名称", "一级类目", "客户名称", "sku_id", "bd_name", "销量", "关键词",
+             "规格_clean"]]
+        unmatched = unmatched.merge(other_specs, on="关键词", how="left")
+        unmatched = unmatched.dropna(subset=["规格"]).drop_duplicates().reset_index(drop=True)
+        analysis_df = pd.concat([matched, unmatched], ignore_index=True)
+    else:
+        analysis_df = matched.reset_index(drop=True)
+
+    if analysis_df.empty:
+        return None
+
+    # 存量/增量判定
+    base_start = start_date - timedelta(days=90)
+    base_end = start_date - timedelta(days=1)
+
+    bonus_period = analysis_df[
+        (analysis_df["订单日期"] >= pd.Timestamp(start_date)) &
+        (analysis_df["订单日期"] <= pd.Timestamp(end_date))
+        ].drop_duplicates().reset_index(drop=True)
+
+    base_period = analysis_df[
+        (analysis_df["订单日期"] >= pd.Timestamp(base_start)) &
+        (analysis_df["订单日期"] <= pd.Timestamp(base_end))
+        ].drop_duplicates().reset_index(drop=True)
+
+    with stage('存量判断', rows_in=len(bonus_period)) as info:
+        bonus_period["唯一标识"] = bonus_period["客户名称"] + "_" + bonus_period["关键词"] + "_" + bonus_period[
+            "商品名称"]
+        bonus_period = bonus_period.drop_duplicates(subset=["唯一标识"]).reset_index(drop=True)
+
+        base_period["唯一标识"] = base_period["客户名称"] + "_" + base_period["关键词"] + "_" + base_period[
+            "商品名称"]
+        base_period = base_period.drop_duplicates(subset=["唯一标识"]).reset_index(drop=True)
+
+        existing_ids = set(base_period["唯一标识"].unique())
+        bonus_period["类型"] = bonus_period["唯一标识"].apply(
+            lambda x: "存量" if x in existing_ids else "增量"
+        )
+        info.rows_out = len(bonus_period)
+
+    # 奖金计算（保留两位小数）
+    bonus_period["奖金金额"] = bonus_period.apply(
+        lambda row: round(row["销量"] * row["存量奖金"], 2) if row["类型"] == "存量"
+        else round(row["销量"] * row["增量奖金"], 2), axis=1
+    )
+    bonus_period = bonus_period.drop_duplicates().reset_index(drop=True)
+
+    with stage('分组汇总', rows_in=len(bonus_period)) as info:
+        # 汇总明细（含商品描述）
+        detail_cols = [
+            "bd_name", "客户名称", "商品名称", "关键词", "规格", "商品描述",
+            "销量", "类型", "奖金金额"
+        ]
+        detail_df = bonus_period[detail_cols].groupby(
+            ["bd_name", "客户名称", "商品名称", "关键词", "规格", "商品描述", "类型"],
+            as_index=False
+        ).agg({"销量": "sum", "奖金金额": "sum"})
+        detail_df["奖金金额"] = detail_df["奖金金额"].round(2)  # 明细保留两位小数
+        detail_df = detail_df[detail_df["奖金金额"] > 0].drop_duplicates().reset_index(drop=True)
+
+        # 按BD汇总奖金（新增"共计奖金"列）
+        summary_df = detail_df.groupby("bd_name", as_index=False).agg(
+            存量奖金总额=pd.NamedAgg(column="奖金金额",
+                                     aggfunc=lambda x: x[detail_df["类型"] == "存量"].sum().round(2)),
+            增量奖金总额=pd.NamedAgg(column="奖金金额",
+                                     aggfunc=lambda x: x[detail_df["类型"] == "增量"].sum().round(2))
+        )
+        # 计算共计奖金（存量+增量）
+        summary_df["共计奖金"] = (summary_df["存量奖金总额"] + summary_df["增量奖金总额"]).round(2)
+        summary_df[["存量奖金总额", "增量奖金总额", "共计奖金"]] = summary_df[
+            ["存量奖金总额", "增量奖金总额", "共计奖金"]].fillna(0)
+        summary_df = summary_df.drop_duplicates().reset_index(drop=True)
+        info.rows_out = len(detail_df)
+
+    # 计算总计行（含共计奖金）
+    total_increment = round(summary_df["增量奖金总额"].sum(), 2)
+    total_stock = round(summary_df["存量奖金总额"].sum(), 2)
+    total_total = round(total_stock + total_increment, 2)
+    total_row = pd.DataFrame({
+        "bd_name": ["总计"],
+        "存量奖金总额": [total_stock],
+        "增量奖金总额": [total_increment],
+        "共计奖金": [total_total]
+    })
+    summary_with_total = pd.concat([summary_df, total_row], ignore_index=True)
+    return summary_with_total, detail_df
+
+
+@instrumented('app009')
 def main():
+    st.set_page_config(page_title="新版销售激励（鲜果）--大麦", layout="wide")
+    st.title("新版销售激励（鲜果）--大麦分析工具")
+
     st.subheader("1. 上传数据")
-    raw_file = st.file_uploader("请上传原始数据表（.csv/.xlsx）", type=["csv", "xls", "xlsx"], key="raw")
+    raw_file = st.file_uploader("请上传原始数据表（.csv/.xlsx，可多选）", type=["csv", "xls", "xlsx"], key="raw",
+                                accept_multiple_files=True)
     bonus_file = st.file_uploader("请上传鲜果奖金表（.csv/.xlsx）", type=["csv", "xls", "xlsx"], key="bonus")
 
     if not (raw_file and bonus_file):
@@ -50,7 +209,7 @@ def main():
         return
 
     raw_df = load_data(raw_file, "原始数据表")
-    bonus_df = load_data(bonus_file, "鲜果奖金表")
+    bonus_df = load_data([bonus_file], "鲜果奖金表")
     if raw_df is None or bonus_df is None:
         return
 
@@ -67,123 +226,11 @@ def main():
 
     if st.button("开始分析"):
         with st.spinner("分析中..."):
-            # ---------------------- 数据处理核心逻辑 ----------------------
-            # 预处理奖金表（清洗规格并重置索引）
-            bonus_df = bonus_df.drop_duplicates().reset_index(drop=True)
-            bonus_df["规格_clean"] = bonus_df["规格"].str.replace(r"\s+", "", regex=True)
-
-            # 生成笛卡尔积（原始数据 × 奖金表）
-            merged_df = raw_df.assign(key=1).merge(bonus_df.assign(key=1), on="key").drop(columns="key")
-            merged_df = merged_df.drop_duplicates().reset_index(drop=True)
-
-            # 关键词匹配
-            merged_df["关键词匹配"] = merged_df.apply(
-                lambda row: row["关键词"] in str(row["商品名称"]), axis=1
-            )
-            merged_df = merged_df[merged_df["关键词匹配"]].drop_duplicates().reset_index(drop=True)
-
-            # 筛选一级类目为"鲜果"
-            merged_df = merged_df[merged_df["一级类目"] == "鲜果"].drop_duplicates().reset_index(drop=True)
-
-            # 预处理商品描述（清洗空格）
-            merged_df["商品描述_clean"] = merged_df["商品描述"].str.replace(r"\s+", "", regex=True)
-
-            # 规格匹配
-            merged_df["规格匹配"] = merged_df.apply(
-                lambda row: row["规格_clean"] in row["商品描述_clean"], axis=1
-            )
-            merged_df = merged_df.drop_duplicates().reset_index(drop=True)
-
-            # 分离匹配和未匹配规格的记录
-            matched = merged_df[merged_df["规格匹配"]].drop_duplicates().reset_index(drop=True)
-            unmatched = merged_df[~merged_df["规格匹配"]].drop_duplicates().reset_index(drop=True)
-
-            # 处理未匹配规格（合并"其他"规格）
-            other_specs = bonus_df[bonus_df["规格"] == "其他"][["关键词", "规格", "存量奖金", "增量奖金"]]
-            if not other_specs.empty:
-                unmatched = unmatched[
-                    ["订单日期", "商品描述", "商品名称", "一级类目", "客户名称", "sku_id", "bd_name", "销量", "关键词",
-                     "规格_clean"]]
-                unmatched = unmatched.merge(other_specs, on="关键词", how="left")
-                unmatched = unmatched.dropna(subset=["规格"]).drop_duplicates().reset_index(drop=True)
-                analysis_df = pd.concat([matched, unmatched], ignore_index=True)
-            else:
-                analysis_df = matched.reset_index(drop=True)
-
-            if analysis_df.empty:
+            result = compute_fruit_bonus(raw_df, bonus_df, start_date, end_date)
+            if result is None:
                 st.warning("未匹配到任何符合条件的商品数据")
                 return
-
-            # 存量/增量判定
-            base_start = start_date - timedelta(days=90)
-            base_end = start_date - timedelta(days=1)
-
-            bonus_period = analysis_df[
-                (analysis_df["订单日期"] >= pd.Timestamp(start_date)) &
-                (analysis_df["订单日期"] <= pd.Timestamp(end_date))
-                ].drop_duplicates().reset_index(drop=True)
-
-            base_period = analysis_df[
-                (analysis_df["订单日期"] >= pd.Timestamp(base_start)) &
-                (analysis_df["订单日期"] <= pd.Timestamp(base_end))
-                ].drop_duplicates().reset_index(drop=True)
-
-            bonus_period["唯一标识"] = bonus_period["客户名称"] + "_" + bonus_period["关键词"] + "_" + bonus_period[
-                "商品名称"]
-            bonus_period = bonus_period.drop_duplicates(subset=["唯一标识"]).reset_index(drop=True)
-
-            base_period["唯一标识"] = base_period["客户名称"] + "_" + base_period["关键词"] + "_" + base_period[
-                "商品名称"]
-            base_period = base_period.drop_duplicates(subset=["唯一标识"]).reset_index(drop=True)
-
-            existing_ids = set(base_period["唯一标识"].unique())
-            bonus_period["类型"] = bonus_period["唯一标识"].apply(
-                lambda x: "存量" if x in existing_ids else "增量"
-            )
-
-            # 奖金计算（保留两位小数）
-            bonus_period["奖金金额"] = bonus_period.apply(
-                lambda row: round(row["销量"] * row["存量奖金"], 2) if row["类型"] == "存量"
-                else round(row["销量"] * row["增量奖金"], 2), axis=1
-            )
-            bonus_period = bonus_period.drop_duplicates().reset_index(drop=True)
-
-            # 汇总明细（含商品描述）
-            detail_cols = [
-                "bd_name", "客户名称", "商品名称", "关键词", "规格", "商品描述",
-                "销量", "类型", "奖金金额"
-            ]
-            detail_df = bonus_period[detail_cols].groupby(
-                ["bd_name", "客户名称", "商品名称", "关键词", "规格", "商品描述", "类型"],
-                as_index=False
-            ).agg({"销量": "sum", "奖金金额": "sum"})
-            detail_df["奖金金额"] = detail_df["奖金金额"].round(2)  # 明细保留两位小数
-            detail_df = detail_df[detail_df["奖金金额"] > 0].drop_duplicates().reset_index(drop=True)
-
-            # 按BD汇总奖金（新增"共计奖金"列）
-            summary_df = detail_df.groupby("bd_name", as_index=False).agg(
-                存量奖金总额=pd.NamedAgg(column="奖金金额",
-                                         aggfunc=lambda x: x[detail_df["类型"] == "存量"].sum().round(2)),
-                增量奖金总额=pd.NamedAgg(column="奖金金额",
-                                         aggfunc=lambda x: x[detail_df["类型"] == "增量"].sum().round(2))
-            )
-            # 计算共计奖金（存量+增量）
-            summary_df["共计奖金"] = (summary_df["存量奖金总额"] + summary_df["增量奖金总额"]).round(2)
-            summary_df[["存量奖金总额", "增量奖金总额", "共计奖金"]] = summary_df[
-                ["存量奖金总额", "增量奖金总额", "共计奖金"]].fillna(0)
-            summary_df = summary_df.drop_duplicates().reset_index(drop=True)
-
-            # 计算总计行（含共计奖金）
-            total_increment = round(summary_df["增量奖金总额"].sum(), 2)
-            total_stock = round(summary_df["存量奖金总额"].sum(), 2)
-            total_total = round(total_stock + total_increment, 2)
-            total_row = pd.DataFrame({
-                "bd_name": ["总计"],
-                "存量奖金总额": [total_stock],
-                "增量奖金总额": [total_increment],
-                "共计奖金": [total_total]
-            })
-            summary_with_total = pd.concat([summary_df, total_row], ignore_index=True)
+            summary_with_total, detail_df = result
 
             # ---------------------- 页面彩色化样式 ----------------------
             st.markdown("""
@@ -206,7 +253,7 @@ def main():
                 st.markdown("### 奖金统计（含共计）")
                 # 高亮总计行，并设置列格式
                 styled_summary = summary_with_total.style.apply(
-                    lambda row: ['class: total-row' if row.name == len(summary_df) else '' for _ in row],
+                    lambda row: ['class: total-row' if row.name == len(summary_with_total) - 1 else '' for _ in row],
                     axis=1
                 )
                 st.dataframe(
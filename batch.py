@@ -0,0 +1,359 @@
+"""
+命令行批量运行各工具：读取输入文件和参数，直接调用各工具的计算函数并写出结果文件，
+不需要打开 Streamlit 页面，可用于定时任务和大文件。
+
+用法示例：
+  python batch.py inactive 订单_4月.xlsx 订单_5月.xlsx --days 30 -o 不活跃商品.xlsx
+  python batch.py incentive 原始数据.xlsx --bonus 标品奖金表.xlsx --start 2025-05-02 --end 2025-05-31
+  python batch.py commission 新订单.csv --store last_purchase_state.sqlite --days 30
+
+每个子命令的参数见 python batch.py <子命令> --help。多个原始数据文件用 --workers 个进程并行解析。
+加 --perf 时在标准错误输出各阶段的耗时、行数和内存，并写入性能日志（见 perf.py）。
+"""
+import argparse
+import contextlib
+import logging
+import os
+import sys
+from datetime import date, datetime, timedelta
+from io import BytesIO
+
+import pandas as pd
+import streamlit  # 先导入，下面才能调整其日志级别
+
+from data_loader import load_table, parse_dates
+from perf import PerfRecorder, stage
+
+# 命令行运行时没有 Streamlit 运行环境，各工具的缓存装饰器会提示 "No runtime found"，不影响计算
+logging.getLogger('streamlit.runtime.caching.cache_data_api').setLevel(logging.ERROR)
+
+
+def read_file(path):
+    """返回 (文件名, 内容)，与上传文件的形式一致"""
+    with open(path, 'rb') as f:
+        return os.path.basename(path), f.read()
+
+
+def read_input(path, required=(), name='上传文件', **kwargs):
+    """先只读取表头校验必要列再完整解析"""
+    return load_table(*read_file(path), required, name, **kwargs)
+
+
+def to_excel(sheets):
+    output = BytesIO()
+    with stage('导出Excel', rows_in=sum(len(df) for df in sheets.values())), \
+            pd.ExcelWriter(output, engine='openpyxl') as writer:
+        for sheet_name, df in sheets.items():
+            df.to_excel(writer, index=False, sheet_name=sheet_name[:31])
+    return output.getvalue()
+
+
+def write_output(result, path):
+    """result 为 {工作表名: 表} 或已生成的 Excel 内容；只有一个工作表且输出为 .csv 时写成 CSV"""
+    if isinstance(result, dict) and path.lower().endswith('.csv'):
+        if len(result) != 1:
+            raise ValueError(f"结果包含 {len(result)} 个工作表，请输出为 .xlsx 文件")
+        next(iter(result.values())).to_csv(path, index=False, encoding='utf-8-sig')
+    else:
+        with open(path, 'wb') as f:
+            f.write(to_excel(result) if isinstance(result, dict) else result)
+    print(f"已写入 {path}")
+
+
+def run_costing(args):
+    """配方成本批量核算（app000）"""
+    import app000
+
+    book = app000.RecipeCostBook(read_input(args.recipes, app000.RECIPE_COLUMNS, '配方表'),
+                                 read_input(args.catalog, app000.CATALOG_COLUMNS, '价格表'))
+    impact = None
+    if args.prices:
+        impact = book.update_prices(read_input(args.prices, app000.CATALOG_COLUMNS, '新价格表'))
+        print(f"受影响的配方共 {len(impact)} 个")
+    sheets = app000.costing_sheets(book, impact)
+    print(f"配方共 {len(sheets['配方成本汇总'])} 个，缺少价格的原材料 {len(sheets['缺少价格'])} 条")
+    return sheets, '配方成本核算.xlsx'
+
+
+def run_match(args):
+    """匹配商品的客户及最后一次下单时间（app001）"""
+    import app001
+
+    base_df = app001.read_file(*read_file(args.base))
+    match_df = app001.read_file(*read_file(args.match))
+    result_df = app001.match_latest_orders(base_df, match_df)
+    print(f"匹配到 {len(result_df)} 个客户-商品组合")
+    return {'匹配结果': result_df}, 'matched_results.csv'
+
+
+def run_inactive(args):
+    """超过阈值天数未购买的客户-商品组合（app002）"""
+    import app002
+
+    matching = read_file(args.matching) if args.matching else None
+    if args.stream:
+        if len(args.original) != 1:
+            raise ValueError("--stream 只支持一个 CSV 文件")
+        result = app002.scan_latest_orders(args.original[0], matching)
+    else:
+        result = app002.read_latest_orders([read_file(path) for path in args.original], matching, args.workers)
+    latest_orders, valid_count, messages, has_m_id = result
+    for _, message in messages:
+        print(message)
+
+    inactive_products = app002.select_inactive(latest_orders, valid_count, has_m_id, args.days, datetime.now())
+    print(f"超过{args.days}天未购买的客户-商品组合：{len(inactive_products)} / {len(latest_orders)}")
+    return {'Inactive Products': inactive_products}, 'inactive_products.xlsx'
+
+
+def run_mom(args):
+    """两个期段的环比分析（app003）"""
+    import app003
+
+    period1 = tuple(pd.Timestamp(day) for day in args.period1)
+    period2 = tuple(pd.Timestamp(day) for day in args.period2)
+    if period1[0] >= period1[1] or period2[0] >= period2[1]:
+        raise ValueError("结束日期必须晚于开始日期")
+    if period2[0] <= period1[1]:
+        print("警告：分析期段存在时间重叠")
+
+    raw_df = app003.read_orders([read_file(path) for path in args.files], args.workers)
+    results = app003.compare_periods(raw_df, period1, period2)
+    if not results:
+        raise ValueError("所选时间段无有效数据")
+    return app003.to_excel(results), 'custom_period_analysis.xlsx'
+
+
+def run_missing(args):
+    """同主营类型下热门但客户未购买的商品（app004）"""
+    import app004
+
+    df = read_input(args.file, app004.REQUIRED_COLUMNS, '上传的表格')
+    result_df = app004.find_missing_products(df, args.min_count)
+    return app004.to_excel(result_df), '分析结果.xlsx'
+
+
+def run_cycle(args):
+    """客户-商品购买周期及下次购买时间预测（app005）"""
+    import app005
+
+    if args.estimator not in app005.ESTIMATORS:
+        raise ValueError(f"不支持的估计方法：{args.estimator}")
+    orders, product_index = app005.prepare_orders(read_input(args.file, app005.REQUIRED_COLUMNS, 'Excel文件'))
+    if args.product:
+        result = app005.product_cycles(orders, product_index, args.product, args.estimator)
+        if result is None:
+            raise ValueError(f"查询不到商品：{args.product}")
+        return {'Sheet1': result}, f"分析结果_{args.product}.xlsx"
+
+    stats = app005.CycleStats().update(orders)
+    if args.extra:
+        extra_orders, _ = app005.prepare_orders(read_input(args.extra, app005.REQUIRED_COLUMNS, 'Excel文件'))
+        stats.update(extra_orders)
+    batch_summary, due_soon = app005.batch_cycles(stats, args.estimator, args.filter, args.due_days)
+    print(f"共 {len(batch_summary)} 个客户-商品组合，未来{args.due_days}天内预计下单 {len(due_soon)} 条")
+    return {
+        '全部购买周期': app005.format_prediction(batch_summary),
+        f'未来{args.due_days}天预计下单': app005.format_prediction(due_soon)
+    }, "分析结果_全部商品.xlsx"
+
+
+def run_gmv(args):
+    """客户月均GMV目标测算，多个百分比或排名区间时输出多场景对比（app006）"""
+    import app006
+
+    pct_list = app006.parse_pct_list(args.pct)
+    rank_bands = app006.parse_rank_bands(args.bands)
+    if not pct_list or not rank_bands:
+        raise ValueError("请至少输入一个上涨百分比和一个排名区间")
+
+    _, total_gmv, customer_avg_gmv = app006.gmv_cube(
+        read_input(args.file, app006.REQUIRED_COLUMNS, '上传文件', columns=[]))
+    print(f"实付GMV总和值：{total_gmv}")
+    if len(pct_list) == 1 and len(rank_bands) == 1:
+        (min_rank, max_rank), = rank_bands
+        filtered_customers = app006.analyze_data(customer_avg_gmv, pct_list[0], min_rank, max_rank)
+        return app006.to_excel({'Sheet1': filtered_customers}), "目标客户分析结果_with_cust_id.xlsx"
+    sheets = app006.scenario_sheets(customer_avg_gmv, pct_list, rank_bands)
+    return app006.to_excel(sheets), "目标客户多场景分析结果.xlsx"
+
+
+def run_commission(args):
+    """不活跃商品分析，可使用本地最后购买记录库增量运行（app007）"""
+    import app007
+
+    if not args.original and not args.store:
+        raise ValueError("请提供原始数据表或 --store 记录库")
+
+    if args.original:
+        df = app007.read_original_files([read_file(path) for path in args.original], args.workers)
+    if args.store:
+        store = app007.LastPurchaseStore(args.store)
+        try:
+            if args.original:
+                # 只并入本次的新订单，历史记录不再重新扫描
+                df['order_date'], _ = parse_dates(df['order_date'])
+                updated = store.ingest(df)
+                print(f"已并入 {len(df)} 条新订单，更新 {updated} 个客户-商品组合")
+            total_pairs, latest_date = store.stats()
+            print(f"记录库共 {total_pairs} 个客户-商品组合，最新订单日期：{latest_date or '无'}")
+            df = store.inactive_since(datetime.now() - timedelta(days=args.days))
+        finally:
+            store.conn.close()
+
+    if args.customers:
+        customer_df = read_input(args.customers, ['客户名称'], '客户匹配表')
+        df = df[df['客户名称'].isin(customer_df['客户名称'])]
+
+    if args.products:
+        product_df = read_input(args.products, ['商品名称'], '商品匹配表')
+        df = app007.smart_product_filter(df, product_df['商品名称'].dropna().astype(str).unique())
+
+    inactive_df, invalid_count = app007.find_inactive(df, args.days)
+    if invalid_count:
+        print(f"发现 {invalid_count} 条无效日期记录，已自动排除")
+    print(f"不活跃商品共 {len(inactive_df)} 条")
+    return {'不活跃商品': inactive_df}, '分析结果.xlsx'
+
+
+def run_incentive(args):
+    """标品销售激励（app008）"""
+    import app008
+
+    bonus_df = read_input(args.bonus, app008.BONUS_COLUMNS, '标品奖金表')
+    raw_df = app008.read_raw_data([read_file(path) for path in args.raw], args.workers)
+    summary_df, detail_df = app008.compute_commission(raw_df, bonus_df, args.start, args.end)
+    print(f"总奖金金额：¥{summary_df['总奖金'].iloc[-1]:,.2f}，总订单数：{len(detail_df)} 笔")
+    return app008.to_excel(summary_df, detail_df), f'销售激励分析_{args.start}至{args.end}.xlsx'
+
+
+def run_fruit(args):
+    """鲜果销售激励（app009）"""
+    import app009
+
+    if args.start >= args.end:
+        raise ValueError("结束日期需晚于开始日期")
+    raw_df = app009.read_data_files([read_file(path) for path in args.raw], "原始数据表", args.workers)
+    raw_df, invalid_dates = app009.normalize_order_dates(raw_df)
+    if invalid_dates:
+        print(f"注意：原始数据表中存在无法解析的订单日期（{invalid_dates} 条），已过滤无效日期")
+    bonus_df = app009.read_data_files([read_file(args.bonus)], "鲜果奖金表")
+
+    result = app009.compute_fruit_bonus(raw_df, bonus_df, args.start, args.end)
+    if result is None:
+        raise ValueError("未匹配到任何符合条件的商品数据")
+    summary_with_total, detail_df = result
+    return {'BD奖金统计': summary_with_total, '奖金明细': detail_df}, '鲜果销售激励.xlsx'
+
+
+def run_quote(args):
+    """生鲜食材报价（baojia）"""
+    import baojia
+
+    quote_df, avg_gross_margin, has_quantity = baojia.quote_prices(
+        read_input(args.cost, baojia.COST_COLUMNS, '成本价格表'),
+        read_input(args.quote, ['商品名称'], '待报价文件'),
+        read_input(args.margin, baojia.MARGIN_COLUMNS, '总部毛利率参考表'),
+        args.customer_type)
+    matched = int((quote_df['匹配商品名称'] != "无").sum()) if len(quote_df) else 0
+    print(f"综合毛利率：{avg_gross_margin:.2%}，{len(quote_df)} 个商品中成功匹配 {matched} 个")
+    return (baojia.quote_workbook(quote_df, args.customer_type, avg_gross_margin, has_quantity),
+            f"{args.customer_type}_报价结果.xlsx")
+
+
+def build_parser():
+    # 各子命令共用的参数
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('-o', '--output', help="输出文件（默认与页面下载的文件名相同）")
+    common.add_argument('--workers', type=int, help="并行解析多个文件的进程数（默认为 CPU 数）")
+    common.add_argument('--perf', action='store_true', help="输出各阶段的耗时和内存，并写入性能日志")
+
+    parser = argparse.ArgumentParser(description="命令行批量运行各工具")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    cmd = commands.add_parser('costing', parents=[common], help=run_costing.__doc__)
+    cmd.add_argument('recipes', help="配方表")
+    cmd.add_argument('catalog', help="原材料价格表")
+    cmd.add_argument('--prices', help="新的原材料价格表，输出价格变动影响")
+    cmd.set_defaults(run=run_costing)
+
+    cmd = commands.add_parser('match', parents=[common], help=run_match.__doc__)
+    cmd.add_argument('base', help="基础文件")
+    cmd.add_argument('match', help="匹配文件")
+    cmd.set_defaults(run=run_match)
+
+    cmd = commands.add_parser('inactive', parents=[common], help=run_inactive.__doc__)
+    cmd.add_argument('original', nargs='+', help="原始数据表，可多个")
+    cmd.add_argument('--matching', help="客户匹配表")
+    cmd.add_argument('--days', type=int, default=30, help="未购买天数阈值")
+    cmd.add_argument('--stream', action='store_true', help="分块读取超大 CSV")
+    cmd.set_defaults(run=run_inactive)
+
+    cmd = commands.add_parser('mom', parents=[common], help=run_mom.__doc__)
+    cmd.add_argument('files', nargs='+', help="订单文件，可多个")
+    cmd.add_argument('--period1', nargs=2, type=date.fromisoformat, required=True, metavar=('开始', '结束'))
+    cmd.add_argument('--period2', nargs=2, type=date.fromisoformat, required=True, metavar=('开始', '结束'))
+    cmd.set_defaults(run=run_mom)
+
+    cmd = commands.add_parser('missing', parents=[common], help=run_missing.__doc__)
+    cmd.add_argument('file', help="订单表")
+    cmd.add_argument('--min-count', type=int, default=10, help="复购次数阈值")
+    cmd.set_defaults(run=run_missing)
+
+    cmd = commands.add_parser('cycle', parents=[common], help=run_cycle.__doc__)
+    cmd.add_argument('file', help="订单表")
+    cmd.add_argument('--extra', help="追加的新订单文件")
+    cmd.add_argument('--estimator', default='平均值', help="预测购买时间的估计方法：平均值、中位数、EWMA、去极值均值")
+    cmd.add_argument('--product', help="只查询一个商品（严格匹配）")
+    cmd.add_argument('--filter', default='', help="按商品名称筛选（模糊匹配）")
+    cmd.add_argument('--due-days', type=int, default=7, help="列出未来N天内预计下单的客户")
+    cmd.set_defaults(run=run_cycle)
+
+    cmd = commands.add_parser('gmv', parents=[common], help=run_gmv.__doc__)
+    cmd.add_argument('file', help="订单表")
+    cmd.add_argument('--pct', default='10', help="目标上涨百分比，逗号分隔，例如 5,10,15")
+    cmd.add_argument('--bands', default='11-50', help="排名区间，逗号分隔，例如 1-10,11-50")
+    cmd.set_defaults(run=run_gmv)
+
+    cmd = commands.add_parser('commission', parents=[common], help=run_commission.__doc__)
+    cmd.add_argument('original', nargs='*', help="原始数据表，可多个；使用 --store 时只需包含新订单")
+    cmd.add_argument('--customers', help="客户匹配表")
+    cmd.add_argument('--products', help="商品匹配表")
+    cmd.add_argument('--days', type=int, default=30, help="未购买天数阈值")
+    cmd.add_argument('--store', help="本地最后购买记录库文件")
+    cmd.set_defaults(run=run_commission)
+
+    for name, run in [('incentive', run_incentive), ('fruit', run_fruit)]:
+        cmd = commands.add_parser(name, parents=[common], help=run.__doc__)
+        cmd.add_argument('raw', nargs='+', help="原始数据表，可多个")
+        cmd.add_argument('--bonus', required=True, help="奖金表")
+        cmd.add_argument('--start', type=date.fromisoformat, required=True, help="奖金开始日期，例如 2025-05-01")
+        cmd.add_argument('--end', type=date.fromisoformat, required=True, help="奖金结束日期")
+        cmd.set_defaults(run=run)
+
+    cmd = commands.add_parser('quote', parents=[common], help=run_quote.__doc__)
+    cmd.add_argument('cost', help="成本价格表")
+    cmd.add_argument('margin', help="总部毛利率参考表")
+    cmd.add_argument('quote', help="待报价文件")
+    cmd.add_argument('--customer-type', default='线上客户', choices=['线上客户', '线下客户'])
+    cmd.set_defaults(run=run_quote)
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    recorder = PerfRecorder(args.command) if args.perf else None
+    try:
+        with recorder or contextlib.nullcontext():
+            result, default_output = args.run(args)
+            write_output(result, args.output or default_output)
+    except (ValueError, OSError) as e:
+        sys.exit(f"错误：{e}")
+    finally:
+        if recorder is not None:
+            print(recorder.to_frame().to_string(index=False), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
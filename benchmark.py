@@ -0,0 +1,387 @@
+"""
+各工具核心计算的基准测试：用 gen_data.py 生成指定规模的模拟数据，按阶段（读取、预处理、计算等）
+记录每个工具的耗时和内存峰值，可保存为基线文件并与之前的基线对比，耗时明显变长时以非零状态退出。
+
+用法：
+  python benchmark.py --scale 10k --save 基线_10k.json
+  python benchmark.py --scale 10k --compare 基线_10k.json
+  python benchmark.py --scale 1m --tools mom gmv cycle --timeout 600
+
+耗时取 --repeat 次运行中每个阶段的最短耗时；内存峰值在另一次运行中用 tracemalloc 统计，
+为该阶段相对阶段开始时新增的 Python 对象和 numpy 数组内存的峰值（pyarrow 分配的内存不计入）。
+读取阶段默认不使用上传文件的磁盘缓存，每次都完整解析；加 --upload-cache 时与页面的实际行为一致。
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import signal
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+import streamlit  # 先导入，下面才能调整其日志级别
+
+import data_loader
+from gen_data import DEFAULT_END, SCALES, generate_tables, scale_rows, table_bytes
+
+# 命令行运行时没有 Streamlit 运行环境，各工具的缓存装饰器会提示 "No runtime found"，不影响计算
+logging.getLogger('streamlit.runtime.caching.cache_data_api').setLevel(logging.ERROR)
+
+# 与基线对比时，耗时超过基线的比例及绝对差值都超过阈值才算变慢（过滤很短阶段的波动）
+DEFAULT_TOLERANCE = 0.2
+MIN_REGRESSION_SECONDS = 0.05
+
+
+class BenchmarkTimeout(BaseException):
+    """单个工具运行超时；继承 BaseException，不会被工具内部的 except Exception 吞掉"""
+
+
+@contextmanager
+def time_limit(seconds):
+    """限制代码块的运行时间，只在支持 SIGALRM 的系统（Linux、macOS）上生效"""
+    if not seconds or not hasattr(signal, 'SIGALRM'):
+        yield
+        return
+
+    def handle_alarm(signum, frame):
+        raise BenchmarkTimeout(f"超过 {seconds} 秒")
+
+    previous = signal.signal(signal.SIGALRM, handle_alarm)
+    signal.setitimer(signal.ITIMER_REAL, seconds)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+
+class StageRecorder:
+    """按阶段记录一次运行的耗时（秒）和内存峰值（字节，trace_memory 为 True 时）"""
+
+    def __init__(self, trace_memory=False):
+        self.trace_memory = trace_memory
+        self.seconds = {}
+        self.peak_bytes = {}
+
+    @contextmanager
+    def stage(self, name):
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+            start_bytes = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds[name] = time.perf_counter() - start
+            if self.trace_memory:
+                self.peak_bytes[name] = tracemalloc.get_traced_memory()[1] - start_bytes
+
+
+class BenchData:
+    """模拟数据：各表及其序列化后的上传文件内容（按需生成并缓存）"""
+
+    def __init__(self, rows, seed=0, fmt='csv'):
+        self.rows = rows
+        self.seed = seed
+        self.fmt = fmt
+        self.tables = generate_tables(rows, seed)
+        self._files = {}
+        # 分析期段以订单的最后日期为准
+        self.end = pd.Timestamp(DEFAULT_END)
+        self.now = self.end + timedelta(days=1)
+
+    def file(self, name):
+        """(文件名, 内容)，与上传文件的形式一致"""
+        if name not in self._files:
+            self._files[name] = (f"{name}.{self.fmt}", table_bytes(self.tables[name], self.fmt))
+        return self._files[name]
+
+    def read(self, name, required=(), **kwargs):
+        return data_loader.load_table(*self.file(name), required, name, **kwargs)
+
+
+# ================== 各工具的基准测试 ==================
+# 每个函数接收 (模拟数据, 阶段记录器)，按页面的实际调用顺序分阶段运行工具的计算函数
+
+def bench_costing(data, recorder):
+    import app000
+    recipes = data.read('配方表', app000.RECIPE_COLUMNS)
+    catalog = data.read('原材料价格表', app000.CATALOG_COLUMNS)
+    new_prices = data.read('新价格表', app000.CATALOG_COLUMNS)
+    with recorder.stage('核算'):
+        book = app000.RecipeCostBook(recipes, catalog)
+    with recorder.stage('价格变动'):
+        impact = book.update_prices(new_prices)
+    with recorder.stage('汇总'):
+        app000.costing_sheets(book, impact)
+
+
+def bench_match(data, recorder):
+    import app001
+    with recorder.stage('读取'):
+        base_df = app001.read_file(*data.file('订单明细'))
+    match_df = app001.read_file(*data.file('商品匹配表'))
+    with recorder.stage('匹配'):
+        app001.match_latest_orders(base_df, match_df)
+
+    # 单独比较汇总这一步：当前的单次分组与改写前的排序 + 分组（见 golden.py）
+    from golden import legacy_aggregate_latest_orders
+    orders = base_df.assign(下单时间=data_loader.parse_dates(base_df['下单时间'])[0]).dropna(subset=['下单时间'])
+    matched = orders.loc[orders['商品名称'].isin(match_df['商品名称']), app001.REQUIRED_COLUMNS_BASE]
+    with recorder.stage('汇总'):
+        app001.aggregate_latest_orders(matched)
+    with recorder.stage('汇总（改写前）'):
+        legacy_aggregate_latest_orders(matched)
+
+
+def bench_inactive(data, recorder):
+    import app002
+    with recorder.stage('读取汇总'):
+        latest_orders, valid_count, _, has_m_id = app002.read_latest_orders(
+            [data.file('订单明细')], data.file('客户匹配表'))
+    with recorder.stage('筛选'):
+        app002.select_inactive(latest_orders, valid_count, has_m_id, 30, data.now)
+
+
+def bench_mom(data, recorder):
+    import app003
+    with recorder.stage('读取'):
+        raw_df = app003.read_orders([data.file('订单明细')])
+    period2 = (data.end - timedelta(days=29), data.end)
+    period1 = (period2[0] - timedelta(days=30), period2[0] - timedelta(days=1))
+    with recorder.stage('环比'):
+        app003.compare_periods(raw_df, period1, period2)
+
+
+def bench_missing(data, recorder):
+    import app004
+    with recorder.stage('读取'):
+        df = data.read('订单明细', app004.REQUIRED_COLUMNS)
+    with recorder.stage('计算'):
+        app004.find_missing_products(df)
+
+
+def bench_cycle(data, recorder):
+    import app005
+    with recorder.stage('读取'):
+        df = data.read('订单明细', app005.REQUIRED_COLUMNS)
+    with recorder.stage('整理'):
+        orders, product_index = app005.prepare_orders(df)
+    with recorder.stage('周期统计'):
+        stats = app005.CycleStats().update(orders)
+    with recorder.stage('批量预测'):
+        app005.batch_cycles(stats, '中位数')
+    product_name = orders['商品名称'].value_counts().index[0]
+    with recorder.stage('单品查询'):
+        app005.product_cycles(orders, product_index, product_name, '平均值')
+
+
+def bench_gmv(data, recorder):
+    import app006
+    with recorder.stage('读取'):
+        df = data.read('订单明细', app006.REQUIRED_COLUMNS, columns=[])
+    with recorder.stage('汇总'):
+        _, _, customer_avg_gmv = app006.gmv_cube(df)
+    with recorder.stage('多场景'):
+        app006.scenario_sheets(customer_avg_gmv, [5, 10, 15, 20], [(1, 10), (11, 50), (51, 100)])
+
+
+def bench_commission(data, recorder):
+    import app007
+    with recorder.stage('读取'):
+        df = app007.read_original_files([data.file('订单明细')])
+    terms = data.tables['商品匹配表']['商品名称'].astype(str).unique()
+    with recorder.stage('商品筛选'):
+        df = app007.smart_product_filter(df, terms)
+    with recorder.stage('不活跃'):
+        app007.find_inactive(df, 30, data.now)
+
+
+def bench_incentive(data, recorder):
+    import app008
+    bonus_df = data.read('标品奖金表', app008.BONUS_COLUMNS)
+    with recorder.stage('读取'):
+        raw_df = app008.read_raw_data([data.file('订单明细')])
+    start = (data.end - timedelta(days=29)).date()
+    with recorder.stage('计算'):
+        app008.compute_commission(raw_df, bonus_df, start, data.end.date())
+
+
+def bench_fruit(data, recorder):
+    import app009
+    bonus_df = app009.read_data_files([data.file('鲜果奖金表')], "鲜果奖金表")
+    with recorder.stage('读取'):
+        raw_df = app009.read_data_files([data.file('订单明细')], "原始数据表")
+    with recorder.stage('日期'):
+        raw_df, _ = app009.normalize_order_dates(raw_df)
+    start = (data.end - timedelta(days=29)).date()
+    with recorder.stage('计算'):
+        app009.compute_fruit_bonus(raw_df, bonus_df, start, data.end.date())
+
+
+def bench_quote(data, recorder):
+    import baojia
+    cost = data.read('成本价格表', baojia.COST_COLUMNS)
+    margin = data.read('毛利率参考表', baojia.MARGIN_COLUMNS)
+    quote = data.read('待报价文件', ['商品名称'])
+    with recorder.stage('报价'):
+        baojia.quote_prices(cost, quote, margin, '线上客户')
+
+
+# 工具名（与 batch.py 的子命令一致） -> 基准测试函数
+BENCHMARKS = {
+    'costing': bench_costing,
+    'match': bench_match,
+    'inactive': bench_inactive,
+    'mom': bench_mom,
+    'missing': bench_missing,
+    'cycle': bench_cycle,
+    'gmv': bench_gmv,
+    'commission': bench_commission,
+    'incentive': bench_incentive,
+    'fruit': bench_fruit,
+    'quote': bench_quote,
+}
+
+
+def run_tool(tool, data, repeat=1, trace_memory=True, timeout=None):
+    """
+    运行一个工具的基准测试，返回每个阶段一条记录的列表：
+    {'工具', '阶段', '耗时(秒)', '峰值内存(MB)', '状态'}；出错或超时时只返回一条说明原因的记录。
+    """
+    runs = [False] * repeat + ([True] if trace_memory else [])
+    seconds, peak_mb = {}, {}
+    for traced in runs:
+        recorder = StageRecorder(trace_memory=traced)
+        if traced:
+            tracemalloc.start()
+        try:
+            with time_limit(timeout):
+                BENCHMARKS[tool](data, recorder)
+        except ImportError as e:
+            return [failed_record(tool, f"缺少依赖：{e.name}")]
+        except BenchmarkTimeout as e:
+            return [failed_record(tool, f"超时（{e}）")]
+        except Exception as e:
+            return [failed_record(tool, f"出错：{e}")]
+        finally:
+            if traced:
+                tracemalloc.stop()
+
+        for stage, value in recorder.seconds.items():
+            if not traced:
+                seconds[stage] = min(seconds.get(stage, value), value)
+        for stage, value in recorder.peak_bytes.items():
+            peak_mb[stage] = value / 1024 ** 2
+
+    return [{'工具': tool, '阶段': stage, '耗时(秒)': value, '峰值内存(MB)': peak_mb.get(stage), '状态': '完成'}
+            for stage, value in seconds.items()]
+
+
+def failed_record(tool, status):
+    return {'工具': tool, '阶段': '', '耗时(秒)': None, '峰值内存(MB)': None, '状态': status}
+
+
+def environment():
+    """记录在基线文件中的运行环境"""
+    return {
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+    }
+
+
+def save_baseline(path, results, meta):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({'meta': meta, 'results': results}, f, ensure_ascii=False, indent=2)
+
+
+def load_baseline(path):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def compare_results(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    """
+    按 (工具, 阶段) 与基线对比，返回附加了基线耗时、变化比例和是否变慢的表。
+    耗时超过基线 (1 + tolerance) 倍且多出 MIN_REGRESSION_SECONDS 秒以上时记为变慢。
+    """
+    base = {(row['工具'], row['阶段']): row for row in baseline['results']}
+    df = pd.DataFrame(results)
+    df['耗时(秒)'] = pd.to_numeric(df['耗时(秒)'])
+    base_seconds = [base.get((tool, stage), {}).get('耗时(秒)') for tool, stage in zip(df['工具'], df['阶段'])]
+    df['基线耗时'] = pd.to_numeric(pd.Series(base_seconds, index=df.index, dtype=object))
+    df['变化'] = df['耗时(秒)'] / df['基线耗时'] - 1
+    df['变慢'] = (df['变化'] > tolerance) & (df['耗时(秒)'] - df['基线耗时'] > MIN_REGRESSION_SECONDS)
+    return df
+
+
+def main():
+    parser = argparse.ArgumentParser(description="各工具核心计算的分阶段基准测试")
+    parser.add_argument('--scale', default='10k', help=f"订单行数：{', '.join(SCALES)} 或具体行数")
+    parser.add_argument('--tools', nargs='+', choices=list(BENCHMARKS), help="只测试指定的工具（默认全部）")
+    parser.add_argument('--format', default='csv', choices=['csv', 'xlsx'], help="上传文件的格式")
+    parser.add_argument('--seed', type=int, default=0, help="模拟数据的随机种子")
+    parser.add_argument('--repeat', type=int, default=1, help="每个工具重复运行的次数，取每个阶段的最短耗时")
+    parser.add_argument('--no-memory', action='store_true', help="不统计内存峰值（省去一次额外的运行）")
+    parser.add_argument('--timeout', type=float, help="单个工具每次运行的最长秒数，超时后跳过该工具")
+    parser.add_argument('--upload-cache', action='store_true', help="读取阶段使用上传文件的磁盘缓存")
+    parser.add_argument('--save', metavar='PATH', help="把本次结果保存为基线文件（JSON）")
+    parser.add_argument('--compare', metavar='PATH', help="与基线文件对比，有阶段变慢时以状态 1 退出")
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE, help="允许的耗时增长比例")
+    args = parser.parse_args()
+
+    try:
+        rows = scale_rows(args.scale)
+        baseline = load_baseline(args.compare) if args.compare else None
+    except (ValueError, OSError) as e:
+        sys.exit(f"错误：{e}")
+    if not args.upload_cache:
+        data_loader.UPLOAD_CACHE_DIR = None
+
+    start = time.perf_counter()
+    data = BenchData(rows, args.seed, args.format)
+    print(f"已生成 {rows} 行模拟订单（{time.perf_counter() - start:.1f} 秒）")
+
+    results = []
+    for tool in args.tools or BENCHMARKS:
+        records = run_tool(tool, data, args.repeat, not args.no_memory, args.timeout)
+        for record in records:
+            print(f"{tool:<12}{record['阶段'] or '-':<10}"
+                  + (f"{record['耗时(秒)']:>10.3f} 秒" if record['耗时(秒)'] is not None else f"  {record['状态']}"))
+        results.extend(records)
+
+    meta = {'rows': rows, 'seed': args.seed, 'format': args.format, 'upload_cache': args.upload_cache,
+            'repeat': args.repeat, 'created': datetime.now().isoformat(timespec='seconds'), **environment()}
+
+    report = pd.DataFrame(results)
+    regressions = 0
+    if baseline is not None:
+        base_meta = baseline.get('meta', {})
+        if (base_meta.get('rows'), base_meta.get('seed'), base_meta.get('format')) != (rows, args.seed, args.format):
+            print(f"警告：基线的数据规模或格式与本次不同（基线为 {base_meta.get('rows')} 行、"
+                  f"种子 {base_meta.get('seed')}、{base_meta.get('format')} 格式）")
+        report = compare_results(results, baseline, args.tolerance)
+        regressions = int(report['变慢'].sum())
+
+    print()
+    print(report.to_string(index=False, float_format=lambda value: f"{value:.3f}"))
+
+    if args.save:
+        save_baseline(args.save, results, meta)
+        print(f"\n已保存基线 {args.save}")
+    if regressions:
+        print(f"\n有 {regressions} 个阶段比基线慢 {args.tolerance:.0%} 以上")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""
+比较不同 Excel 解析引擎的耗时，并检查各引擎的解析结果（含日期单元格）是否与 openpyxl 一致。
+
+用法：python benchmark_excel.py 订单导出.xlsx [更多文件...] [--repeat 3]
+"""
+import argparse
+import importlib.util
+import time
+from io import BytesIO
+
+import pandas as pd
+
+# 引擎名 -> 需要安装的模块
+ENGINES = {
+    'openpyxl': 'openpyxl',
+    'calamine': 'python_calamine',
+}
+
+
+def available_engines():
+    return [engine for engine, module in ENGINES.items() if importlib.util.find_spec(module) is not None]
+
+
+def benchmark_file(path, repeat=1):
+    """返回每个引擎的 (引擎, 最短耗时秒数, 行数, 与 openpyxl 是否一致, 差异说明)"""
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    results = []
+    frames = {}
+    for engine in available_engines():
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            frames[engine] = pd.read_excel(BytesIO(data), engine=engine)
+            timings.append(time.perf_counter() - start)
+        results.append([engine, min(timings), len(frames[engine])])
+
+    reference = frames.get('openpyxl')
+    for row in results:
+        if reference is None:
+            row += [None, '未安装 openpyxl，无法对比']
+            continue
+        try:
+            pd.testing.assert_frame_equal(frames[row[0]], reference)
+            row += [True, '']
+        except AssertionError as e:
+            row += [False, str(e).splitlines()[0]]
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="比较 Excel 解析引擎的耗时和结果一致性")
+    parser.add_argument('files', nargs='+', help="要解析的 xlsx 文件")
+    parser.add_argument('--repeat', type=int, default=1, help="每个引擎重复解析的次数，取最短耗时")
+    args = parser.parse_args()
+
+    for path in args.files:
+        results = benchmark_file(path, args.repeat)
+        print(f"\n{path}")
+        print(pd.DataFrame(results, columns=['引擎', '耗时(秒)', '行数', '与openpyxl一致', '差异']).to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,487 @@
+import os
+import time
+import uuid
+import hashlib
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+
+import numpy as np
+import pandas as pd
+
+from perf import stage
+
+logger = logging.getLogger(__name__)
+
+# 各工具上传文件的公共读取逻辑：
+# 先只读取表头（CSV 的第一行、Excel 第一个工作表的第一行非空行）校验必要列，
+# 校验通过后才解析文件（只读取需要的列），缺列时无需等待整个工作簿解析完成即可报错。
+# 解析结果按文件内容哈希（及读取的列）缓存为列式文件，同一份文件再次上传时直接读取缓存。
+
+EXCEL_EXTENSIONS = ('.xlsx', '.xlsm', '.xls')
+
+# 上传文件的缓存目录，设为 None 时不使用缓存
+UPLOAD_CACHE_DIR = 'uploads'
+
+# 缓存淘汰策略：超过保留天数或总大小超限时，优先删除最久未使用的文件
+UPLOAD_CACHE_MAX_BYTES = 500 * 1024 * 1024
+UPLOAD_CACHE_MAX_AGE_DAYS = 7
+
+# 有 pyarrow 时使用 Parquet（requirements.txt 已包含），否则退回 pickle
+try:
+    import pyarrow.parquet as pq
+    CACHE_EXT = '.parquet'
+except ImportError:
+    pq = None
+    CACHE_EXT = '.pkl'
+
+# 不影响解析结果的读取参数，不参与缓存键
+CACHE_NEUTRAL_KWARGS = {'engine'}
+
+# 合并多个文件时记录每行来源的列
+SOURCE_COLUMN = '来源文件'
+
+# 日期字符串的候选格式（'/' 已统一为 '-'），按顺序检测
+DATE_FORMATS = ['%Y-%m-%d', '%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%d %H:%M:%S.%f', '%Y%m%d']
+
+# Excel 解析引擎：安装了 python-calamine（Rust 实现）时优先使用，比 openpyxl 快数倍；
+# 可通过环境变量 EXCEL_ENGINE 指定（如 openpyxl），为空时使用 pandas 默认引擎
+try:
+    import python_calamine  # noqa: F401
+    EXCEL_ENGINE = os.environ.get('EXCEL_ENGINE', 'calamine') or None
+except ImportError:
+    EXCEL_ENGINE = os.environ.get('EXCEL_ENGINE') or None
+
+
+class MissingColumnsError(ValueError):
+    """上传文件缺少必要列"""
+
+    def __init__(self, name, missing):
+        self.missing = missing
+        super().__init__(f"{name}缺少必要列：{', '.join(missing)}")
+
+
+def file_extension(file_name):
+    return os.path.splitext(file_name)[1].lower()
+
+
+def probe_columns(file_name, data):
+    """只读取表头，返回列名列表（与 pandas 默认读取的第一个工作表一致）"""
+    ext = file_extension(file_name)
+    if ext == '.csv':
+        return list(pd.read_csv(BytesIO(data), nrows=0).columns)
+
+    if ext in ('.xlsx', '.xlsm'):
+        from openpyxl import load_workbook
+        # 只读模式按行流式读取，只取到第一行非空行就停止
+        workbook = load_workbook(BytesIO(data), read_only=True, data_only=True)
+        try:
+            for row in workbook.worksheets[0].iter_rows(values_only=True):
+                if any(cell is not None for cell in row):
+                    return [cell for cell in row if cell is not None]
+            return []
+        finally:
+            workbook.close()
+
+    if ext == '.xls':
+        import xlrd
+        workbook = xlrd.open_workbook(file_contents=data, on_demand=True)
+        try:
+            sheet = workbook.sheet_by_index(0)
+            for row_index in range(sheet.nrows):
+                row = [cell for cell in sheet.row_values(row_index) if cell != '']
+                if row:
+                    return row
+            return []
+        finally:
+            workbook.release_resources()
+
+    raise ValueError(f"不支持的文件格式: {ext}")
+
+
+def find_columns(columns, required):
+    """
+    按要求查找列名。required 中每一项为列名，或按优先级排列的候选列名元组（如 ('sku_id', 'sku')）。
+    返回 (每一项实际找到的列名列表, 缺少的项列表)，缺少的项以 “候选1/候选2” 表示。
+    """
+    columns = set(columns)
+    found, missing = [], []
+    for item in required:
+        candidates = (item,) if isinstance(item, str) else tuple(item)
+        present = [col for col in candidates if col in columns]
+        if present:
+            found.append(present[0])
+        else:
+            missing.append('/'.join(candidates))
+    return found, missing
+
+
+def check_columns(file_name, data, required, name='上传文件'):
+    """
+    只读取表头校验必要列，缺列时抛出 MissingColumnsError。
+    返回每一项实际找到的列名；表头无法单独读取时返回 None，由完整解析后的校验兜底。
+    """
+    try:
+        with stage('校验表头'):
+            columns = probe_columns(file_name, data)
+    except Exception as e:
+        logger.warning(f"读取 {file_name} 表头失败，改为完整解析后校验: {e}")
+        return None
+    # 列名两端的空格不影响匹配
+    found, missing = find_columns([str(col).strip() for col in columns], required)
+    if missing:
+        raise MissingColumnsError(name, missing)
+    return found
+
+
+def flatten_columns(columns):
+    """将列名及候选列名元组展开为列名集合"""
+    names = set()
+    for item in columns:
+        names.update((item,) if isinstance(item, str) else item)
+    return names
+
+
+class ColumnFilter:
+    """usecols 参数：只读取列名（去除两端空格后）在 names 中的列；names 同时用作缓存键的一部分"""
+
+    def __init__(self, names):
+        self.names = frozenset(names)
+
+    def __call__(self, col):
+        return str(col).strip() in self.names
+
+
+def column_filter(columns):
+    """只读取给定列名或候选列名的 ColumnFilter"""
+    return ColumnFilter(flatten_columns(columns))
+
+
+def optimize_dtypes(df, dtypes):
+    """
+    按列转换为更省内存的类型，dtypes 为 {列名: 类型}，类型可为：
+    - 'category'：重复度高的字符串（客户名称、商品名称、BD、类目等）
+    - 'integer'：整数列（sku_id、销量等）按取值范围降为 int8/16/32；含缺失值或小数时保持原样
+    列名不存在或无法转换时保持原样。
+    """
+    for col, kind in dtypes.items():
+        if col not in df.columns:
+            continue
+        if kind == 'category':
+            df[col] = df[col].astype('category')
+        elif kind == 'integer':
+            try:
+                df[col] = pd.to_numeric(df[col], downcast='integer')
+            except (ValueError, TypeError):
+                pass
+        else:
+            raise ValueError(f"不支持的列类型: {kind}")
+    return df
+
+
+def parse_table(file_name, data, **kwargs):
+    """按扩展名完整解析文件，额外参数传给 pd.read_csv / pd.read_excel"""
+    ext = file_extension(file_name)
+    if ext == '.csv':
+        return pd.read_csv(BytesIO(data), **kwargs)
+    if ext in EXCEL_EXTENSIONS:
+        return read_excel(data, **kwargs)
+    raise ValueError(f"不支持的文件格式: {ext}")
+
+
+def read_excel(data, engine=None, **kwargs):
+    """未指定 engine 时使用 EXCEL_ENGINE，解析失败（如 pandas 版本不支持该引擎）时退回 pandas 默认引擎"""
+    if engine is None and EXCEL_ENGINE is not None:
+        try:
+            return pd.read_excel(BytesIO(data), engine=EXCEL_ENGINE, **kwargs)
+        except Exception as e:
+            logger.warning(f"使用 {EXCEL_ENGINE} 引擎解析失败，改用默认引擎: {e}")
+    return pd.read_excel(BytesIO(data), engine=engine, **kwargs)
+
+
+def cache_key(data, kwargs):
+    """缓存键：文件内容的 sha256；使用了影响解析结果的读取参数时附加参数的哈希"""
+    digest = hashlib.sha256(data).hexdigest()
+    options = sorted((key, repr(value)) for key, value in kwargs.items() if key not in CACHE_NEUTRAL_KWARGS)
+    if options:
+        digest += '-' + hashlib.sha256(repr(options).encode()).hexdigest()[:12]
+    return digest
+
+
+def write_cache(df, path):
+    """写入临时文件后原子替换，避免并发会话读到写了一半的文件"""
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    try:
+        if CACHE_EXT == '.parquet':
+            try:
+                df.to_parquet(tmp_path, index=False)
+            except Exception as e:
+                # 混合类型的列或非字符串列名无法写成 Parquet 时改用 pickle
+                logger.warning(f"无法写入Parquet缓存，改用pickle: {e}")
+                path = os.path.splitext(path)[0] + '.pkl'
+                df.to_pickle(tmp_path)
+        else:
+            df.to_pickle(tmp_path)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def evict_upload_cache():
+    """删除过期文件，并在总大小超限时按最近使用时间淘汰"""
+    now = time.time()
+    entries = []
+    for name in os.listdir(UPLOAD_CACHE_DIR):
+        if not name.endswith(('.parquet', '.pkl')):
+            continue
+        path = os.path.join(UPLOAD_CACHE_DIR, name)
+        try:
+            stat = os.stat(path)
+            if now - stat.st_mtime > UPLOAD_CACHE_MAX_AGE_DAYS * 86400:
+                os.remove(path)
+            else:
+                entries.append((stat.st_mtime, stat.st_size, path))
+        except FileNotFoundError:
+            continue
+
+    total_size = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total_size <= UPLOAD_CACHE_MAX_BYTES:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total_size -= size
+
+
+def read_cache(digest, usecols=None):
+    """读取缓存的解析结果，未命中时返回 None；Parquet 缓存只读取 usecols 选中的列"""
+    for ext in ('.parquet', '.pkl'):
+        path = os.path.join(UPLOAD_CACHE_DIR, digest + ext)
+        if not os.path.exists(path):
+            continue
+        try:
+            os.utime(path)  # 记录最近使用时间，供淘汰策略使用
+            if ext == '.pkl':
+                return select_columns(pd.read_pickle(path), usecols)
+            if pq is None:
+                continue
+            columns = None
+            if usecols is not None:
+                columns = [col for col in pq.read_schema(path).names if usecols(col)]
+            return pd.read_parquet(path, columns=columns)
+        except Exception as e:
+            logger.warning(f"读取缓存 {path} 失败，重新解析: {e}")
+    return None
+
+
+def select_columns(df, usecols):
+    """按 usecols 参数（可调用对象）筛选已解析的列"""
+    if usecols is None:
+        return df
+    return df.drop(columns=[col for col in df.columns if not usecols(col)])
+
+
+def detect_date_format(values, sample_size=50):
+    """从非空字符串样本中检测日期格式（'/' 视同 '-'），样本全部符合某个候选格式时返回该格式"""
+    sample = values[values != ''].head(sample_size).str.strip().str.replace('/', '-', regex=False)
+    if sample.empty:
+        return None
+    for date_format in DATE_FORMATS:
+        if pd.to_datetime(sample, format=date_format, errors='coerce').notna().all():
+            return date_format
+    return None
+
+
+def parse_dates(series, date_format=None):
+    """
+    将下单时间/订单日期列转换为 datetime64，返回 (转换后的列, 无法解析的行数)。
+    订单量再大，不同的日期取值通常也只有几百个：只对去重后的取值解析一次，再按编码映射回每一行。
+    字符串按样本检测的格式解析（'/' 和 '-' 两种写法都接受），不符合该格式的取值再逐个推断；
+    Excel 日期单元格等非字符串取值直接转换。空值和空白字符串转换为 NaT，不计入无法解析的行数。
+    指定 date_format 时只按该格式解析，结果与 pd.to_datetime(series, format=date_format, errors='coerce') 相同
+    （其他写法、带时间的取值和空白字符串都转换为 NaT 并计入无法解析的行数）。
+    """
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return series, 0
+
+    with stage('日期转换', rows_in=len(series)) as info:
+        result, unparsable = _parse_dates(series, date_format)
+        info.rows_out = len(result) - int(result.isna().sum())
+    return result, unparsable
+
+
+def _parse_dates(series, date_format=None):
+    codes, uniques = pd.factorize(series)
+    values = pd.Series(uniques, dtype=object)
+    if date_format is not None:
+        parsed = pd.to_datetime(values, format=date_format, errors='coerce')
+        return _take_dates(parsed, codes, parsed.isna().to_numpy(), series)
+
+    if pd.api.types.infer_dtype(values, skipna=True) == 'string':
+        is_text = pd.Series(True, index=values.index)
+    else:
+        is_text = values.map(lambda value: isinstance(value, str)).astype(bool)
+    text = values[is_text]
+
+    parsed = pd.Series(pd.NaT, index=values.index, dtype='datetime64[ns]')
+    date_format = detect_date_format(text)
+    if date_format is not None:
+        for separator_format in (date_format, date_format.replace('-', '/')):
+            pending = is_text & parsed.isna()
+            if pending.any():
+                parsed[pending] = pd.to_datetime(text[pending[is_text]], format=separator_format, errors='coerce')
+
+    # 与检测格式不符的字符串（如日期和日期时间混用、带空格）以及非字符串取值再逐个推断
+    retry = parsed.isna()
+    pending = values[retry].map(lambda value: value.strip().replace('/', '-') if isinstance(value, str) else value)
+    blank = pd.Series(False, index=values.index)
+    blank[retry] = pending.map(lambda value: value == '' if isinstance(value, str) else False).astype(bool)
+    pending = pending[~blank[retry]]
+    if not pending.empty:
+        parsed[pending.index] = pd.to_datetime(pending, format='mixed', errors='coerce')
+
+    return _take_dates(parsed, codes, (parsed.isna() & ~blank).to_numpy(), series)
+
+
+def _take_dates(parsed, codes, invalid, series):
+    """去重取值的解析结果按编码映射回每一行，返回 (转换后的列, 无法解析的行数)"""
+    unparsable = int(np.count_nonzero(invalid[codes[codes >= 0]]))
+    result = pd.DatetimeIndex(parsed).take(codes, allow_fill=True, fill_value=pd.NaT)
+    return pd.Series(result, index=series.index, name=series.name), unparsable
+
+
+def read_table(file_name, data, usecols=None, **kwargs):
+    """
+    解析文件，额外参数传给 pd.read_csv / pd.read_excel；usecols 只支持可调用对象，见 column_filter。
+    解析结果按文件内容哈希缓存在 UPLOAD_CACHE_DIR 中，命中缓存时直接读取列式文件：
+    - 已有完整解析（不限列）的缓存时，从中只读取需要的列，各工具共用
+    - 否则只解析需要的列（解析时的内存峰值与列数成正比），缓存键附加列名集合；
+      需要其他列的工具不能共用这份缓存，首次读取时会再解析一次
+    """
+    if UPLOAD_CACHE_DIR is None:
+        with stage('解析文件') as info:
+            df = parse_table(file_name, data, usecols=usecols, **kwargs)
+            info.rows_out = len(df)
+        return df
+
+    digest = cache_key(data, kwargs)
+    # 按列名集合区分的缓存键；其他可调用对象无法作为缓存键，解析全部列后再筛选
+    names = getattr(usecols, 'names', None)
+    columns_digest = cache_key(data, {**kwargs, 'usecols': sorted(names)}) if names is not None else None
+    with stage('读取缓存') as info:
+        df = read_cache(digest, usecols)
+        if df is None and columns_digest is not None:
+            df = read_cache(columns_digest)
+        info.rows_out = None if df is None else len(df)
+    if df is not None:
+        return df
+
+    with stage('解析文件') as info:
+        df = parse_table(file_name, data, **({'usecols': usecols} if columns_digest else {}), **kwargs)
+        info.rows_out = len(df)
+    try:
+        os.makedirs(UPLOAD_CACHE_DIR, exist_ok=True)
+        write_cache(df, os.path.join(UPLOAD_CACHE_DIR, (columns_digest or digest) + CACHE_EXT))
+        evict_upload_cache()
+    except OSError as e:
+        logger.warning(f"写入缓存失败: {e}")
+    return df if columns_digest else select_columns(df, usecols)
+
+
+def load_table(file_name, data, required=(), name='上传文件', columns=None, dtypes=None, **kwargs):
+    """
+    先校验表头再完整解析；表头无法单独读取时在解析后再校验一次。
+    columns 为需要读取的列（可含候选列名元组，必要列自动包含），其余列不读取；
+    dtypes 见 optimize_dtypes，候选列名可分别指定类型。
+    """
+    with stage('读取文件') as info:
+        found = check_columns(file_name, data, required, name)
+        if columns is not None:
+            kwargs['usecols'] = column_filter(list(required) + list(columns))
+        df = read_table(file_name, data, **kwargs)
+        if found is None:
+            _, missing = find_columns([str(col).strip() for col in df.columns], required)
+            if missing:
+                raise MissingColumnsError(name, missing)
+        if dtypes:
+            optimize_dtypes(df, dtypes)
+        info.rows_out = len(df)
+    return df
+
+
+def load_upload(uploaded_file, required=(), name='上传文件', **kwargs):
+    """读取 Streamlit 上传的文件，见 load_table"""
+    return load_table(uploaded_file.name, uploaded_file.getvalue(), required, name, **kwargs)
+
+
+def files_digest(files):
+    """多个文件的组合哈希（与顺序有关），作为合并结果的缓存键"""
+    digest = hashlib.sha256()
+    for file_name, data in files:
+        digest.update(file_name.encode())
+        digest.update(hashlib.sha256(data).digest())
+    return digest.hexdigest()
+
+
+def _parse_job(job):
+    """进程池中解析单个文件（参数需可序列化，usecols 在子进程中重新生成）"""
+    file_name, data, columns, kwargs = job
+    usecols = column_filter(columns) if columns is not None else None
+    return read_table(file_name, data, usecols=usecols, **kwargs)
+
+
+def alias_renames(columns, aliases):
+    """aliases 为 {标准列名: 候选列名列表}，返回把第一个存在的候选列名改为标准列名的重命名字典"""
+    renames = {}
+    for standard_name, candidates in aliases.items():
+        present = [col for col in candidates if col in columns]
+        if present and standard_name not in columns:
+            renames[present[0]] = standard_name
+    return renames
+
+
+def load_tables(files, required=(), name='上传文件', columns=None, dtypes=None, aliases=None,
+                source_column=SOURCE_COLUMN, max_workers=None, **kwargs):
+    """
+    读取多个文件（如按月或按仓库导出的订单）并纵向合并，files 为 [(文件名, 内容), ...]。
+    先逐个只读取表头校验必要列，全部通过后用进程池并行解析；合并结果增加 source_column 列记录来源文件。
+    各文件可能使用不同的候选列名，合并前按 aliases 统一为标准列名（见 alias_renames）；
+    各文件的 category 取值不同，dtypes 在合并后统一转换。其余参数见 load_table。
+    """
+    with stage('读取文件') as info:
+        found = [check_columns(file_name, data, required, f"{name}（{file_name}）") for file_name, data in files]
+        if columns is not None:
+            columns = list(required) + list(columns)
+        jobs = [(file_name, data, columns, kwargs) for file_name, data in files]
+
+        # 只有一个文件或一个 CPU 时直接在当前进程解析
+        workers = min(len(jobs), max_workers or os.cpu_count() or 1)
+        if workers > 1:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                frames = list(pool.map(_parse_job, jobs))
+        else:
+            frames = [_parse_job(job) for job in jobs]
+
+        for (file_name, _), columns_found, frame in zip(files, found, frames):
+            if columns_found is None:
+                _, missing = find_columns([str(col).strip() for col in frame.columns], required)
+                if missing:
+                    raise MissingColumnsError(f"{name}（{file_name}）", missing)
+            if aliases:
+                frame.rename(columns=alias_renames(frame.columns, aliases), inplace=True)
+            if source_column:
+                frame[source_column] = file_name
+
+        df = pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0]
+        if dtypes or source_column:
+            optimize_dtypes(df, {**(dtypes or {}), **({source_column: 'category'} if source_column else {})})
+        info.rows_out = len(df)
+    return df
+
+
+def load_uploads(uploaded_files, required=(), name='上传文件', **kwargs):
+    """读取 Streamlit 上传的多个文件并合并，见 load_tables"""
+    return load_tables([(f.name, f.getvalue()) for f in uploaded_files], required, name, **kwargs)
@@ -0,0 +1,321 @@
+"""
+生成各工具使用的模拟数据：订单明细表，以及标品/鲜果奖金表、成本价格表、毛利率参考表、待报价文件、
+配方表、原材料价格表、客户/商品匹配表。同一随机种子生成的数据完全相同，可用于基准测试和结果对比。
+
+订单明细表是一张“宽表”，包含所有工具需要的列（同一含义的不同列名都会生成，如 BD 和 bd_name、
+sku_id 和 sku、下单时间和订单日期、类目和一级类目），每个工具都能直接读取同一份文件。
+商品和客户的下单频次按长尾分布生成，少数热门商品和活跃客户占大部分订单。
+
+用法：python gen_data.py --scale 1m -o 模拟数据 [--format xlsx] [--seed 0]
+"""
+import argparse
+import os
+from io import BytesIO
+
+import numpy as np
+import pandas as pd
+
+# 预设规模 -> 订单行数
+SCALES = {'10k': 10_000, '1m': 1_000_000, '10m': 10_000_000}
+
+# Excel 单个工作表的最大行数（含表头）
+EXCEL_MAX_ROWS = 1_048_576
+
+# 订单日期范围默认结束于该日期（固定日期，保证同一种子生成的数据相同）
+DEFAULT_END = '2025-06-30'
+DEFAULT_DAYS = 180
+
+CITIES = ['杭州', '上海', '苏州', '南京', '宁波', '无锡', '合肥', '武汉']
+# 主营类型 -> 客户名称后缀
+MAIN_TYPES = {'烘焙': '烘焙坊', '茶饮': '茶饮店', '咖啡': '咖啡馆', '西餐': '西餐厅', '甜品': '甜品店'}
+BDS = [f'BD{i:02d}' for i in range(1, 21)]
+ORDER_TYPES = ['普通订单', '预售订单', '省心送']
+
+# 一级类目 -> (商品分类列表, 商品名称基础词列表, 商品描述列表)
+# 鲜果的基础词包含 app007 的限类目关键词和 app009 鲜果奖金表的关键词
+CATEGORIES = {
+    '鲜果': (['浆果类', '瓜类', '热带水果'],
+           ['红颜草莓', '麒麟西瓜', '台农芒果', '智利蓝莓', '车厘子', '金煌芒', '章姬草莓', '无籽西瓜'],
+           ['3斤 装', '5斤 装', '10斤装', '5斤', '单果约 200g']),
+    '乳制品': (['淡奶油', '黄油', '奶酪'],
+            ['淡奶油', '无盐黄油', '马斯卡彭', '奶油奶酪', '全脂牛奶', '马苏里拉'],
+            ['1L*12盒', '1kg*10块', '500g*20袋', '1L*6盒']),
+    '烘焙原料': (['面粉', '糖类', '巧克力'],
+             ['高筋面粉', '低筋面粉', '细砂糖', '糖粉', '黑巧克力', '可可粉'],
+             ['25kg/袋', '1kg*10袋', '5kg/箱']),
+    '饮品原料': (['茶叶', '果酱', '糖浆'],
+             ['茉莉绿茶', '四季春茶', '草莓果酱', '芒果果酱', '果糖', '焦糖糖浆'],
+             ['500g*20袋', '1.2kg*12瓶', '2.5kg*6瓶']),
+    '包装耗材': (['杯子', '吸管', '打包袋'],
+             ['700ml注塑杯', '粗吸管', '单杯打包袋', '蛋糕盒'],
+             ['1000个/箱', '500支/包', '100个/包']),
+}
+CATEGORY_WEIGHTS = [0.3, 0.25, 0.2, 0.15, 0.1]
+BRANDS = ['', '安佳', '爱乐薇', '总统', '蓝风车', '王后', '金像', '百钻', '鲜沐']
+# app003 和 app006 单独处理的商品，放在热门商品中
+SPECIAL_PRODUCTS = [('安佳淡奶油', '乳制品', '淡奶油', '1L*12盒'), ('爱乐薇(铁塔)淡奶油', '乳制品', '淡奶油', '1L*12盒')]
+
+# 鲜果奖金表：关键词 -> 规格列表（另加“其他”规格）
+FRUIT_BONUS_SPECS = {'草莓': ['3斤', '5斤'], '西瓜': ['10斤'], '芒': ['5斤'], '蓝莓': ['单果约200g'], '车厘子': []}
+
+# 配方原材料的单位，及对应的到货规格和单位
+RECIPE_UNITS = ['克', '克', '克', '毫升', '个', '公斤']
+CATALOG_PACKS = [(25, '公斤'), (1, '公斤'), (500, '克'), (1, '升'), (12, '个'), (5, '斤')]
+
+
+def scale_rows(scale):
+    """预设规模名称或行数（如 '1m'、'250000'）转换为订单行数"""
+    if str(scale).lower() in SCALES:
+        return SCALES[str(scale).lower()]
+    try:
+        rows = int(scale)
+    except ValueError:
+        raise ValueError(f"不支持的规模：{scale}（可用 {', '.join(SCALES)} 或行数）")
+    if rows <= 0:
+        raise ValueError("订单行数必须大于0")
+    return rows
+
+
+def clamp(value, low, high):
+    return int(min(max(value, low), high))
+
+
+def long_tail_weights(n, rng, exponent=1.1):
+    """长尾分布的抽样权重：排名越靠前权重越大，排名顺序随机打乱"""
+    weights = 1 / np.arange(1, n + 1) ** exponent
+    return rng.permutation(weights / weights.sum())
+
+
+def build_products(n, rng):
+    """商品表：商品名称、sku_id、类目、商品分类、商品描述、单价，按热门程度排列（热门在前）"""
+    categories = rng.choice(list(CATEGORIES), n - len(SPECIAL_PRODUCTS), p=CATEGORY_WEIGHTS)
+    rows = list(SPECIAL_PRODUCTS)
+    seen = {name for name, *_ in SPECIAL_PRODUCTS}
+    counters = dict.fromkeys(CATEGORIES, 0)
+    for category in categories:
+        sub_categories, bases, descriptions = CATEGORIES[category]
+        i = counters[category]
+        counters[category] += 1
+        base = bases[i % len(bases)]
+        brand = BRANDS[(i // len(bases)) % len(BRANDS)] if category != '鲜果' else ''
+        name = f"{brand}{base}"
+        # 品牌和基础词组合用完后加编号
+        if name in seen:
+            name = f"{name}{i // (len(bases) * len(BRANDS)) + 1}号"
+        while name in seen:
+            name += '*'
+        seen.add(name)
+        rows.append((name, category, sub_categories[i % len(sub_categories)],
+                     descriptions[rng.integers(len(descriptions))]))
+
+    products = pd.DataFrame(rows, columns=['商品名称', '类目', '商品分类', '商品描述'])
+    products.insert(1, 'sku_id', np.arange(10001, 10001 + n))
+    products['单价'] = np.round(rng.lognormal(4, 0.8, n).clip(5, 2000), 2)
+    return products
+
+
+def build_customers(n, rng):
+    """客户表：客户名称、cust_id、m_id、主营类型、BD（每个客户固定归属一个BD）"""
+    main_types = rng.choice(list(MAIN_TYPES), n)
+    cities = rng.choice(CITIES, n)
+    names = [f"{city}{i + 1:05d}{MAIN_TYPES[main_type]}" for i, (city, main_type) in enumerate(zip(cities, main_types))]
+    return pd.DataFrame({
+        '客户名称': names,
+        'cust_id': np.arange(1, n + 1),
+        'm_id': np.arange(500001, 500001 + n),
+        '主营类型': main_types,
+        'BD': rng.choice(BDS, n),
+    })
+
+
+def generate_orders(products, customers, rows, rng, end=DEFAULT_END, days=DEFAULT_DAYS):
+    """订单明细宽表，按下单时间排序；字符串列为 category，下单时间为 datetime64"""
+    # 客户活跃度和商品热门程度均为长尾分布；约三成订单来自客户自己偏好的商品（商品序号整体偏移）
+    customer = rng.choice(len(customers), rows, p=long_tail_weights(len(customers), rng, 0.8))
+    popular = np.arange(len(products))
+    product_weights = 1 / (popular + 1) ** 1.1
+    product = rng.choice(len(products), rows, p=product_weights / product_weights.sum())
+    shift = rng.integers(0, len(products), len(customers))
+    preferred = rng.random(rows) < 0.3
+    product[preferred] = (product[preferred] + shift[customer[preferred]]) % len(products)
+
+    # 下单时间：日期均匀分布，时间集中在 6:00 - 22:00
+    start = pd.Timestamp(end) - pd.Timedelta(days=days - 1)
+    seconds = rng.integers(0, days, rows) * 86400 + rng.integers(6 * 3600, 22 * 3600, rows)
+    order_time = np.sort(start.to_datetime64().astype('datetime64[s]') + seconds.astype('timedelta64[s]'))
+
+    quantity = rng.choice([1, 1, 1, 2, 2, 3, 5, 10], rows)
+    price = products['单价'].to_numpy()[product]
+    paid = np.round(quantity * price * rng.uniform(0.85, 1.0, rows), 2)
+
+    def take(table, column, index):
+        # 按编码取值生成 category 列，避免构造千万个字符串对象
+        values = table[column]
+        categories = pd.Index(values.unique())
+        return pd.Categorical.from_codes(categories.get_indexer(values)[index], categories)
+
+    order_date = pd.Series(order_time.astype('datetime64[D]'))
+    day_codes, day_values = pd.factorize(order_date)
+    order_date_text = pd.Categorical.from_codes(day_codes, pd.Index(day_values.strftime('%Y/%m/%d')))
+
+    bd = take(customers, 'BD', customer)
+    sku = products['sku_id'].to_numpy()[product]
+    category = take(products, '类目', product)
+    return pd.DataFrame({
+        '下单时间': order_time,
+        '订单日期': order_date_text,
+        '客户名称': take(customers, '客户名称', customer),
+        'cust_id': customers['cust_id'].to_numpy()[customer],
+        'm_id': customers['m_id'].to_numpy()[customer],
+        '主营类型': take(customers, '主营类型', customer),
+        'BD': bd,
+        'bd_name': bd,
+        '商品名称': take(products, '商品名称', product),
+        'sku_id': sku,
+        'sku': sku,
+        '商品描述': take(products, '商品描述', product),
+        '类目': category,
+        '一级类目': category,
+        '商品分类': take(products, '商品分类', product),
+        '订单类型': pd.Categorical.from_codes(rng.choice(len(ORDER_TYPES), rows, p=[0.8, 0.1, 0.1]), ORDER_TYPES),
+        '销量': quantity,
+        '实付金额': paid,
+    })
+
+
+def generate_recipes(n_recipes, n_materials, rng):
+    """配方表、原材料价格表和新价格表（约一成原材料调价，少数原材料缺少价格）"""
+    materials = [f"原料{i + 1:04d}" for i in range(n_materials)]
+    counts = rng.integers(3, 9, n_recipes)
+    recipe = np.repeat(np.arange(n_recipes), counts)
+    recipes = pd.DataFrame({
+        '配方名称': [f"配方{i + 1:05d}" for i in recipe],
+        '原材料名称': np.asarray(materials)[rng.choice(n_materials, len(recipe), p=long_tail_weights(n_materials, rng))],
+        '用量': np.round(rng.uniform(1, 500, len(recipe)), 1),
+        '单位': rng.choice(RECIPE_UNITS, len(recipe)),
+    }).drop_duplicates(['配方名称', '原材料名称'])
+
+    packs = rng.integers(len(CATALOG_PACKS), size=n_materials)
+    catalog = pd.DataFrame({
+        '原材料名称': materials,
+        '到货规格': [CATALOG_PACKS[i][0] for i in packs],
+        '到货单位': [CATALOG_PACKS[i][1] for i in packs],
+        '到货价格': np.round(rng.lognormal(4, 1, n_materials).clip(2, 3000), 2),
+    })
+    catalog = catalog[rng.random(n_materials) >= 0.03].reset_index(drop=True)
+
+    new_prices = catalog.sample(frac=0.1, random_state=rng.integers(2 ** 31)).copy()
+    new_prices['到货价格'] = np.round(new_prices['到货价格'] * rng.uniform(0.9, 1.2, len(new_prices)), 2)
+    return recipes, catalog, new_prices.reset_index(drop=True)
+
+
+def generate_tables(rows, seed=0, end=DEFAULT_END, days=DEFAULT_DAYS):
+    """生成全部模拟数据，返回 {文件名（不含扩展名）: 表}"""
+    rng = np.random.default_rng(seed)
+    products = build_products(clamp(rows // 1000, 40, 5000), rng)
+    customers = build_customers(clamp(rows // 100, 50, 50_000), rng)
+    orders = generate_orders(products, customers, rows, rng, end, days)
+
+    # 标品奖金表（app008）：约三成非鲜果商品
+    standard = products[products['类目'] != '鲜果'].sample(frac=0.3, random_state=rng.integers(2 ** 31))
+    commission = np.round(rng.uniform(0.5, 3, len(standard)), 2)
+    bonus = pd.DataFrame({
+        '商品名称': standard['商品名称'].to_numpy(),
+        'SKU': standard['sku_id'].to_numpy(),
+        '存量佣金': commission,
+        '增量佣金': np.round(commission * rng.uniform(1.5, 2, len(standard)), 2),
+    })
+
+    # 鲜果奖金表（app009）：每个关键词的各规格加一行“其他”
+    fruit_rows = [(keyword, spec) for keyword, specs in FRUIT_BONUS_SPECS.items() for spec in specs + ['其他']]
+    stock = np.round(rng.uniform(0.5, 2, len(fruit_rows)), 1)
+    fruit_bonus = pd.DataFrame(fruit_rows, columns=['关键词', '规格'])
+    fruit_bonus['存量奖金'] = stock
+    fruit_bonus['增量奖金'] = stock * 2
+
+    # 报价工具（baojia）：成本价格表、毛利率参考表、待报价文件（名称带括号备注或改写，部分商品不在成本表中）
+    cost = products[['商品名称', '商品分类']].assign(成本价=np.round(products['单价'] * 0.7, 2))
+    sub_categories = sorted(products['商品分类'].unique())
+    margin = pd.DataFrame({
+        '序号': np.arange(1, len(sub_categories) + 1),
+        '商品分类': sub_categories,
+        '线上客户毛利率': rng.integers(15, 35, len(sub_categories)),
+        '线下客户毛利率': rng.integers(10, 30, len(sub_categories)),
+    })
+    quote_names = products['商品名称'].sample(min(200, len(products)), random_state=rng.integers(2 ** 31))
+    quote_names = [f"{name}(新品)" if i % 3 == 0 else f" {name} " for i, name in enumerate(quote_names)]
+    quote = pd.DataFrame({
+        '商品名称': quote_names + [f"未知商品{i}" for i in range(10)],
+        '数量': rng.integers(1, 50, len(quote_names) + 10),
+    })
+
+    # 配方成本（app000）
+    recipes, catalog, new_prices = generate_recipes(clamp(rows // 50, 20, 200_000), clamp(rows // 1000, 30, 5000), rng)
+
+    # 客户匹配表（app002、app007）和商品匹配表（app001、app007）
+    matching_customers = customers[['客户名称']].sample(frac=0.2, random_state=rng.integers(2 ** 31))
+    matching_products = pd.concat([
+        products[['商品名称']].head(20),
+        pd.DataFrame({'商品名称': ['草莓', '芒果']})
+    ], ignore_index=True)
+
+    return {
+        '订单明细': orders,
+        '标品奖金表': bonus,
+        '鲜果奖金表': fruit_bonus,
+        '成本价格表': cost,
+        '毛利率参考表': margin,
+        '待报价文件': quote,
+        '配方表': recipes,
+        '原材料价格表': catalog,
+        '新价格表': new_prices,
+        '客户匹配表': matching_customers.reset_index(drop=True),
+        '商品匹配表': matching_products,
+    }
+
+
+def table_bytes(df, fmt='csv'):
+    """表序列化为上传文件的内容"""
+    if fmt == 'csv':
+        return df.to_csv(index=False).encode('utf-8')
+    if fmt == 'xlsx':
+        if len(df) >= EXCEL_MAX_ROWS:
+            raise ValueError(f"{len(df)} 行超出 Excel 工作表的行数上限，请使用 csv 格式")
+        output = BytesIO()
+        df.to_excel(output, index=False, engine='xlsxwriter')
+        return output.getvalue()
+    raise ValueError(f"不支持的文件格式: {fmt}")
+
+
+def write_tables(tables, out_dir, fmt='csv'):
+    """每张表写成一个文件，返回写入的文件路径列表"""
+    os.makedirs(out_dir, exist_ok=True)
+    paths = []
+    for name, df in tables.items():
+        path = os.path.join(out_dir, f"{name}.{fmt}")
+        with open(path, 'wb') as f:
+            f.write(table_bytes(df, fmt))
+        paths.append(path)
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description="生成各工具使用的模拟数据")
+    parser.add_argument('--scale', default='10k', help=f"订单行数：{', '.join(SCALES)} 或具体行数")
+    parser.add_argument('-o', '--output', default='模拟数据', help="输出目录")
+    parser.add_argument('--format', default='csv', choices=['csv', 'xlsx'], help="文件格式")
+    parser.add_argument('--seed', type=int, default=0, help="随机种子")
+    parser.add_argument('--end', default=DEFAULT_END, help="订单的最后日期")
+    parser.add_argument('--days', type=int, default=DEFAULT_DAYS, help="订单覆盖的天数")
+    args = parser.parse_args()
+
+    try:
+        tables = generate_tables(scale_rows(args.scale), args.seed, args.end, args.days)
+        for path in write_tables(tables, args.output, args.format):
+            print(f"已写入 {path}")
+    except ValueError as e:
+        parser.exit(1, f"错误：{e}\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,814 @@
+"""
+结果一致性检查：在同一份模拟数据（gen_data.py）上运行各工具当前的计算逻辑，与保存的基准结果以及
+其他实现路径（流式读取、增量更新，以及改写前的实现等）的结果逐表对比，输出差异报告。
+改写前的实现（legacy_* 函数）同一日期的多行按原表顺序取舍，见“改写前的实现”一节。
+改写计算逻辑或换用更快的引擎前先保存基准结果，改完后检查，确认奖金等数字与改写前完全一致。
+
+用法：
+  python golden.py record --scale 10k --dir 基准结果_10k       # 保存当前实现的结果
+  python golden.py check --dir 基准结果_10k --report 报告.md   # 与基准结果及其他实现路径对比
+  python golden.py check --scale 10k                          # 只对比各实现路径
+
+对比规则：
+- 列名、行数和每个单元格的取值都要一致；行的顺序不影响结果（按主键或整行匹配），列类型不比较
+- 金额列按工具的展示精度取整后再比较：app008 的奖金按两位小数展示，app009 的奖金在计算时保留两位小数
+- 空值（NaN、NaT、None）之间视为相同
+
+新的快速实现写好后，在 TOOLS 中对应工具的 candidates 里登记 {名称: 函数}。函数接收模拟数据（BenchData），
+返回与当前实现相同的 {表名: 结果表}；不适用于当前数据时返回 None。
+"""
+import argparse
+import json
+import os
+import pickle
+import sys
+import tempfile
+from collections import Counter
+from datetime import datetime, timedelta
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+
+import data_loader
+from benchmark import BenchData, environment
+from gen_data import SCALES, scale_rows, table_bytes
+
+# 报告中每类差异最多列出的示例数
+MAX_EXAMPLES = 5
+
+# 金额保留两位小数
+MONEY = 2
+
+
+# ================== 各工具当前的实现 ==================
+# 每个函数接收模拟数据，返回 {表名: 结果表}，表名与页面下载的工作表一致
+
+def costing_tables(data):
+    """
+    配方表、原材料价格表和新价格表，各加一列品牌：配方用到的第一种调价原材料品牌为空，其余为“品牌A”。
+    完整核算时空品牌按空值相互匹配，这种原材料的调价也应计入成本簿的增量更新。
+    """
+    import app000
+    new_prices = data.tables['新价格表']
+    blank = new_prices.loc[new_prices['原材料名称'].isin(data.tables['配方表']['原材料名称']), '原材料名称'].iloc[0]
+    tables = []
+    for name, required in [('配方表', app000.RECIPE_COLUMNS), ('原材料价格表', app000.CATALOG_COLUMNS),
+                           ('新价格表', app000.CATALOG_COLUMNS)]:
+        df = data.tables[name]
+        df = df.assign(品牌=np.where(df['原材料名称'] == blank, None, '品牌A'))
+        tables.append(data_loader.load_table(f"{name}.{data.fmt}", table_bytes(df, data.fmt), required, name))
+    return tables
+
+
+def costing_outputs(data):
+    import app000
+    recipes, catalog, new_prices = costing_tables(data)
+    book = app000.RecipeCostBook(recipes, catalog)
+    impact = book.update_prices(new_prices)
+    return app000.costing_sheets(book, impact)
+
+
+def costing_rebuilt(data):
+    """价格变动后按新价格完整重算，应与成本簿的增量更新一致"""
+    import app000
+    recipes, catalog, new_prices = costing_tables(data)
+    book = app000.RecipeCostBook(recipes, pd.concat([catalog, new_prices], ignore_index=True))
+    return app000.costing_sheets(book)
+
+
+def match_outputs(data):
+    import app001
+    base_df = app001.read_file(*data.file('订单明细'))
+    match_df = app001.read_file(*data.file('商品匹配表'))
+    return {'匹配结果': app001.match_latest_orders(base_df, match_df)}
+
+
+def match_legacy(data):
+    """汇总用改写前的排序 + 分组（legacy_aggregate_latest_orders）"""
+    import app001
+    with mock.patch.object(app001, 'aggregate_latest_orders', legacy_aggregate_latest_orders):
+        return match_outputs(data)
+
+
+def inactive_outputs(data):
+    import app002
+    result = app002.read_latest_orders([data.file('订单明细')], data.file('客户匹配表'))
+    return inactive_products(result, data)
+
+
+def inactive_streamed(data):
+    """分块读取 CSV 的流式路径"""
+    import app002
+    if data.fmt != 'csv':
+        return None
+    with tempfile.TemporaryDirectory() as tmp:
+        file_name, content = data.file('订单明细')
+        path = os.path.join(tmp, file_name)
+        with open(path, 'wb') as f:
+            f.write(content)
+        # 分块小于行数，确保跨块合并的逻辑被覆盖
+        result = app002.scan_latest_orders(path, data.file('客户匹配表'), chunksize=max(1000, data.rows // 7))
+    return inactive_products(result, data)
+
+
+def inactive_legacy(data):
+    """改写前的完整读取 + 排序去重 + 按日期筛选（legacy_inactive_products）"""
+    return {'Inactive Products': legacy_inactive_products(data.file('订单明细'), data.file('客户匹配表'), 30, data.now)}
+
+
+def inactive_products(result, data):
+    import app002
+    latest_orders, valid_count, _, has_m_id = result
+    return {'Inactive Products': app002.select_inactive(latest_orders, valid_count, has_m_id, 30, data.now)}
+
+
+def mom_outputs(data):
+    import app003
+    raw_df = app003.read_orders([data.file('订单明细')])
+    period2 = (data.end - timedelta(days=29), data.end)
+    period1 = (period2[0] - timedelta(days=30), period2[0] - timedelta(days=1))
+    return app003.compare_periods(raw_df, period1, period2)
+
+
+def missing_outputs(data):
+    import app004
+    return {'分析结果': app004.find_missing_products(data.read('订单明细', app004.REQUIRED_COLUMNS))}
+
+
+def cycle_outputs(data):
+    import app005
+    orders, _ = app005.prepare_orders(data.read('订单明细', app005.REQUIRED_COLUMNS))
+    return cycle_sheets(app005.CycleStats().update(orders))
+
+
+def cycle_incremental(data):
+    """按下单时间分两批并入（页面追加新订单的路径），应与一次性统计一致"""
+    import app005
+    orders, _ = app005.prepare_orders(data.read('订单明细', app005.REQUIRED_COLUMNS))
+    cutoff = data.end - timedelta(days=30)
+    earlier = orders['下单时间'] < cutoff
+    return cycle_sheets(app005.CycleStats().update(orders[earlier]).update(orders[~earlier]))
+
+
+def cycle_reingested(data):
+    """先并入前一段订单，再把完整订单并入两次（与上一批重叠、重复上传），重复的订单不应产生新的间隔"""
+    import app005
+    orders, _ = app005.prepare_orders(data.read('订单明细', app005.REQUIRED_COLUMNS))
+    cutoff = data.end - timedelta(days=30)
+    return cycle_sheets(app005.CycleStats().update(orders[orders['下单时间'] < cutoff]).update(orders).update(orders))
+
+
+def cycle_legacy(data):
+    """改写前的逐组合重新计算（legacy_cycle_summary）"""
+    import app005
+    orders, _ = app005.prepare_orders(data.read('订单明细', app005.REQUIRED_COLUMNS))
+    return {estimator: app005.format_prediction(legacy_cycle_summary(orders, estimator))
+            for estimator in app005.ESTIMATORS}
+
+
+def cycle_sheets(stats):
+    # 未来N天预计下单的名单与运行当天有关，不参与对比
+    import app005
+    return {estimator: app005.format_prediction(stats.summary(estimator)) for estimator in app005.ESTIMATORS}
+
+
+def gmv_outputs(data):
+    import app006
+    _, total_gmv, customer_avg_gmv = app006.gmv_cube(data.read('订单明细', app006.REQUIRED_COLUMNS, columns=[]))
+    sheets = app006.scenario_sheets(customer_avg_gmv, [5, 10], [(1, 10), (11, 50)])
+    return {'实付GMV总和': pd.DataFrame({'实付GMV总和值': [total_gmv]}), **sheets}
+
+
+def commission_orders(data):
+    """
+    原始数据表，另加一行无效日期的订单：复制一个不活跃组合最后购买的那行，日期改为无法解析的文本。
+    该组合的最后购买取无效日期的一行，不再出现在结果中，各路径（包括记录库）都应如此。
+    """
+    import app007
+    df = app007.read_original_files([data.file('订单明细')])
+    dates, _ = data_loader.parse_dates(df['order_date'])
+    last = dates.groupby([df['客户名称'], df['商品名称']], observed=True).transform('max')
+    inactive = df[(dates == last) & (last < data.now - timedelta(days=30))]
+    invalid = inactive.head(1).assign(order_date='无效日期')
+    return pd.concat([df, invalid], ignore_index=True)
+
+
+def commission_outputs(data):
+    return commission_inactive(commission_orders(data), data)
+
+
+def commission_store(data):
+    """先并入本地最后购买记录库再查询的增量路径"""
+    import app007
+    df = commission_orders(data)
+    df['order_date'], _ = data_loader.parse_dates(df['order_date'])
+    with tempfile.TemporaryDirectory() as tmp:
+        store = app007.LastPurchaseStore(os.path.join(tmp, 'store.sqlite'))
+        try:
+            store.ingest(df)
+            df = store.inactive_since(data.now - timedelta(days=30))
+        finally:
+            store.conn.close()
+    return commission_inactive(df, data)
+
+
+def commission_store_batches(data):
+    """
+    分两批并入记录库：第一批带一行空 cust_id（整列读成浮点数），第二批不带空值。
+    同一客户两批的编号应写成同一个主键，结果与一次性计算一致。
+    """
+    import app007
+    df = commission_orders(data)
+    df['order_date'], _ = data_loader.parse_dates(df['order_date'])
+    # 无效日期的一行随第二批并入，应覆盖该组合第一批记下的有效日期
+    earlier = df['order_date'] < data.end - timedelta(days=30)
+    blank = df[earlier].head(1).assign(cust_id=np.nan)
+    with tempfile.TemporaryDirectory() as tmp:
+        store = app007.LastPurchaseStore(os.path.join(tmp, 'store.sqlite'))
+        try:
+            store.ingest(pd.concat([df[earlier], blank], ignore_index=True))
+            store.ingest(df[~earlier])
+            df = store.inactive_since(data.now - timedelta(days=30))
+        finally:
+            store.conn.close()
+    return commission_inactive(df, data)
+
+
+def commission_legacy_latest(data):
+    """最后购买记录用改写前的排序去重（legacy_latest_purchases）"""
+    import app007
+    with mock.patch.object(app007, 'extract_latest_purchases', legacy_latest_purchases):
+        return commission_outputs(data)
+
+
+def commission_legacy_filter(data):
+    """商品筛选用改写前的逐词 str.contains（legacy_smart_product_filter）"""
+    import app007
+    with mock.patch.object(app007, 'smart_product_filter', legacy_smart_product_filter):
+        return commission_outputs(data)
+
+
+def commission_inactive(df, data):
+    import app007
+    terms = data.tables['商品匹配表']['商品名称'].astype(str).unique()
+    inactive_df, _ = app007.find_inactive(app007.smart_product_filter(df, terms), 30, data.now)
+    return {'不活跃商品': inactive_df}
+
+
+def payroll_orders(data):
+    """
+    奖金工具的原始数据表：最后一天（奖金周期的结束日）的订单各复制两份，记到新的客户名下（成为新的客户-商品组合，
+    app009 不会按重复行去掉），订单日期分别写成带时间的 '2025/06/30 10:00:00' 和 '-' 分隔的 '2025-06-30'。
+    两种写法都不符合 '%Y/%m/%d'，与改写前一样视为无效日期，不计入奖金。
+    """
+    orders = data.tables['订单明细']
+    last_day = orders[orders['订单日期'] == f"{data.end:%Y/%m/%d}"]
+    customers = last_day['客户名称'].astype(str)
+    extra = pd.concat([last_day.assign(订单日期=f"{data.end:%Y/%m/%d} 10:00:00", 客户名称=customers + '-带时间'),
+                       last_day.assign(订单日期=f"{data.end:%Y-%m-%d}", 客户名称=customers + '-横线日期')],
+                      ignore_index=True)
+    return f"订单明细.{data.fmt}", table_bytes(pd.concat([orders, extra], ignore_index=True), data.fmt)
+
+
+def incentive_outputs(data):
+    import app008
+    bonus_df = data.read('标品奖金表', app008.BONUS_COLUMNS)
+    raw_df = app008.read_raw_data([payroll_orders(data)])
+    start = (data.end - timedelta(days=29)).date()
+    summary_df, detail_df = app008.compute_commission(raw_df, bonus_df, start, data.end.date())
+    return {'汇总': summary_df, '明细': detail_df}
+
+
+def incentive_legacy_dates(data):
+    """订单日期用改写前的整列 pd.to_datetime（legacy_parse_dates）"""
+    import app008
+    with mock.patch.object(app008, 'parse_dates', legacy_parse_dates):
+        return incentive_outputs(data)
+
+
+def fruit_outputs(data):
+    import app009
+    bonus_df = app009.read_data_files([data.file('鲜果奖金表')], "鲜果奖金表")
+    raw_df, _ = app009.normalize_order_dates(app009.read_data_files([payroll_orders(data)], "原始数据表"))
+    start = (data.end - timedelta(days=29)).date()
+    result = app009.compute_fruit_bonus(raw_df, bonus_df, start, data.end.date())
+    if result is None:
+        return {}
+    summary_with_total, detail_df = result
+    return {'BD奖金统计': summary_with_total, '奖金明细': detail_df}
+
+
+def fruit_legacy_dates(data):
+    """订单日期用改写前的整列 pd.to_datetime（legacy_parse_dates）"""
+    import app009
+    with mock.patch.object(app009, 'parse_dates', legacy_parse_dates):
+        return fruit_outputs(data)
+
+
+def quote_outputs(data):
+    import baojia
+    quote_df, avg_gross_margin, _ = baojia.quote_prices(
+        data.read('成本价格表', baojia.COST_COLUMNS), data.read('待报价文件', ['商品名称']),
+        data.read('毛利率参考表', baojia.MARGIN_COLUMNS), '线上客户')
+    return {'报价结果': quote_df, '综合毛利率': pd.DataFrame({'综合毛利率': [avg_gross_margin]})}
+
+
+# ================== 改写前的实现 ==================
+# 各工具改写前的计算逻辑，作为其他实现路径与当前实现对比。
+# 改写前按日期排序时用的是默认的不稳定排序，同一日期的多行取哪一行不确定；这里统一改为稳定排序
+# （同一日期按原表顺序），结果是确定的，也是当前实现约定的取法。
+
+def legacy_parse_dates(series, date_format=None):
+    """app008/app009 改写前：整列调用一次 pd.to_datetime，无法解析的行数按 NaT 计"""
+    dates = pd.to_datetime(series, format=date_format, errors='coerce')
+    return dates, int(dates.isna().sum() - series.isna().sum())
+
+
+def legacy_aggregate_latest_orders(df, keys=('客户名称', '商品名称'), first_columns=('m_id', 'BD', 'sku'),
+                                   date_col='下单时间'):
+    """app001 改写前：按日期排序后分组，属性列取第一个值，日期取最大值"""
+    return df.sort_values(date_col, kind='stable').groupby(list(keys)).agg(
+        {**dict.fromkeys(first_columns, 'first'), date_col: 'max'}).reset_index()
+
+
+def legacy_inactive_products(original, matching, threshold_days, now):
+    """app002 改写前：完整读取原始数据表，全表排序去重后按阈值日期筛选（不缓存汇总结果，不用二分查找）"""
+    import app002
+    original_df = data_loader.parse_table(*original)
+    rename_map, _, has_m_id = app002.resolve_columns(original_df.columns)
+    original_df = original_df.rename(columns=rename_map)
+    matching_df = data_loader.parse_table(*matching)
+    matched_customers = original_df[original_df['客户名称'].isin(matching_df['客户名称'])].copy()
+    matched_customers['order_date'] = pd.to_datetime(matched_customers['order_date'], errors='coerce')
+
+    latest_orders = matched_customers.sort_values('order_date', kind='stable').drop_duplicates(
+        ['客户名称', '商品名称'], keep='last')
+    inactive_products = latest_orders[latest_orders['order_date'] < now - timedelta(days=int(threshold_days))]
+    result_columns = ['客户名称', '商品名称', 'sku_id', 'BD', 'order_date']
+    if has_m_id:
+        result_columns.append('m_id')
+    return inactive_products[result_columns].rename(columns={'order_date': '最后一次购买日期'})
+
+
+def legacy_smart_product_filter(df, search_terms):
+    """app007 改写前：每个搜索词分别 str.contains 后按位或"""
+    import app007
+    df_clean = df.assign(
+        clean_name=df['商品名称'].str.lower().str.strip().fillna(''),
+        category_lower=df['类目'].str.lower().str.strip()
+    )
+    restricted_keywords = {kw.lower() for kw in app007.CATEGORY_RESTRICTED_KEYWORDS}
+    terms = [str(term).strip().lower() for term in search_terms]
+    restricted_terms = [term for term in terms if term in restricted_keywords]
+    normal_terms = [term for term in terms if term not in restricted_keywords]
+
+    conditions = []
+    if restricted_terms:
+        name_cond = pd.Series(False, index=df.index)
+        for term in restricted_terms:
+            name_cond |= df_clean['clean_name'].str.contains(term, regex=False, case=False)
+        conditions.append((df_clean['category_lower'] == '鲜果') & name_cond)
+    if normal_terms:
+        normal_cond = pd.Series(False, index=df.index)
+        for term in normal_terms:
+            normal_cond |= df_clean['clean_name'].str.contains(term, regex=False, case=False)
+        conditions.append(normal_cond)
+    if conditions:
+        return df[pd.concat(conditions, axis=1).any(axis=1)]
+    return df
+
+
+def legacy_cycle_summary(orders, estimator):
+    """
+    app005 改写前的做法：每次查询都从全部订单逐个 客户-商品 重新计算购买间隔（按下单时间排序后 diff），
+    不维护增量统计。汇总的列与估计方法沿用当前实现：BD 取最后一次下单的 BD，
+    中位数、分位数和去极值均值只用最近 CYCLE_WINDOW 个间隔，EWMA 按时间顺序逐个递推。
+    """
+    import app005
+    df = orders[app005.PAIR_COLUMNS + ['BD', '下单时间']].dropna(subset=['下单时间'])
+    df = df.sort_values(app005.PAIR_COLUMNS + ['下单时间'], kind='stable')
+    rows = []
+    for (customer, product), group in df.groupby(app005.PAIR_COLUMNS, sort=False, observed=True):
+        gaps = (group['下单时间'].diff().dropna() // pd.Timedelta(days=1)).to_numpy(dtype=float)
+        if len(gaps) == 0:
+            continue
+        recent = gaps[-app005.CYCLE_WINDOW:]
+        p25, median, p75 = np.percentile(recent, [25, 50, 75])
+        iqr = p75 - p25
+        ewma = gaps[0]
+        for gap in gaps[1:]:
+            ewma = app005.EWMA_ALPHA * gap + (1 - app005.EWMA_ALPHA) * ewma
+        rows.append({
+            '客户名称': customer, '商品名称': product, 'BD': group['BD'].iloc[-1],
+            '购买间隔次数': len(gaps), '平均购买周期(天)': gaps.mean(),
+            '最短购买周期(天)': gaps.min(), '最长购买周期(天)': gaps.max(),
+            '中位购买周期(天)': median, 'P25购买周期(天)': p25, 'P75购买周期(天)': p75,
+            'EWMA购买周期(天)': ewma,
+            '去极值平均周期(天)': recent[(recent >= p25 - 1.5 * iqr) & (recent <= p75 + 1.5 * iqr)].mean(),
+            '最近一次下单时间': group['下单时间'].max(),
+        })
+    summary = pd.DataFrame(rows)
+    summary = summary[
+        (summary['平均购买周期(天)'] != 0) |
+        (summary['最短购买周期(天)'] != 0) |
+        (summary['最长购买周期(天)'] != 0)
+    ]
+    summary['预测购买时间'] = summary['最近一次下单时间'] + pd.to_timedelta(
+        summary[app005.ESTIMATORS[estimator]], unit='D')
+    return summary.reset_index(drop=True)
+
+
+def legacy_latest_purchases(df, keys=('客户名称', '商品名称'), date_col='order_date'):
+    """app007 改写前：按日期排序后每个组合保留最后一行"""
+    return df.sort_values(date_col, kind='stable').drop_duplicates(list(keys), keep='last').reset_index(drop=True)
+
+
+# ================== 构造的边界用例 ==================
+# 模拟数据覆盖不到的情况（同一日期多行、无效日期、分组键为空、空表）：每个用例给出输入和手写的预期结果，
+# 当前实现和改写前的实现都要与预期一致，行的顺序也要相同。
+
+def match_cases():
+    """app001 aggregate_latest_orders 的用例，返回 [(用例名, 预期的 {表名: 结果表}, {实现名: {表名: 结果表}})]"""
+    import app001
+    day = pd.Timestamp
+    columns = ['客户名称', '商品名称', 'm_id', 'BD', 'sku', '下单时间']
+    orders = pd.DataFrame([
+        ['乙', 'x', 9, 'B9', 90, day('2025-01-05')],
+        # 甲-a：最早一天（01-01）的 m_id 为空，取下一天（01-02）两行中原表靠前的一行
+        ['甲', 'a', 1, None, 10, day('2025-01-02')],
+        ['甲', 'a', 2, 'B2', 20, day('2025-01-02')],
+        ['甲', 'a', np.nan, 'B3', 30, day('2025-01-01')],
+        ['甲', 'a', 4, 'B4', 40, pd.NaT],
+        # 甲-b：同一天的两行，各列都取原表靠前的一行
+        ['甲', 'b', 5, 'B5', 50, day('2025-01-03')],
+        ['甲', 'b', 6, 'B6', 60, day('2025-01-03')],
+        # 丙-c：日期全部无效，取原表第一行，最大日期为空
+        ['丙', 'c', 7, 'B7', 70, pd.NaT],
+        ['丙', 'c', 8, 'B8', 80, pd.NaT],
+        # 分组键为空的行不参与汇总
+        [None, 'a', 11, 'B11', 110, day('2025-01-01')],
+        ['甲', np.nan, 12, 'B12', 120, day('2025-01-01')],
+    ], columns=columns)
+    expected = pd.DataFrame([
+        ['丙', 'c', 7, 'B7', 70, pd.NaT],
+        ['乙', 'x', 9, 'B9', 90, day('2025-01-05')],
+        ['甲', 'a', 1, 'B3', 30, day('2025-01-02')],
+        ['甲', 'b', 5, 'B5', 50, day('2025-01-03')],
+    ], columns=columns)
+
+    cases = []
+    for label, df, result in [('同一日期、无效日期和空分组键', orders, expected),
+                              ('空表', orders.iloc[:0], expected.iloc[:0])]:
+        implementations = {'当前实现': app001.aggregate_latest_orders, '改写前的排序分组': legacy_aggregate_latest_orders}
+        cases.append((label, {'汇总': result},
+                      {name: {'汇总': aggregate(df.copy())} for name, aggregate in implementations.items()}))
+    return cases
+
+
+# 工具名（与 batch.py 的子命令一致） -> 对比设置：
+# - reference：当前实现；candidates：{名称: 其他实现路径}；cases：构造的边界用例，见 match_cases
+# - keys：{表名: 主键列}，按主键对齐后逐列比较；未列出的表按整行匹配
+# - decimals：{列名: 小数位数}，比较前取整
+TOOLS = {
+    'costing': {
+        'reference': costing_outputs,
+        'candidates': {'完整重算': costing_rebuilt},
+        'keys': {'配方成本汇总': ['配方名称'], '缺少价格': ['配方名称', '原材料名称']},
+        'decimals': {'总成本': MONEY, '原材料成本': MONEY},
+    },
+    'match': {
+        'reference': match_outputs,
+        'candidates': {'改写前的排序分组': match_legacy},
+        'cases': match_cases,
+        'keys': {'匹配结果': ['客户名称', '商品名称']},
+    },
+    'inactive': {
+        'reference': inactive_outputs,
+        'candidates': {'流式读取': inactive_streamed, '改写前的排序去重': inactive_legacy},
+        'keys': {'Inactive Products': ['客户名称', '商品名称']},
+    },
+    'mom': {
+        'reference': mom_outputs,
+        'decimals': {'实付金额_期段1': MONEY, '实付金额_期段2': MONEY, '环比增长率': 6},
+    },
+    'missing': {
+        'reference': missing_outputs,
+    },
+    'cycle': {
+        'reference': cycle_outputs,
+        'candidates': {'增量更新': cycle_incremental, '重复并入': cycle_reingested, '改写前的逐组合计算': cycle_legacy},
+        'keys': dict.fromkeys(['平均值', '中位数', 'EWMA', '去极值均值'], ['客户名称', '商品名称']),
+        # 增量更新、逐组合计算时浮点数的累加顺序不同
+        'decimals': {col: 6 for col in ['平均购买周期(天)', 'EWMA购买周期(天)', '去极值平均周期(天)']},
+    },
+    'gmv': {
+        'reference': gmv_outputs,
+        'decimals': {'实付GMV总和值': MONEY, '月平均GMV': MONEY, '目标': MONEY, '月平均GMV合计': MONEY,
+                     '目标GMV合计': MONEY},
+    },
+    'commission': {
+        'reference': commission_outputs,
+        'candidates': {'记录库': commission_store, '记录库分批并入': commission_store_batches,
+                       '改写前的排序去重': commission_legacy_latest, '改写前的商品筛选': commission_legacy_filter},
+        'keys': {'不活跃商品': ['客户名称', '商品名称']},
+    },
+    'incentive': {
+        'reference': incentive_outputs,
+        'candidates': {'改写前的日期解析': incentive_legacy_dates},
+        'keys': {'汇总': ['bd_name']},
+        # 奖金按两位小数展示
+        'decimals': {'奖金': MONEY, '总奖金': MONEY, '存量奖金': MONEY, '增量奖金': MONEY},
+    },
+    'fruit': {
+        'reference': fruit_outputs,
+        'candidates': {'改写前的日期解析': fruit_legacy_dates},
+        'keys': {'BD奖金统计': ['bd_name']},
+        # 奖金在计算时保留两位小数
+        'decimals': {'奖金金额': MONEY, '存量奖金总额': MONEY, '增量奖金总额': MONEY, '共计奖金': MONEY},
+    },
+    'quote': {
+        'reference': quote_outputs,
+        'decimals': {'报价': MONEY, '总计': MONEY, '综合毛利率': 6},
+    },
+}
+
+
+# ================== 对比 ==================
+
+class _Missing:
+    """空值的占位符：NaN、NaT、None 之间视为相同"""
+
+    def __repr__(self):
+        return '空'
+
+
+MISSING = _Missing()
+
+
+def normalize_value(value, decimals=None):
+    if value is None or value is pd.NaT or (isinstance(value, float) and np.isnan(value)) or value is pd.NA:
+        return MISSING
+    if isinstance(value, (np.integer, np.floating, np.bool_)):
+        value = value.item()
+    if decimals is not None and isinstance(value, float):
+        value = round(value, decimals)
+    return value
+
+
+def normalize_frame(df, decimals=None):
+    """每列转为可直接比较的 Python 取值列表：category 取原值，日期统一为 Timestamp，按 decimals 取整"""
+    decimals = decimals or {}
+    columns = {}
+    for col in df.columns:
+        series = df[col]
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            series = series.astype(object)
+        elif pd.api.types.is_datetime64_any_dtype(series):
+            series = series.astype('datetime64[ns]').astype(object)
+        digits = decimals.get(col)
+        columns[col] = [normalize_value(value, digits) for value in series.tolist()]
+    return columns
+
+
+def diff_frames(reference, candidate, keys=None, decimals=None):
+    """
+    对比两张表，返回差异说明的列表（为空表示一致）。
+    keys 为主键列：两边主键都唯一时按主键对齐并逐列比较，否则按整行（多重集合）匹配。
+    """
+    messages = []
+    missing_columns = [col for col in reference.columns if col not in candidate.columns]
+    extra_columns = [col for col in candidate.columns if col not in reference.columns]
+    if missing_columns:
+        messages.append(f"缺少列：{', '.join(map(str, missing_columns))}")
+    if extra_columns:
+        messages.append(f"多出列：{', '.join(map(str, extra_columns))}")
+    if len(reference) != len(candidate):
+        messages.append(f"行数不同：{len(reference)} → {len(candidate)}")
+
+    columns = [col for col in reference.columns if col in candidate.columns]
+    ref_rows = list(zip(*normalize_frame(reference[columns], decimals).values()))
+    cand_rows = list(zip(*normalize_frame(candidate[columns], decimals).values()))
+
+    keys = [col for col in (keys or []) if col in columns]
+    if keys:
+        key_positions = [columns.index(col) for col in keys]
+        ref_keyed = keyed_rows(ref_rows, key_positions)
+        cand_keyed = keyed_rows(cand_rows, key_positions)
+        if ref_keyed is not None and cand_keyed is not None:
+            return messages + diff_keyed(ref_keyed, cand_keyed, columns, keys)
+
+    ref_counts, cand_counts = Counter(ref_rows), Counter(cand_rows)
+    for label, rows in [('只在基准中的行', ref_counts - cand_counts), ('只在对比结果中的行', cand_counts - ref_counts)]:
+        if rows:
+            examples = list(rows.elements())[:MAX_EXAMPLES]
+            messages.append(f"{label}：{sum(rows.values())} 行，例如 " +
+                            '；'.join(format_row(columns, row) for row in examples))
+    return messages
+
+
+def keyed_rows(rows, key_positions):
+    """{主键取值: 整行}；主键不唯一时返回 None"""
+    keyed = {}
+    for row in rows:
+        key = tuple(row[i] for i in key_positions)
+        if key in keyed:
+            return None
+        keyed[key] = row
+    return keyed
+
+
+def diff_keyed(ref_rows, cand_rows, columns, keys):
+    """按主键对齐的两组行：列出只在一边出现的主键，以及每列取值不同的单元格数"""
+    messages = []
+    for label, missing in [('只在基准中的主键', ref_rows.keys() - cand_rows.keys()),
+                           ('只在对比结果中的主键', cand_rows.keys() - ref_rows.keys())]:
+        if missing:
+            examples = sorted(missing, key=repr)[:MAX_EXAMPLES]
+            messages.append(f"{label}：{len(missing)} 个，例如 " + '；'.join(format_row(keys, key) for key in examples))
+
+    common = sorted(ref_rows.keys() & cand_rows.keys(), key=repr)
+    for i, col in enumerate(columns):
+        if col in keys:
+            continue
+        differences = [(key, ref_rows[key][i], cand_rows[key][i]) for key in common
+                       if ref_rows[key][i] != cand_rows[key][i]]
+        if differences:
+            messages.append(f"列 {col}：{len(differences)} 处不同，例如 " + '；'.join(
+                f"{format_row(keys, key)}：{before!r} → {after!r}" for key, before, after in differences[:MAX_EXAMPLES]))
+    return messages
+
+
+def format_row(columns, values):
+    return '(' + ', '.join(f"{col}={value}" for col, value in zip(columns, values)) + ')'
+
+
+def diff_outputs(reference, candidate, spec, partial=False):
+    """
+    对比两组 {表名: 结果表}，返回 [(表名, 差异说明列表)]。
+    partial 为 True 时（其他实现路径）candidate 可以只输出部分表，未输出的表记为跳过。
+    """
+    results = []
+    for name in dict.fromkeys([*reference, *candidate]):
+        if name not in candidate:
+            results.append((name, ['跳过：该实现路径不输出此表'] if partial else ['缺少该表']))
+        elif name not in reference:
+            results.append((name, ['多出该表']))
+        else:
+            results.append((name, diff_frames(reference[name], candidate[name], spec.get('keys', {}).get(name),
+                                              spec.get('decimals'))))
+    return results
+
+
+# ================== 基准结果的保存和读取 ==================
+
+def record(tools, data, directory):
+    """运行当前实现并保存结果，返回 {工具: 出错原因}"""
+    os.makedirs(directory, exist_ok=True)
+    manifest = {'meta': data_meta(data), 'tools': {}}
+    errors = {}
+    for tool in tools:
+        try:
+            outputs = TOOLS[tool]['reference'](data)
+        except ImportError as e:
+            errors[tool] = f"缺少依赖：{e.name}"
+            continue
+        with open(os.path.join(directory, f"{tool}.pkl"), 'wb') as f:
+            pickle.dump(outputs, f)
+        manifest['tools'][tool] = list(outputs)
+    with open(os.path.join(directory, 'manifest.json'), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    return errors
+
+
+def load_manifest(directory):
+    with open(os.path.join(directory, 'manifest.json'), encoding='utf-8') as f:
+        return json.load(f)
+
+
+def load_outputs(directory, tool):
+    with open(os.path.join(directory, f"{tool}.pkl"), 'rb') as f:
+        return pickle.load(f)
+
+
+def data_meta(data):
+    return {'rows': data.rows, 'seed': data.seed, 'format': data.fmt,
+            'created': datetime.now().isoformat(timespec='seconds'), **environment()}
+
+
+# ================== 检查和报告 ==================
+
+def check(tools, data, directory=None):
+    """
+    运行每个工具的当前实现，与基准结果（directory 中保存的）及登记的其他实现路径对比，再检查构造的边界用例。
+    返回报告条目列表：(工具, 对比, 表名, 差异说明列表)；表名为空时差异说明为无法对比的原因。
+    """
+    manifest = load_manifest(directory) if directory else None
+    entries = []
+    for tool in tools:
+        spec = TOOLS[tool]
+        try:
+            current = spec['reference'](data)
+        except ImportError as e:
+            entries.append((tool, '当前实现', '', [f"跳过：缺少依赖 {e.name}"]))
+            continue
+
+        if manifest is not None:
+            if tool in manifest['tools']:
+                for name, messages in diff_outputs(load_outputs(directory, tool), current, spec):
+                    entries.append((tool, '当前实现 vs 基准结果', name, messages))
+            else:
+                entries.append((tool, '当前实现 vs 基准结果', '', ['跳过：基准结果中没有该工具']))
+
+        for label, candidate in spec.get('candidates', {}).items():
+            outputs = candidate(data)
+            if outputs is None:
+                entries.append((tool, f"{label} vs 当前实现", '', ['跳过：不适用于当前数据']))
+                continue
+            for name, messages in diff_outputs(current, outputs, spec, partial=True):
+                entries.append((tool, f"{label} vs 当前实现", name, messages))
+
+        for label, expected, outputs in spec['cases']() if 'cases' in spec else []:
+            for implementation, actual in outputs.items():
+                for name, messages in diff_outputs(expected, actual, spec):
+                    if not messages and name in actual:
+                        messages = diff_order(expected[name], actual[name], spec.get('decimals'))
+                    entries.append((tool, f"用例「{label}」：{implementation} vs 预期", name, messages))
+    return entries
+
+
+def diff_order(reference, candidate, decimals=None):
+    """取值一致的两张表再比较行的顺序"""
+    columns = list(reference.columns)
+    ref_rows = list(zip(*normalize_frame(reference[columns], decimals).values()))
+    cand_rows = list(zip(*normalize_frame(candidate[columns], decimals).values()))
+    return [] if ref_rows == cand_rows else ['行的顺序不同']
+
+
+def is_skipped(messages):
+    return bool(messages) and messages[0].startswith('跳过')
+
+
+def format_report(entries, meta):
+    """Markdown 格式的报告：总表及每个不一致的表的差异明细"""
+    lines = ['# 结果一致性报告', '',
+             f"数据：{meta['rows']} 行模拟订单，种子 {meta['seed']}，{meta['format']} 格式；"
+             f"生成时间 {datetime.now().isoformat(timespec='seconds')}", '',
+             '| 工具 | 对比 | 表 | 结果 |', '| --- | --- | --- | --- |']
+    for tool, comparison, name, messages in entries:
+        status = messages[0] if is_skipped(messages) else ('不一致' if messages else '一致')
+        lines.append(f"| {tool} | {comparison} | {name or '-'} | {status} |")
+
+    for tool, comparison, name, messages in entries:
+        if messages and not is_skipped(messages):
+            lines += ['', f"## {tool}：{comparison} / {name}", '']
+            lines += [f"- {message}" for message in messages]
+    return '\n'.join(lines) + '\n'
+
+
+def main():
+    parser = argparse.ArgumentParser(description="各工具计算结果的一致性检查")
+    commands = parser.add_subparsers(dest='command', required=True)
+    for name, help_text in [('record', "保存当前实现的结果作为基准"), ('check', "与基准结果及其他实现路径对比")]:
+        cmd = commands.add_parser(name, help=help_text)
+        cmd.add_argument('--tools', nargs='+', choices=list(TOOLS), help="只处理指定的工具（默认全部）")
+        cmd.add_argument('--dir', required=name == 'record', help="基准结果目录")
+        cmd.add_argument('--scale', default='10k', help=f"订单行数：{', '.join(SCALES)} 或具体行数（check 时以基准结果为准）")
+        cmd.add_argument('--format', default='csv', choices=['csv', 'xlsx'], help="上传文件的格式")
+        cmd.add_argument('--seed', type=int, default=0, help="模拟数据的随机种子")
+    commands.choices['check'].add_argument('--report', metavar='PATH', help="报告写入文件（Markdown）")
+    args = parser.parse_args()
+
+    # 每次都完整解析，不读取上传文件的磁盘缓存
+    data_loader.UPLOAD_CACHE_DIR = None
+    tools = args.tools or list(TOOLS)
+    try:
+        if args.command == 'check' and args.dir:
+            meta = load_manifest(args.dir)['meta']
+            rows, seed, fmt = meta['rows'], meta['seed'], meta['format']
+        else:
+            rows, seed, fmt = scale_rows(args.scale), args.seed, args.format
+    except (ValueError, OSError) as e:
+        sys.exit(f"错误：{e}")
+    data = BenchData(rows, seed, fmt)
+
+    if args.command == 'record':
+        errors = record(tools, data, args.dir)
+        for tool, error in errors.items():
+            print(f"{tool}：{error}")
+        print(f"已保存 {len(tools) - len(errors)} 个工具的基准结果到 {args.dir}")
+        return
+
+    entries = check(tools, data, args.dir)
+    report = format_report(entries, data_meta(data))
+    print(report)
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8') as f:
+            f.write(report)
+        print(f"已写入 {args.report}")
+    if any(messages and not is_skipped(messages) for *_, messages in entries):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
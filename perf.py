@@ -0,0 +1,188 @@
+import os
+import json
+import time
+import uuid
+import logging
+import functools
+import threading
+import contextvars
+from contextlib import contextmanager
+from datetime import datetime
+from types import SimpleNamespace
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# 各工具共用的性能记录：按阶段（读取文件、日期转换、匹配、分组汇总、导出等）记录耗时、输入/输出行数和常驻内存，
+# 页面底部的“性能”折叠面板显示本次运行的各阶段，同时以 JSON 行追加写入本地日志文件，便于对比不同数据量下的表现。
+# 计算函数中用 stage() 标记阶段即可，没有正在进行的记录时 stage() 不做任何事，命令行和基准测试不受影响。
+
+# 性能日志文件（每行一个阶段的 JSON 记录），设为空字符串时不写日志
+PERF_LOG_FILE = os.environ.get('PERF_LOG_FILE', 'perf_log.jsonl')
+
+# 阶段进行中采样常驻内存的间隔（秒），用于得到每个阶段的内存峰值
+RSS_SAMPLE_INTERVAL = 0.05
+
+MB = 1024 * 1024
+
+# 有 psutil 时用它读取常驻内存，否则读取 /proc（Linux）；都没有时不记录内存
+try:
+    import psutil
+    _process = psutil.Process()
+except ImportError:
+    psutil = None
+
+_current = contextvars.ContextVar('perf_recorder', default=None)
+_log_lock = threading.Lock()
+
+
+def rss_mb():
+    """当前进程的常驻内存（MB），无法获取时返回 None"""
+    if psutil is not None:
+        return _process.memory_info().rss / MB
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / MB
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+class PerfRecorder:
+    """
+    一次运行（一次页面刷新或一次命令行执行）的性能记录，用作上下文管理器：
+    进入后代码中的 stage() 都记录到这里，退出时写入日志文件。
+    嵌套的阶段记录层级，父阶段的耗时包含子阶段。
+    """
+
+    def __init__(self, tool, log_file=None):
+        self.tool = tool
+        self.log_file = PERF_LOG_FILE if log_file is None else log_file
+        self.run_id = uuid.uuid4().hex[:12]
+        self.records = []
+        # 进行中的阶段的内存峰值，由采样线程更新
+        self._open_peaks = []
+        self._stop = threading.Event()
+        self._sampler = None
+        self._token = None
+
+    def __enter__(self):
+        self._token = _current.set(self)
+        if rss_mb() is not None:
+            self._sampler = threading.Thread(target=self._sample, daemon=True)
+            self._sampler.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._stop.set()
+        if self._sampler is not None:
+            self._sampler.join()
+        _current.reset(self._token)
+        self.write_log()
+        return False
+
+    def _sample(self):
+        while not self._stop.wait(RSS_SAMPLE_INTERVAL):
+            rss = rss_mb()
+            for peak in list(self._open_peaks):
+                peak[0] = max(peak[0], rss)
+
+    @contextmanager
+    def stage(self, name, rows_in=None):
+        """
+        记录一个阶段，rows_in 为输入行数；返回的对象可设置 rows_out（输出行数），
+        输入行数事先未知时（如分块读取）也可在阶段内设置 rows_in。阶段出错时记录异常类型后继续抛出。
+        """
+        info = SimpleNamespace(rows_in=rows_in, rows_out=None)
+        record = {'stage': name, 'level': len(self._open_peaks)}
+        # 先占位，记录按阶段开始的顺序排列
+        self.records.append(record)
+        start_rss = rss_mb()
+        peak = [start_rss or 0.0]
+        self._open_peaks.append(peak)
+        start = time.perf_counter()
+        error = None
+        try:
+            yield info
+        except BaseException as e:
+            error = type(e).__name__
+            raise
+        finally:
+            seconds = time.perf_counter() - start
+            end_rss = rss_mb()
+            # 按对象而不是取值移除，取值相同的父阶段不受影响
+            self._open_peaks = [item for item in self._open_peaks if item is not peak]
+            record.update({
+                'seconds': round(seconds, 4),
+                'rows_in': info.rows_in,
+                'rows_out': info.rows_out,
+                'rss_mb': None if end_rss is None else round(end_rss, 1),
+                'peak_rss_mb': None if start_rss is None else round(max(peak[0], end_rss), 1),
+                'peak_delta_mb': None if start_rss is None else round(max(peak[0], end_rss) - start_rss, 1),
+                'error': error,
+            })
+
+    def to_frame(self):
+        """各阶段的记录表（阶段名按层级缩进），用于页面显示"""
+        records = [record for record in self.records if 'seconds' in record]
+        return pd.DataFrame({
+            '阶段': ['　' * record['level'] + record['stage'] for record in records],
+            '耗时(秒)': [record['seconds'] for record in records],
+            '输入行数': pd.array([record['rows_in'] for record in records], dtype='Int64'),
+            '输出行数': pd.array([record['rows_out'] for record in records], dtype='Int64'),
+            '内存(MB)': [record['rss_mb'] for record in records],
+            '峰值内存(MB)': [record['peak_rss_mb'] for record in records],
+            '峰值增加(MB)': [record['peak_delta_mb'] for record in records],
+            '错误': [record['error'] or '' for record in records],
+        })
+
+    def write_log(self):
+        """每个阶段一行 JSON 追加到日志文件；写入失败只记录警告"""
+        if not self.log_file or not self.records:
+            return
+        timestamp = datetime.now().isoformat(timespec='seconds')
+        lines = [json.dumps({'time': timestamp, 'tool': self.tool, 'run_id': self.run_id, **record},
+                            ensure_ascii=False)
+                 for record in self.records if 'seconds' in record]
+        try:
+            with _log_lock, open(self.log_file, 'a', encoding='utf-8') as f:
+                f.write('\n'.join(lines) + '\n')
+        except OSError as e:
+            logger.warning(f"写入性能日志失败: {e}")
+
+
+@contextmanager
+def stage(name, rows_in=None):
+    """在当前的 PerfRecorder 中记录一个阶段；没有正在进行的记录时只执行代码块"""
+    recorder = _current.get()
+    if recorder is None:
+        yield SimpleNamespace(rows_in=rows_in, rows_out=None)
+        return
+    with recorder.stage(name, rows_in) as info:
+        yield info
+
+
+def show_perf(recorder):
+    """在页面上显示“性能”折叠面板"""
+    import streamlit as st
+    if not recorder.records:
+        return
+    with st.expander("性能"):
+        st.dataframe(recorder.to_frame(), hide_index=True, use_container_width=True)
+        st.caption(f"运行编号 {recorder.run_id}" + (f"，已写入 {recorder.log_file}" if recorder.log_file else ""))
+
+
+def instrumented(tool):
+    """
+    装饰页面入口函数：本次运行的各阶段记录到一个 PerfRecorder 中，
+    运行结束后在页面底部显示“性能”面板并写入日志（页面中途 st.stop() 时只写日志）。
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with PerfRecorder(tool) as recorder:
+                result = func(*args, **kwargs)
+            show_perf(recorder)
+            return result
+        return wrapper
+    return decorator